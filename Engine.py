@@ -2,8 +2,70 @@
 # Responsible for determining the valid moves at the current state.
 # Also will keep a move log
 
+from array import array
+
+import evaluation
+import zobrist
+
+#squares reachable from every square, precomputed once so attack queries don't redo the bounds checks
+def _offsetSquares(offsets):
+    return [[tuple((r + dr, c + dc) for dr, dc in offsets if 0 <= r + dr < 8 and 0 <= c + dc < 8)
+             for c in range(8)] for r in range(8)]
+
+def _raySquares(r, c, dr, dc):
+    squares = []
+    r, c = r + dr, c + dc
+    while 0 <= r < 8 and 0 <= c < 8:
+        squares.append((r, c))
+        r, c = r + dr, c + dc
+    return tuple(squares)
+
+KNIGHT_SQUARES = _offsetSquares(((-2,-1), (-2,1), (-1,-2), (-1,2), (1,-2), (1,2), (2,-1), (2,1)))
+KING_SQUARES = _offsetSquares(((-1,-1), (-1,0), (-1,1), (0,-1), (0,1), (1,-1), (1,0), (1,1)))
+RAY_DIRECTIONS = ((-1,0), (0,-1), (1,0), (0,1), (-1,-1), (-1,1), (1,-1), (1,1)) #orthogonal first, then diagonal
+RAYS = [[tuple(_raySquares(r, c, dr, dc) for dr, dc in RAY_DIRECTIONS) for c in range(8)] for r in range(8)]
+SQUARE_TUPLES = [(sq // 8, sq % 8) for sq in range(64)] #shared (row, col) tuples, so make/undo don't build new ones
+
+#castling rights as a 4 bit mask
+CASTLE_WKS = 1
+CASTLE_WQS = 2
+CASTLE_BKS = 4
+CASTLE_BQS = 8
+CASTLING_KEEP = [15] * 64 #rights that survive a move from or to each square: kings and rooks lose theirs
+CASTLING_KEEP[60] = 15 & ~(CASTLE_WKS | CASTLE_WQS) #e1
+CASTLING_KEEP[63] = 15 & ~CASTLE_WKS #h1
+CASTLING_KEEP[56] = 15 & ~CASTLE_WQS #a1
+CASTLING_KEEP[4] = 15 & ~(CASTLE_BKS | CASTLE_BQS) #e8
+CASTLING_KEEP[7] = 15 & ~CASTLE_BKS #h8
+CASTLING_KEEP[0] = 15 & ~CASTLE_BQS #a8
+
+#Undo records: four 64 bit words per ply in one flat array('Q'), for the position after that many moves.
+#The first word is the zobrist key, the second packs
+#   bits 0-3   castling rights
+#   bits 4-7   en passant file + 1, 0 for none
+#   bits 8-11  piece captured by the move that led here (an index into MOVE_PIECES)
+#   bits 12-27 halfmove clock
+#   bits 28-35 game phase
+#the third is the pawn key and the fourth the packed evaluation score, as an unsigned 64 bit word.
+#The array doubles when a game outgrows it, so making and undoing moves never builds per move objects
+UNDO_RECORD_WORDS = 4
+UNDO_STACK_PLIES = 512 #initial size, 16 KiB
+WORD_MASK = (1 << 64) - 1
+
+
 class GameState():
-    def __init__(self):
+    BACKENDS = ('mailbox', 'bitboard')
+
+    #GameState(backend='bitboard') builds the bitboard subclass, everything else about the API stays the same
+    def __new__(cls, legalMoveGen=True, backend='mailbox', fen=None):
+        if backend not in cls.BACKENDS:
+            raise ValueError("unknown backend %r, expected one of %s" % (backend, ", ".join(cls.BACKENDS)))
+        if backend == 'bitboard' and cls is GameState:
+            import bitboard #imported here since the bitboard module builds on this one
+            cls = bitboard.BitboardGameState
+        return super().__new__(cls)
+
+    def __init__(self, legalMoveGen=True, backend='mailbox', fen=None):
         self.board = [
             ["bR","bN","bB","bQ","bK","bB","bN","bR"],
             ["bp","bp","bp","bp","bp","bp","bp","bp"],
@@ -14,161 +76,375 @@ class GameState():
             ["wp","wp","wp","wp","wp","wp","wp","wp"],
             ["wR","wN","wB","wQ","wK","wB","wN","wR"],
         ]
+        self.backend = backend
+        self.startFen = None #FEN the game started from, None for the normal starting position
         self.moveFunctions = {'p': self.getPawnMoves, 'R': self.getRookMoves, 'N': self.getKnightMoves,
                               'B': self.getBishopMoves, 'Q': self.getQueenMoves, 'K': self.getKingMoves} #Done for redundancy purpose
         self.whiteToMove = True
         self.moveLog = []
         self.whiteKingLocation = (7, 4)
         self.blackKingLocation = (0, 4)
+        self.legalMoveGen = legalMoveGen #False falls back to the make/undo filter so the two generators can be cross-checked
+        self.pins = [] #(row, col, dirRow, dirCol) for every ally piece pinned to the king
+        self.checks = [] #(row, col, dirRow, dirCol) for every enemy piece giving check
+        self.checkMate = False
+        self.staleMate = False
+        self.enpassantPossible = () # coordinates for the square where an en passant is possible
+        self.castlingRights = CASTLE_WKS | CASTLE_WQS | CASTLE_BKS | CASTLE_BQS
+        self.halfmoveClock = 0 #plies since the last capture or pawn move
+        self.startPly = 0 #plies played before the start position, from the FEN move number
+
+        #zobrist key of the current position, kept up to date by makeMove; undoMove takes it from the undo stack
+        self.zobristKey = zobrist.computeKey(self)
+        #material + piece-square score, game phase and pawn only hash for evaluation, kept up to date the same way
+        self.pstScore, self.gamePhase, self.pawnKey = evaluation.computeScores(self)
+        self.undoStack = array('Q', [0]) * (UNDO_RECORD_WORDS * UNDO_STACK_PLIES)
+        self.storeUndoRecord(0, 0)
+        self.repetitionCounts = {self.zobristKey: 1} #times each key appears on the undo stack
+
+        if fen is not None:
+            self.loadFen(fen)
+
+    #set up the position from a FEN string: piece placement, side to move, castling rights, en passant square and
+    #the move counters when they are there (EPD style four field strings work too)
+    def loadFen(self, fen):
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("FEN needs at least 4 fields: %r" % fen)
+        rows = fields[0].split('/')
+        if len(rows) != 8:
+            raise ValueError("FEN board needs 8 ranks: %r" % fen)
+        board = []
+        for row in rows:
+            boardRow = []
+            for char in row:
+                if char.isdigit():
+                    boardRow.extend(["--"] * int(char))
+                elif char.upper() in 'PNBRQK':
+                    boardRow.append(('w' if char.isupper() else 'b') + ('p' if char in 'Pp' else char.upper()))
+                else:
+                    raise ValueError("bad piece %r in FEN %r" % (char, fen))
+            if len(boardRow) != 8:
+                raise ValueError("FEN rank %r doesn't have 8 squares" % row)
+            board.append(boardRow)
+        if fields[1] not in ('w', 'b'):
+            raise ValueError("bad side to move in FEN %r" % fen)
+        for king in ('wK', 'bK'):
+            if sum(row.count(king) for row in board) != 1:
+                raise ValueError("FEN needs one king per side: %r" % fen)
+        enpassant = fields[3]
+        if enpassant != '-' and (len(enpassant) != 2 or enpassant[0] not in 'abcdefgh' or
+                                 enpassant[1] != ('6' if fields[1] == 'w' else '3')):
+            raise ValueError("bad en passant square %r in FEN %r" % (enpassant, fen))
+
+        self.board = board
+        self.startFen = fen
+        self.whiteToMove = fields[1] == 'w'
+        for r in range(8):
+            for c in range(8):
+                if board[r][c] == 'wK':
+                    self.whiteKingLocation = (r, c)
+                elif board[r][c] == 'bK':
+                    self.blackKingLocation = (r, c)
+        #a right only counts with its king and rook still at home, whatever the FEN says
+        self.castlingRights = 0
+        for char, right, row, rookCol in (('K', CASTLE_WKS, 7, 7), ('Q', CASTLE_WQS, 7, 0),
+                                          ('k', CASTLE_BKS, 0, 7), ('q', CASTLE_BQS, 0, 0)):
+            color = 'w' if row == 7 else 'b'
+            if char in fields[2] and board[row][4] == color + 'K' and board[row][rookCol] == color + 'R':
+                self.castlingRights |= right
+        if enpassant == '-':
+            self.enpassantPossible = ()
+        else:
+            self.enpassantPossible = (Move.ranksToRows[enpassant[1]], Move.filesToCols[enpassant[0]])
+        self.halfmoveClock = int(fields[4]) if len(fields) > 4 and fields[4].isdigit() else 0
+        fullmoveNumber = int(fields[5]) if len(fields) > 5 and fields[5].isdigit() else 1
+        self.startPly = 2 * (max(fullmoveNumber, 1) - 1) + (not self.whiteToMove)
+        self.moveLog = []
         self.pins = []
         self.checks = []
         self.checkMate = False
         self.staleMate = False
-        self.enpassantPossible = () # coordinates for the square where an en passant is possible
-        self.enpassantPossibleLog = [self.enpassantPossible]
-        
-        #castling rights
-        self.currentCastlingRight = CastleRights(True, True, True, True)
-        self.castleRightsLog = [CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks, 
-                                             self.currentCastlingRight.wqs, self.currentCastlingRight.bqs)]
+        self.zobristKey = zobrist.computeKey(self)
+        self.pstScore, self.gamePhase, self.pawnKey = evaluation.computeScores(self)
+        self.storeUndoRecord(0, 0)
+        self.repetitionCounts = {self.zobristKey: 1}
        
+    #FEN string of the current position, with the move counters
+    def getFen(self):
+        rows = []
+        for row in self.board:
+            text = ''
+            empty = 0
+            for piece in row:
+                if piece == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                text += piece[1].upper() if piece[0] == 'w' else piece[1].lower()
+            rows.append(text + (str(empty) if empty else ''))
+        castling = ''.join(char for char, right in (('K', CASTLE_WKS), ('Q', CASTLE_WQS), ('k', CASTLE_BKS), ('q', CASTLE_BQS))
+                           if self.castlingRights & right) or '-'
+        if self.enpassantPossible:
+            enpassant = SQUARE_NAMES[self.enpassantPossible[0] * 8 + self.enpassantPossible[1]]
+        else:
+            enpassant = '-'
+        fullmoveNumber = (self.startPly + len(self.moveLog)) // 2 + 1
+        return "%s %s %s %s %d %d" % ('/'.join(rows), 'w' if self.whiteToMove else 'b', castling, enpassant,
+                                      self.halfmoveClock, fullmoveNumber)
+
     #make the move that is passed as a parameter
     def makeMove(self, move):
-        self.board[move.startRow][move.startCol] = "--" #when a piece moves, it leaves a blank space behind
-        self.board[move.endRow][move.endCol] = move.pieceMoved #icon to shift to its destination square
+        packed = move.packed #the fields are decoded once here rather than through the Move properties
+        fromSq = packed & 63
+        toSq = (packed >> 6) & 63
+        startRow, startCol, endRow, endCol = fromSq >> 3, fromSq & 7, toSq >> 3, toSq & 7
+        pieceMoved = MOVE_PIECES[(packed >> 17) & 15]
+        pieceCaptured = MOVE_PIECES[packed >> 21]
+        board = self.board
+        previousEnpassant = self.enpassantPossible
+        previousCastling = self.castlingRights
+        board[startRow][startCol] = "--" #when a piece moves, it leaves a blank space behind
+        board[endRow][endCol] = pieceMoved #icon to shift to its destination square
         self.moveLog.append(move) #log the move so we can undo or for review later
         self.whiteToMove = not self.whiteToMove #swaps players
         
         #update the king's location if updated
-        if move.pieceMoved == 'wK':
-            self.whiteKingLocation = (move.endRow, move.endCol)
-        elif move.pieceMoved == 'bK':
-            self.blackKingLocation = (move.endRow, move.endCol)
+        if pieceMoved == 'wK':
+            self.whiteKingLocation = SQUARE_TUPLES[toSq]
+        elif pieceMoved == 'bK':
+            self.blackKingLocation = SQUARE_TUPLES[toSq]
 
         #pawn promotion
-        if move.pawnPromotion:
-            self.board[move.endRow][move.endCol] = move.pieceMoved[0] + 'Q'
+        if packed & MOVE_PROMOTION:
+            board[endRow][endCol] = pieceMoved[0] + Move.promotionPieces[(packed >> 12) & 3]
 
         #enpassant move
-        if move.enpassant:
-            self.board[move.startRow][move.endCol] = '--' #capturing the pawn
+        if packed & MOVE_ENPASSANT:
+            board[startRow][endCol] = '--' #capturing the pawn
 
         #update enpassantPossible variable
-        if move.pieceMoved[1] == 'p' and abs(move.startRow - move.endRow) == 2: #only on 2 square advance of pawn
-            self.enpassantPossible = ((move.startRow + move.endRow)//2, move.endCol)
+        if pieceMoved[1] == 'p' and abs(startRow - endRow) == 2: #only on 2 square advance of pawn
+            self.enpassantPossible = SQUARE_TUPLES[(fromSq + toSq) // 2]
         else:
             self.enpassantPossible = ()
 
         #castle moves
-        if move.isCastleMove:
-            if move.endCol - move.startCol == 2: #kingside castle move
-                self.board[move.endRow][move.endCol-1] = self.board[move.endRow][move.endCol+1] #moves the rook
-                self.board[move.endRow][move.endCol+1] = '--' #empty space where the rook was
+        if packed & MOVE_CASTLE:
+            if endCol - startCol == 2: #kingside castle move
+                board[endRow][endCol-1] = board[endRow][endCol+1] #moves the rook
+                board[endRow][endCol+1] = '--' #empty space where the rook was
             else: #queenside castle move
-                self.board[move.endRow][move.endCol+1] = self.board[move.endRow][move.endCol-2] #moves the rook
-                self.board[move.endRow][move.endCol-2] = '--' #empty space where the rook was
+                board[endRow][endCol+1] = board[endRow][endCol-2] #moves the rook
+                board[endRow][endCol-2] = '--' #empty space where the rook was
 
-        self.enpassantPossibleLog.append(self.enpassantPossible)
-        
-        #updating castling rights -whenever it is a king or rook move
-        self.updateCastleRights(move)
-        self.castleRightsLog.append(CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks, 
-                                                self.currentCastlingRight.wqs, self.currentCastlingRight.bqs))
+        #updating castling rights -whenever a king or rook moves or a rook is captured
+        castling = previousCastling & CASTLING_KEEP[fromSq] & CASTLING_KEEP[toSq]
+        self.castlingRights = castling
+
+        if pieceMoved[1] == 'p' or pieceCaptured != '--':
+            self.halfmoveClock = 0
+        else:
+            self.halfmoveClock += 1
+
+        #zobrist key and evaluation terms: take out what the move changed and put in the new state
+        pieceKeys = zobrist.PIECE_KEYS
+        pst = evaluation.PST
+        pieceArrived = board[endRow][endCol] #the promoted piece when promoting
+        capturedSq = startRow * 8 + endCol if packed & MOVE_ENPASSANT else toSq
+        key = self.zobristKey ^ zobrist.SIDE_KEY
+        key ^= pieceKeys[pieceMoved][fromSq] ^ pieceKeys[pieceArrived][toSq] ^ pieceKeys[pieceCaptured][capturedSq]
+        score = self.pstScore - pst[pieceMoved][fromSq] + pst[pieceArrived][toSq] - pst[pieceCaptured][capturedSq]
+        if pieceCaptured != '--':
+            self.gamePhase -= evaluation.PHASE_WEIGHTS[pieceCaptured]
+            if pieceCaptured[1] == 'p':
+                self.pawnKey ^= pieceKeys[pieceCaptured][capturedSq]
+        if pieceMoved[1] == 'p':
+            self.pawnKey ^= pieceKeys[pieceMoved][fromSq]
+            if packed & MOVE_PROMOTION:
+                self.gamePhase += evaluation.PHASE_WEIGHTS[pieceArrived]
+            else:
+                self.pawnKey ^= pieceKeys[pieceMoved][toSq]
+        if packed & MOVE_CASTLE:
+            rook = pieceMoved[0] + 'R'
+            if endCol - startCol == 2: #kingside
+                rookFrom, rookTo = toSq + 1, toSq - 1
+            else: #queenside
+                rookFrom, rookTo = toSq - 2, toSq + 1
+            key ^= pieceKeys[rook][rookFrom] ^ pieceKeys[rook][rookTo]
+            score += pst[rook][rookTo] - pst[rook][rookFrom]
+        self.pstScore = score
+        if previousEnpassant:
+            key ^= zobrist.ENPASSANT_KEYS[previousEnpassant[1]]
+        if self.enpassantPossible:
+            key ^= zobrist.ENPASSANT_KEYS[self.enpassantPossible[1]]
+        if castling != previousCastling:
+            key ^= zobrist.CASTLING_KEYS[previousCastling] ^ zobrist.CASTLING_KEYS[castling]
+        self.zobristKey = key
+        self.storeUndoRecord(len(self.moveLog), packed >> 21)
+        self.repetitionCounts[key] = self.repetitionCounts.get(key, 0) + 1
+
+    #write the undo record for the current position, reached after ply moves, growing the stack if needed
+    def storeUndoRecord(self, ply, capturedIndex):
+        stack = self.undoStack
+        index = ply * UNDO_RECORD_WORDS
+        if index + UNDO_RECORD_WORDS > len(stack):
+            stack.extend(stack) #double it, the old records stay where they are
+        stack[index] = self.zobristKey
+        stack[index + 1] = self.castlingRights | ((self.enpassantPossible[1] + 1 if self.enpassantPossible else 0) << 4) | \
+            (capturedIndex << 8) | (self.halfmoveClock << 12) | (self.gamePhase << 28)
+        stack[index + 2] = self.pawnKey
+        stack[index + 3] = self.pstScore & WORD_MASK
         
+    #castling rights, en passant square, halfmove clock, key and evaluation terms back from the undo record at
+    #index, once whiteToMove is the side to move there again
+    def restoreUndoRecord(self, index):
+        stack = self.undoStack
+        count = self.repetitionCounts[self.zobristKey]
+        if count == 1:
+            del self.repetitionCounts[self.zobristKey]
+        else:
+            self.repetitionCounts[self.zobristKey] = count - 1
+        self.zobristKey = stack[index]
+        state = stack[index + 1]
+        self.castlingRights = state & 15
+        enpassantFile = (state >> 4) & 15
+        if enpassantFile:
+            self.enpassantPossible = SQUARE_TUPLES[(16 if self.whiteToMove else 40) + enpassantFile - 1] #row 2 or 5
+        else:
+            self.enpassantPossible = ()
+        self.halfmoveClock = (state >> 12) & 0xFFFF
+        self.gamePhase = state >> 28
+        self.pawnKey = stack[index + 2]
+        score = stack[index + 3]
+        self.pstScore = score - (1 << 64) if score >> 63 else score
+
     #to undo moves
     def undoMove(self):
         if len(self.moveLog) != 0: #Makes sure that there is a move to undo
             move = self.moveLog.pop()
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
+            packed = move.packed
+            startRow, startCol, endRow, endCol = (packed >> 3) & 7, packed & 7, (packed >> 9) & 7, (packed >> 6) & 7
+            pieceMoved = MOVE_PIECES[(packed >> 17) & 15]
+            stack = self.undoStack
+            index = len(self.moveLog) * UNDO_RECORD_WORDS #the record of the position we go back to
+            pieceCaptured = MOVE_PIECES[(stack[index + UNDO_RECORD_WORDS + 1] >> 8) & 15]
+            board = self.board
+            board[startRow][startCol] = pieceMoved
+            board[endRow][endCol] = pieceCaptured
             self.whiteToMove = not self.whiteToMove #switches turns back
             #update the king's location if needed
-            if move.pieceMoved == 'wK':
-                self.whiteKingLocation = (move.startRow, move.startCol)
-            elif move.pieceMoved == 'bK':
-                self.blackKingLocation = (move.startRow, move.startCol)
+            if pieceMoved == 'wK':
+                self.whiteKingLocation = SQUARE_TUPLES[packed & 63]
+            elif pieceMoved == 'bK':
+                self.blackKingLocation = SQUARE_TUPLES[packed & 63]
 
             #undo en passant
-            if move.enpassant:
-                self.board[move.endRow][move.endCol] = '--' #removes the pawn that was added in the wrong square
-                self.board[move.startRow][move.endCol] = move.pieceCaptured #puts the pawn back on the correct square it was captured from
+            if packed & MOVE_ENPASSANT:
+                board[endRow][endCol] = '--' #removes the pawn that was added in the wrong square
+                board[startRow][endCol] = pieceCaptured #puts the pawn back on the correct square it was captured from
     
 
-            self.enpassantPossibleLog.pop()
-            self.enpassantPossible = self.enpassantPossibleLog[-1]
-
-            #undo castling rights
-            self.castleRightsLog.pop() #get rid of the new castle rights from the move we are undoing
-            newRights = self.castleRightsLog[-1]
-            self.currentCastlingRight = CastleRights(newRights.wks, newRights.bks, newRights.wqs, newRights.bqs)
+            self.restoreUndoRecord(index)
 
             #undo castle move
-            if move.isCastleMove:
-                if move.endCol - move.startCol == 2: #kingside 
-                    self.board[move.endRow][move.endCol+1] = self.board[move.endRow][move.endCol-1] 
-                    self.board[move.endRow][move.endCol-1] = '--' 
+            if packed & MOVE_CASTLE:
+                if endCol - startCol == 2: #kingside 
+                    board[endRow][endCol+1] = board[endRow][endCol-1] 
+                    board[endRow][endCol-1] = '--' 
                 else: #queenside
-                    self.board[move.endRow][move.endCol-2] = self.board[move.endRow][move.endCol+1] 
-                    self.board[move.endRow][move.endCol+1] = '--'
+                    board[endRow][endCol-2] = board[endRow][endCol+1] 
+                    board[endRow][endCol+1] = '--'
     
 
             self.checkMate = False
             self.staleMate = False
 
-    
-    #Updating castling rights as per move
-    def updateCastleRights(self, move):
-        if move.pieceMoved == 'wK':
-            self.currentCastlingRight.wks = False
-            self.currentCastlingRight.wqs = False
-        elif move.pieceMoved == 'bK':
-            self.currentCastlingRight.bks = False
-            self.currentCastlingRight.bqs = False
-        elif move.pieceMoved == 'wR':
-            if move.startRow == 7:
-                if move.startCol == 0: #left rook
-                    self.currentCastlingRight.wqs = False
-                elif move.startCol == 7: #right rook
-                    self.currentCastlingRight.wks = False
-        elif move.pieceMoved == 'bR':
-            if move.startRow == 0:
-                if move.startCol == 0: #left rook
-                    self.currentCastlingRight.bqs = False
-                elif move.startCol == 7: #right rook
-                    self.currentCastlingRight.bks = False
-
-        #if it's the rook being captured
-        if move.pieceCaptured == 'wR':
-            if move.endRow == 7:
-                if move.endCol == 0: #left rook
-                    self.currentCastlingRight.wqs = False
-                elif move.endCol == 7: #right rook
-                    self.currentCastlingRight.wks = False
-        elif move.pieceCaptured == 'bR':
-            if move.endRow == 0:
-                if move.endCol == 0: #left rook
-                    self.currentCastlingRight.bqs = False
-                elif move.endCol == 7: #right rook
-                    self.currentCastlingRight.bks = False
+    #how many times the current position has appeared, counting this occurrence. O(1) through repetitionCounts
+    def repetitionCount(self):
+        return self.repetitionCounts.get(self.zobristKey, 0)
 
+    def isThreefoldRepetition(self):
+        return self.repetitionCount() >= 3
+
+    #len(getValidMoves()), for callers that only count, like perft at its last ply. The bitboard backend
+    #counts without building the moves
+    def countValidMoves(self):
+        return len(self.getValidMoves())
 
     #all moves considering checks
     def getValidMoves(self):
+        if not self.legalMoveGen:
+            return self.getValidMovesLegacy()
+        if self.whiteToMove:
+            kingRow, kingCol = self.whiteKingLocation
+        else:
+            kingRow, kingCol = self.blackKingLocation
+        inCheck, self.pins, self.checks = self.checkForPinsAndChecks(kingRow, kingCol)
+        if inCheck:
+            if len(self.checks) == 1: #single check: capture the checker, block the ray or move the king
+                moves = self.getAllPossibleMoves()
+                checkRow, checkCol, dirRow, dirCol = self.checks[0]
+                if self.board[checkRow][checkCol][1] == 'N': #knight checks can't be blocked
+                    validSquares = {(checkRow, checkCol)}
+                else:
+                    validSquares = set()
+                    for i in range(1, 8):
+                        square = (kingRow + dirRow * i, kingCol + dirCol * i)
+                        validSquares.add(square)
+                        if square == (checkRow, checkCol): #stop once we reach the checking piece
+                            break
+                for i in range(len(moves)-1, -1, -1):
+                    packed = moves[i].packed
+                    if MOVE_PIECES[(packed >> 17) & 15][1] == 'K':
+                        continue #king moves are filtered below
+                    if ((packed >> 9) & 7, (packed >> 6) & 7) in validSquares:
+                        continue
+                    if packed & MOVE_ENPASSANT and ((packed >> 3) & 7, (packed >> 6) & 7) == (checkRow, checkCol):
+                        continue #en passant capturing the pawn that gives check
+                    moves.pop(i)
+            else: #double check: the king has to move
+                moves = []
+                self.getKingMoves(kingRow, kingCol, moves)
+        else:
+            moves = self.getAllPossibleMoves()
+            self.getCastleMoves(kingRow, kingCol, moves)
+
+        #king moves: the destination must not be attacked once the king has left its square
+        king = self.board[kingRow][kingCol]
+        self.board[kingRow][kingCol] = '--' #lift the king so sliders see through its old square
+        kingIndex = MOVE_PIECE_INDEX[king]
+        for i in range(len(moves)-1, -1, -1):
+            packed = moves[i].packed
+            if (packed >> 17) & 15 == kingIndex and not packed & MOVE_CASTLE:
+                if self.getAttackers((packed >> 9) & 7, (packed >> 6) & 7, not self.whiteToMove):
+                    moves.pop(i)
+        self.board[kingRow][kingCol] = king
+        self.pins = [] #pins only hold during generation, stale ones would restrict pseudo legal callers
+
+        self.checkMate = len(moves) == 0 and inCheck
+        self.staleMate = len(moves) == 0 and not inCheck
+        return moves
+
+    #all moves considering checks, found by making every pseudo legal move and looking for attacks on the king.
+    #Much slower than getValidMoves, kept to cross-check the pin/check aware generator
+    def getValidMovesLegacy(self):
         tempEnpassantPossible = self.enpassantPossible
-        tempCastleRights = CastleRights(self.currentCastlingRight.wks, self.currentCastlingRight.bks, 
-                                        self.currentCastlingRight.wqs, self.currentCastlingRight.bqs) #copy the current castling rights
+        tempCastleRights = self.castlingRights
+        self.pins = []
+        self.checks = []
         #1) generate all possible moves
         moves = self.getAllPossibleMoves()
        
         #2)  for each move, make the move
         for i in range(len(moves)-1, -1, -1): #when removing from a list go backwards though that list
             self.makeMove(moves[i])
-            #3) generate all opponent's moves
-            oppMoves = self.getAllPossibleMoves()
-            #4) for each of the opponent's moves, see if they attack the king
+            #3) see if the opponent attacks the king
             self.whiteToMove = not self.whiteToMove
             if self.inCheck():
-                moves.remove(moves[i]) #5)if they do not attack your king, not a valid move
+                moves.remove(moves[i]) #4)if they do, not a valid move
             self.whiteToMove = not self.whiteToMove
             self.undoMove()
         if len(moves) == 0: #either checkmate or stalemate
@@ -182,10 +458,86 @@ class GameState():
         else:
             self.getCastleMoves(self.blackKingLocation[0], self.blackKingLocation[1], moves)
         self.enpassantPossible = tempEnpassantPossible
-        self.currentCastlingRight = tempCastleRights
+        self.castlingRights = tempCastleRights
         return moves
 
-    
+    #Scan outwards from square r, c (normally the king) for enemy pieces.
+    #Returns if the square is attacked, the ally pieces pinned to it and the enemy pieces checking it.
+    #The ally king itself is looked through, so this also answers if the king can safely step onto r, c
+    def checkForPinsAndChecks(self, r, c):
+        pins = []
+        checks = []
+        inCheck = False
+        if self.whiteToMove:
+            enemyColor, allyColor = 'b', 'w'
+        else:
+            enemyColor, allyColor = 'w', 'b'
+        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+        for j in range(8):
+            d = directions[j]
+            possiblePin = ()
+            for i in range(1, 8):
+                endRow = r + d[0] * i
+                endCol = c + d[1] * i
+                if not (0 <= endRow < 8 and 0 <= endCol < 8): #off board
+                    break
+                endPiece = self.board[endRow][endCol]
+                if endPiece[0] == allyColor and endPiece[1] != 'K':
+                    if possiblePin == (): #first ally piece could be pinned
+                        possiblePin = (endRow, endCol, d[0], d[1])
+                    else: #second ally piece, so no pin or check in this direction
+                        break
+                elif endPiece[0] == enemyColor:
+                    pieceType = endPiece[1]
+                    #1) orthogonally away from the square and the piece is a rook
+                    #2) diagonally away from the square and the piece is a bishop
+                    #3) 1 square away diagonally and the piece is a pawn attacking the square
+                    #4) any direction and the piece is a queen
+                    #5) any direction 1 square away and the piece is a king
+                    if (0 <= j <= 3 and pieceType == 'R') or \
+                            (4 <= j <= 7 and pieceType == 'B') or \
+                            (i == 1 and pieceType == 'p' and ((enemyColor == 'w' and 6 <= j <= 7) or (enemyColor == 'b' and 4 <= j <= 5))) or \
+                            (pieceType == 'Q') or (i == 1 and pieceType == 'K'):
+                        if possiblePin == (): #no piece blocking, so check
+                            inCheck = True
+                            checks.append((endRow, endCol, d[0], d[1]))
+                        else: #ally piece blocking, so pin
+                            pins.append(possiblePin)
+                    break #enemy piece blocks everything behind it
+        #knight checks
+        knightMoves = ((-2,-1), (-2,1), (-1,-2), (-1,2), (1,-2), (1,2), (2,-1), (2,1))
+        for m in knightMoves:
+            endRow = r + m[0]
+            endCol = c + m[1]
+            if 0 <= endRow < 8 and 0 <= endCol < 8:
+                endPiece = self.board[endRow][endCol]
+                if endPiece[0] == enemyColor and endPiece[1] == 'N':
+                    inCheck = True
+                    checks.append((endRow, endCol, m[0], m[1]))
+        return inCheck, pins, checks
+
+    #returns the pin direction of the piece at r, c, or None if it isn't pinned
+    def getPinDirection(self, r, c):
+        for pin in self.pins:
+            if pin[0] == r and pin[1] == c:
+                return (pin[2], pin[3])
+        return None
+
+    #an en passant capture removes two pawns from the same rank, which pins can't describe.
+    #Play it out on the board and look for attacks on the king
+    def enpassantIsSafe(self, r, c, endRow, endCol):
+        ally = self.board[r][c]
+        captured = self.board[r][endCol]
+        self.board[r][c] = '--'
+        self.board[r][endCol] = '--'
+        self.board[endRow][endCol] = ally
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        safe = not self.checkForPinsAndChecks(kingRow, kingCol)[0]
+        self.board[endRow][endCol] = '--'
+        self.board[r][endCol] = captured
+        self.board[r][c] = ally
+        return safe
+
     #determine if the player is in check
     def inCheck(self):
         if self.whiteToMove:
@@ -195,6 +547,45 @@ class GameState():
 
     #determine if the enemy can attack square r, c
     def squareUnderAttack(self, r, c):
+        if not self.legalMoveGen:
+            return self.squareUnderAttackLegacy(r, c)
+        return self.getAttackers(r, c, not self.whiteToMove) != 0
+
+    #number of pieces of the given side attacking square r, c
+    def attackerCount(self, r, c, byWhite):
+        return bin(self.getAttackers(r, c, byWhite)).count('1')
+
+    #bitmask (bit row*8 + col) of the pieces of the given side attacking square r, c.
+    #Scans outwards from the square: knight and king offsets, pawn diagonals and sliding rays up to the first blocker
+    def getAttackers(self, r, c, byWhite):
+        board = self.board
+        color = 'w' if byWhite else 'b'
+        attackers = 0
+        for endRow, endCol in KNIGHT_SQUARES[r][c]:
+            if board[endRow][endCol] == color + 'N':
+                attackers |= 1 << (endRow * 8 + endCol)
+        for endRow, endCol in KING_SQUARES[r][c]:
+            if board[endRow][endCol] == color + 'K':
+                attackers |= 1 << (endRow * 8 + endCol)
+        pawnRow = r + 1 if byWhite else r - 1 #white pawns attack upwards, black pawns downwards
+        if 0 <= pawnRow < 8:
+            for pawnCol in (c - 1, c + 1):
+                if 0 <= pawnCol < 8 and board[pawnRow][pawnCol] == color + 'p':
+                    attackers |= 1 << (pawnRow * 8 + pawnCol)
+        rays = RAYS[r][c]
+        for j in range(8):
+            for endRow, endCol in rays[j]:
+                endPiece = board[endRow][endCol]
+                if endPiece == '--':
+                    continue
+                if endPiece[0] == color and (endPiece[1] == 'Q' or endPiece[1] == ('R' if j < 4 else 'B')):
+                    attackers |= 1 << (endRow * 8 + endCol)
+                break #first piece on the ray blocks the rest
+        return attackers
+
+    #determine if the enemy can attack square r, c by generating all of its moves.
+    #Kept for the legacy generator, getAttackers gives the same answer without building Move objects
+    def squareUnderAttackLegacy(self, r, c):
         self.whiteToMove = not self.whiteToMove #switch to opponent's turn
         oppMoves = self.getAllPossibleMoves()
         self.whiteToMove = not self.whiteToMove #switch turn's back
@@ -215,114 +606,188 @@ class GameState():
                     self.moveFunctions[piece](r, c, moves) #calls the appropriate move function based on piece type
         return moves
 
-    # Get all the moves possible for pawn at it's row,col and add the moves to the list
-    def getPawnMoves(self, r, c, moves):
+    #Staged generation for the search: captures and quiet moves are produced separately, and only pseudo legal,
+    #so a node that cuts off early never builds the rest. Each move is checked with movedIntoCheck once made.
+
+    #captures, en passant and promotions (to every piece) of the side to move. Found from the victims' side
+    #with getAttackers, so no quiet move is generated on the way
+    def getCaptureMoves(self):
+        board = self.board
+        byWhite = self.whiteToMove
+        ally, enemy = ('w', 'b') if byWhite else ('b', 'w')
+        promotionRow = 0 if byWhite else 7
+        moves = []
+        for r in range(8):
+            row = board[r]
+            for c in range(8):
+                victim = row[c]
+                if victim[0] != enemy or victim[1] == 'K':
+                    continue
+                attackers = self.getAttackers(r, c, byWhite)
+                while attackers:
+                    low = attackers & -attackers
+                    attackers ^= low
+                    fromSq = low.bit_length() - 1
+                    piece = board[fromSq >> 3][fromSq & 7]
+                    if r == promotionRow and piece[1] == 'p':
+                        self.addPawnMove(SQUARE_TUPLES[fromSq], (r, c), moves)
+                    else:
+                        moves.append(Move.fromPacked(fromSq | ((r*8 + c) << 6) | (MOVE_PIECE_INDEX[piece] << 17) |
+                                                     (MOVE_PIECE_INDEX[victim] << 21)))
+        pawn = ally + 'p'
+        pawnRow, step = (1, -1) if byWhite else (6, 1)
+        for c in range(8): #promotions straight ahead
+            if board[pawnRow][c] == pawn and board[pawnRow + step][c] == '--':
+                self.addPawnMove((pawnRow, c), (pawnRow + step, c), moves)
+        if self.enpassantPossible:
+            epRow, epCol = self.enpassantPossible
+            for fromCol in (epCol - 1, epCol + 1):
+                if 0 <= fromCol < 8 and board[epRow - step][fromCol] == pawn:
+                    moves.append(Move((epRow - step, fromCol), (epRow, epCol), board, enpassant=True))
+        return moves
+
+    #every move getCaptureMoves leaves out, castling included: the piece generators only go to empty squares
+    def getQuietMoves(self):
+        moves = []
+        ally = 'w' if self.whiteToMove else 'b'
+        for r in range(8):
+            row = self.board[r]
+            for c in range(8):
+                if row[c][0] == ally:
+                    self.moveFunctions[row[c][1]](r, c, moves, True)
+        kingRow, kingCol = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        self.getCastleMoves(kingRow, kingCol, moves)
+        return moves
+
+    #the move with this compact id if the piece on its start square can make it here, else None. For moves
+    #remembered from other positions, the hash move and killers, without generating the whole list
+    def pseudoLegalMove(self, compactID):
+        r, c = SQUARE_TUPLES[compactID & 63]
+        piece = self.board[r][c]
+        if piece[0] != ('w' if self.whiteToMove else 'b'):
+            return None
+        moves = []
+        self.moveFunctions[piece[1]](r, c, moves)
+        if piece[1] == 'K':
+            self.getCastleMoves(r, c, moves)
+        for move in moves:
+            if move.packed & 0x3FFF == compactID:
+                return move
+        return None
+
+    #after makeMove: whether the move left its own king attacked, which makes a pseudo legal move illegal
+    def movedIntoCheck(self):
+        kingRow, kingCol = self.blackKingLocation if self.whiteToMove else self.whiteKingLocation
+        return self.getAttackers(kingRow, kingCol, self.whiteToMove) != 0
+
+    #a pinned piece may only move along the line between its king and the pinning piece
+    def pinAllows(self, pinDirection, dirRow, dirCol):
+        return pinDirection is None or pinDirection == (dirRow, dirCol) or pinDirection == (-dirRow, -dirCol)
+
+    # Get all the moves possible for pawn at it's row,col and add the moves to the list.
+    # With quietOnly the piece generators leave out captures and promotions, for getQuietMoves
+    def getPawnMoves(self, r, c, moves, quietOnly=False):
+        pinDirection = self.getPinDirection(r, c) if self.pins else None
         if self.whiteToMove: #white pawn moves
-            if self.board[r-1][c] == "--": #1 square pawn advance
-                moves.append(Move((r, c), (r-1, c), self.board))
-                if r == 6 and self.board[r-2][c] == "--": #2 square pawn advance
-                    moves.append(Move((r, c), (r-2, c), self.board))
-            if c-1 >= 0: #captures to the left
-                if self.board[r-1][c-1][0] == 'b': #enemy piece to capture
-                    moves.append(Move((r,c), (r-1, c-1), self.board))
-                elif (r-1, c-1) == self.enpassantPossible:
-                    moves.append(Move((r,c), (r-1, c-1), self.board, enpassant = True))
-            if c+1 <= 7: #captures to the right
-                if self.board[r-1][c+1][0] == 'b': #enemy piece to capture
-                    moves.append(Move((r,c), (r-1, c+1), self.board))
-                elif (r-1, c+1) == self.enpassantPossible:
-                    moves.append(Move((r,c), (r-1, c+1), self.board, enpassant = True))
-        
+            moveAmount, startRow, enemyColor = -1, 6, 'b'
         else: #black pawn moves
-            if self.board[r+1][c] == "--": #1 square pawn advance
-                moves.append(Move((r, c), (r+1, c), self.board))
-                if r == 1 and self.board[r+2][c] == "--": #2 square pawn advance
-                    moves.append(Move((r, c), (r+2, c), self.board))
-            #captures
-            if c-1 >= 0: #captures to the left
-                if self.board[r+1][c-1][0] == 'w': #enemy piece to capture
-                    moves.append(Move((r,c), (r+1, c-1), self.board))
-                elif (r+1, c-1) == self.enpassantPossible:
-                    moves.append(Move((r,c), (r+1, c-1), self.board, enpassant = True))
-            if c+1 <= 7: #captures to the right
-                if self.board[r+1][c+1][0] == 'w': #enemy piece to capture
-                    moves.append(Move((r, c), (r+1, c+1), self.board))
-                elif (r+1, c+1) == self.enpassantPossible:
-                    moves.append(Move((r,c), (r+1, c+1), self.board, enpassant = True))
+            moveAmount, startRow, enemyColor = 1, 1, 'w'
+
+        if self.board[r+moveAmount][c] == "--" and self.pinAllows(pinDirection, moveAmount, 0): #1 square pawn advance
+            if not (quietOnly and r + moveAmount in (0, 7)):
+                self.addPawnMove((r, c), (r+moveAmount, c), moves)
+            if r == startRow and self.board[r+2*moveAmount][c] == "--": #2 square pawn advance
+                moves.append(Move.fromPacked((r*8 + c) | (((r+2*moveAmount)*8 + c) << 6) | (MOVE_PIECE_INDEX[self.board[r][c]] << 17)))
+        if quietOnly:
+            return
+        for dirCol in (-1, 1): #captures to the left and to the right
+            endCol = c + dirCol
+            if not (0 <= endCol <= 7) or not self.pinAllows(pinDirection, moveAmount, dirCol):
+                continue
+            if self.board[r+moveAmount][endCol][0] == enemyColor: #enemy piece to capture
+                self.addPawnMove((r, c), (r+moveAmount, endCol), moves)
+            elif (r+moveAmount, endCol) == self.enpassantPossible:
+                if not self.legalMoveGen or self.enpassantIsSafe(r, c, r+moveAmount, endCol):
+                    moves.append(Move((r, c), (r+moveAmount, endCol), self.board, enpassant = True))
+
+    #a pawn reaching the last rank adds one move per piece it can promote to
+    def addPawnMove(self, startSq, endSq, moves):
+        move = Move(startSq, endSq, self.board)
+        moves.append(move)
+        if move.packed & MOVE_PROMOTION: #the queen promotion is in, one more move per under promotion
+            for i in range(1, len(Move.promotionPieces)):
+                moves.append(Move.fromPacked(move.packed | (i << 12)))
 
     # Get all the moves possible for rook at it's row,col and add the moves to the list
-    def getRookMoves(self, r, c, moves):
+    def getRookMoves(self, r, c, moves, quietOnly=False):
         directions = ((-1,0), (0,-1), (1,0), (0,1)) #up, left, down, right
-        enemyColor = "b" if self.whiteToMove else "w"
-        for d in directions:
-            for i in range(1, 8):
-                endRow = r + d[0] * i
-                endCol = c + d[1] * i
-                if 0 <= endRow < 8 and 0 <= endCol < 8: #is it on the board?
-                    endPiece = self.board[endRow][endCol]
-                    if endPiece == "--": #empty space valid
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    elif endPiece[0] == enemyColor: #enemy space valid
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                        break
-                    else: # friendly piece invalid
-                        break
-                else: # off board
-                    break
+        self.getSlidingMoves(r, c, directions, moves, quietOnly)
     
-    def getBishopMoves(self, r, c, moves):
+    def getBishopMoves(self, r, c, moves, quietOnly=False):
         directions = ((-1,-1), (-1, 1), (1,-1), (1,1)) #ends of the 2 diagonals
+        self.getSlidingMoves(r, c, directions, moves, quietOnly)
+
+    #walk each direction until the edge of the board or a piece, for rooks, bishops and queens
+    def getSlidingMoves(self, r, c, directions, moves, quietOnly=False):
+        pinDirection = self.getPinDirection(r, c) if self.pins else None
         enemyColor = "b" if self.whiteToMove else "w"
+        fromBits = (r*8 + c) | (MOVE_PIECE_INDEX[self.board[r][c]] << 17) #moves are packed directly, see Move
         for d in directions:
-            for i in range(1, 8): #bishop can move max 7 squares
+            if not self.pinAllows(pinDirection, d[0], d[1]):
+                continue
+            for i in range(1, 8): #can move max 7 squares
                 endRow = r + d[0] * i
                 endCol = c + d[1] * i
                 if 0 <= endRow < 8 and 0 <= endCol < 8: #is it on the board?
                     endPiece = self.board[endRow][endCol]
                     if endPiece == "--": #empty space valid
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
-                    elif endPiece[0] == enemyColor: #enemy space valid
-                        moves.append(Move((r, c), (endRow, endCol), self.board))
+                        moves.append(Move.fromPacked(fromBits | ((endRow*8 + endCol) << 6)))
+                    elif endPiece[0] == enemyColor and not quietOnly: #enemy space valid
+                        moves.append(Move.fromPacked(fromBits | ((endRow*8 + endCol) << 6) | (MOVE_PIECE_INDEX[endPiece] << 21)))
                         break
-                    else: # friendly piece invalid
+                    else: # friendly piece invalid, or an enemy one when only quiet moves are wanted
                         break
                 else: # off board
                     break
     
-    def getKnightMoves(self, r, c, moves):
+    def getKnightMoves(self, r, c, moves, quietOnly=False):
+        if self.pins and self.getPinDirection(r, c) is not None:
+            return #a pinned knight can never move along the pin
         knightMoves = ((-2,-1), (-2,1), (-1,-2), (-1,2), (1,-2), (1,2), (2,-1), (2,1))
         allyColor = "w" if self.whiteToMove else "b"
+        fromBits = (r*8 + c) | (MOVE_PIECE_INDEX[self.board[r][c]] << 17)
         for m in knightMoves:
             endRow = r + m[0]
             endCol = c + m[1]
             if 0 <= endRow < 8 and 0 <= endCol < 8:
                 endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor: #not an ally piece(empty or enemy piece)
-                    moves.append(Move((r, c), (endRow, endCol), self.board))
+                if endPiece[0] != allyColor and not (quietOnly and endPiece != '--'): #empty, or an enemy piece unless quiet only
+                    moves.append(Move.fromPacked(fromBits | ((endRow*8 + endCol) << 6) | (MOVE_PIECE_INDEX[endPiece] << 21)))
     
-    def getQueenMoves(self, r, c, moves):
-        self.getRookMoves(r, c, moves)
-        self.getBishopMoves(r, c, moves)
+    def getQueenMoves(self, r, c, moves, quietOnly=False):
+        self.getRookMoves(r, c, moves, quietOnly)
+        self.getBishopMoves(r, c, moves, quietOnly)
 
-    def getKingMoves(self, r, c, moves):
+    def getKingMoves(self, r, c, moves, quietOnly=False):
         kingMoves = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
         allyColor = "w" if self.whiteToMove else "b"
+        fromBits = (r*8 + c) | (MOVE_PIECE_INDEX[self.board[r][c]] << 17)
         for i in range(8):
             endRow = r + kingMoves[i][0]
             endCol = c + kingMoves[i][1]
             if 0 <= endRow < 8 and 0 <= endCol < 8:
                 endPiece = self.board[endRow][endCol]
-                if endPiece[0] != allyColor: #not an ally piece(empty or enemy piece)
-                    moves.append(Move((r, c),(endRow, endCol), self.board))
+                if endPiece[0] != allyColor and not (quietOnly and endPiece != '--'): #empty, or an enemy piece unless quiet only
+                    moves.append(Move.fromPacked(fromBits | ((endRow*8 + endCol) << 6) | (MOVE_PIECE_INDEX[endPiece] << 21)))
 
     #Generate all valid moves for the king at (r,c) and add them to the list of moves
     def getCastleMoves(self, r, c, moves):
         if self.inCheck():
             return #can't castle while in check
-        if (self.whiteToMove and self.currentCastlingRight.wks) or (not self.whiteToMove and self.currentCastlingRight.bks):
-            self.getKingsideCastleMoves(r, c, moves)
-        if (self.whiteToMove and self.currentCastlingRight.wqs) or (not self.whiteToMove and self.currentCastlingRight.bqs):
+        if self.castlingRights & (CASTLE_WKS if self.whiteToMove else CASTLE_BKS):
             self.getKingsideCastleMoves(r, c, moves)
+        if self.castlingRights & (CASTLE_WQS if self.whiteToMove else CASTLE_BQS):
+            self.getQueensideCastleMoves(r, c, moves)
         
     def getKingsideCastleMoves(self, r, c, moves):
         if self.board[r][c+1] == '--' and self.board[r][c+2] == '--':
@@ -338,12 +803,19 @@ class GameState():
 
 
 
-class CastleRights():
-    def __init__(self, wks, bks, wqs, bqs):
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
+#A move is one packed integer, so move lists fit in array('I') buffers and a Move object only wraps that int:
+#   bits 0-5   start square (row*8 + col)
+#   bits 6-11  end square
+#   bits 12-13 promotion piece, an index into Move.promotionPieces
+#   bit 14     pawn promotion, bit 15 en passant, bit 16 castle move
+#   bits 17-20 piece moved, bits 21-24 piece captured, indices into MOVE_PIECES
+#The low 14 bits are the compact id the transposition table stores.
+MOVE_PIECES = ('--', 'wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+MOVE_PIECE_INDEX = {piece: i for i, piece in enumerate(MOVE_PIECES)}
+MOVE_PROMOTION = 1 << 14
+MOVE_ENPASSANT = 1 << 15
+MOVE_CASTLE = 1 << 16
+SQUARE_NAMES = [file + rank for rank in "87654321" for file in "abcdefgh"] #by row*8 + col
 
 
 class Move():
@@ -354,40 +826,115 @@ class Move():
     filesToCols = {"a":0 , "b":1 , "c":2 , "d":3 , "e":4 , "f":5 , "g":6 , "h":7}
     colsToFiles = {v:k for k,v in filesToCols.items()}
 
-    def __init__(self, startSq, endSq, board, enpassant=False, isCastleMove=False):
-        self.startRow = startSq[0]
-        self.startCol = startSq[1]
-        self.endRow = endSq[0]
-        self.endCol = endSq[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        
-        #pawn promotion
-        self.pawnPromotion = (self.pieceMoved == 'wp' and self.endRow == 0) or (self.pieceMoved == 'bp' and self.endRow == 7)
-
-        #en passant
-        self.enpassant = enpassant
-        if self.enpassant:
-            self.pieceCaptured = 'wp' if self.pieceMoved == 'bp' else 'bp'
-
-        self.isCapture = self.pieceCaptured != '--'
-        
-        #castle move
-        self.isCastleMove = isCastleMove
+    promotionPieces = ('Q', 'R', 'B', 'N')
+    promotionIndex = {piece: i for i, piece in enumerate(promotionPieces)}
 
-        #unique id for each move
-        self.moveID = self.startRow*1000 + self.startCol*100 + self.endRow*10 + self.endCol #Creates unique id for moves to better recognize these moves
+    __slots__ = ('packed',) #no per move __dict__, everything else is decoded from the int on demand
 
+    def __init__(self, startSq, endSq, board, enpassant=False, isCastleMove=False, promotionChoice='Q'):
+        startRow, startCol = startSq
+        endRow, endCol = endSq
+        pieceMoved = board[startRow][startCol]
+        packed = (startRow * 8 + startCol) | ((endRow * 8 + endCol) << 6) | (MOVE_PIECE_INDEX[pieceMoved] << 17)
+        if enpassant:
+            packed |= MOVE_ENPASSANT | (MOVE_PIECE_INDEX['wp' if pieceMoved == 'bp' else 'bp'] << 21)
+        else:
+            packed |= MOVE_PIECE_INDEX[board[endRow][endCol]] << 21
+        if isCastleMove:
+            packed |= MOVE_CASTLE
+        if pieceMoved[1] == 'p' and (endRow == 0 or endRow == 7): #pawn promotion, to a queen unless asked otherwise
+            packed |= MOVE_PROMOTION | (self.promotionIndex[promotionChoice] << 12)
+        self.packed = packed
+
+    #wrap a packed move, e.g. one read back from a move buffer, without touching a board
+    @classmethod
+    def fromPacked(cls, packed):
+        move = object.__new__(cls)
+        move.packed = packed
+        return move
+
+    @property
+    def startRow(self):
+        return (self.packed >> 3) & 7
+
+    @property
+    def startCol(self):
+        return self.packed & 7
+
+    @property
+    def endRow(self):
+        return (self.packed >> 9) & 7
+
+    @property
+    def endCol(self):
+        return (self.packed >> 6) & 7
+
+    @property
+    def pieceMoved(self):
+        return MOVE_PIECES[(self.packed >> 17) & 15]
+
+    @property
+    def pieceCaptured(self):
+        return MOVE_PIECES[self.packed >> 21]
+
+    @property
+    def pawnPromotion(self):
+        return self.packed & MOVE_PROMOTION != 0
+
+    @property
+    def promotionChoice(self):
+        return self.promotionPieces[(self.packed >> 12) & 3]
+
+    @property
+    def enpassant(self):
+        return self.packed & MOVE_ENPASSANT != 0
+
+    @property
+    def isCastleMove(self):
+        return self.packed & MOVE_CASTLE != 0
+
+    @property
+    def isCapture(self):
+        return self.packed >> 21 != 0
+
+    #unique id for each move, under promotions get their own ids, queening keeps the plain one
+    @property
+    def moveID(self):
+        moveID = self.startRow*1000 + self.startCol*100 + self.endRow*10 + self.endCol
+        if self.packed & MOVE_PROMOTION:
+            moveID += 10000 * ((self.packed >> 12) & 3)
+        return moveID
 
     #Overriding the equals method
     def __eq__(self, other):
         if isinstance(other, Move):
-            return self.moveID == other.moveID
+            return self.packed & 0x3FFF == other.packed & 0x3FFF
         return False
 
+    def __hash__(self):
+        return self.packed & 0x3FFF
+
+    #16 bit form of the move for compact storage: start square, end square (row*8 + col) and promotion piece
+    def getCompactID(self):
+        return self.packed & 0x3FFF
+
+    #rebuild a move from getCompactID on the board it was played from
+    @classmethod
+    def fromCompactID(cls, compactID, board):
+        startRow, startCol = divmod(compactID & 63, 8)
+        endRow, endCol = divmod((compactID >> 6) & 63, 8)
+        piece = board[startRow][startCol]
+        enpassant = piece[1] == 'p' and startCol != endCol and board[endRow][endCol] == '--'
+        isCastleMove = piece[1] == 'K' and abs(endCol - startCol) == 2
+        return cls((startRow, startCol), (endRow, endCol), board, enpassant, isCastleMove, cls.promotionPieces[compactID >> 12])
+
     def getChessNotation(self):
         #you can add to make this like real chess notation
-        return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        packed = self.packed
+        notation = SQUARE_NAMES[packed & 63] + SQUARE_NAMES[(packed >> 6) & 63]
+        if packed & MOVE_PROMOTION:
+            notation += self.promotionChoice.lower() #e7e8q, as in UCI
+        return notation
     
     def getRankFile(self, r, c):
         return self.colsToFiles[c] + self.rowsToRanks[r]
@@ -410,6 +957,36 @@ class Move():
         #piece moves
         moveString = self.pieceMoved[1]
         if self.isCapture:
-            moveString == 'x'
+            moveString += 'x'
         return moveString + endSquare
 
+
+#Preallocated array('I') move lists, one fixed run of slots per ply, so perft can keep the moves of every ply on
+#its path as packed ints instead of lists of Move objects, and reuse the same memory at every node.
+#Only perft uses them. The search picks moves in stages (moveFinder.Searcher.pickMoves) and often cuts off
+#before the quiet moves are generated at all; storing every stage here would mean generating it eagerly, and
+#get() builds a Move for every entry read back, so the search would allocate as much and do more work
+class MoveBuffers():
+    SLOT_MOVES = 256 #no legal position has more than 218 moves
+
+    def __init__(self, maxPly=128):
+        self.moves = array('I', [0]) * (maxPly * self.SLOT_MOVES)
+        self.counts = array('H', [0]) * maxPly
+
+    #store moves (Move objects) for ply, replacing what was there
+    def store(self, ply, moves):
+        start = ply * self.SLOT_MOVES
+        buffer = self.moves
+        for i, move in enumerate(moves):
+            buffer[start + i] = move.packed
+        self.counts[ply] = len(moves)
+
+    def count(self, ply):
+        return self.counts[ply]
+
+    def packed(self, ply, i):
+        return self.moves[ply * self.SLOT_MOVES + i]
+
+    #the Move for entry i of ply
+    def get(self, ply, i):
+        return Move.fromPacked(self.moves[ply * self.SLOT_MOVES + i])
@@ -2,13 +2,23 @@
 
 import pygame as p
 import Engine
+import engineWorker
 
 p.init() #initialising pygame 
 WIDTH = HEIGHT = 512
 DIMENSION = 8 #since chess board is 8x8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15 #purely for animations
+ENGINE_POLL_MS = 50 #how often the loop wakes up for engine messages while it thinks; otherwise it sleeps until input
+BACKEND = 'bitboard' #position representation used by the engine, 'mailbox' or 'bitboard'
 IMAGES = {}
+PLAYER_ONE = True #True when a human plays white, False when the engine does
+PLAYER_TWO = True #same for black; set either to False to play the engine
+AI_MOVETIME = 2.0 #seconds the engine thinks per move
+AI_HASH_MB = 64
+PONDER = True #keep the engine thinking about its predicted reply while the human moves
+BOOK_PATH = 'book.bin' #opening book built with openingBook.py, the engine searches every move when it's missing
+TABLEBASE_PATH = 'tablebases' #directory of endgame tables made by tablebase.py, used when it's there
 
 #Now we create a dictionary for the images. This will be done exactly once since it's an expensive operation
 
@@ -22,7 +32,8 @@ def main():
     screen = p.display.set_mode((WIDTH, HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
-    gs = Engine.GameState() #can now use the GameState engine from engine class
+    p.event.set_blocked(p.MOUSEMOTION) #nothing follows the mouse, so moving it shouldn't wake the loop
+    gs = Engine.GameState(backend=BACKEND) #can now use the GameState engine from engine class
     validMoves = gs.getValidMoves()
     moveMade = False #Flag variable for when a move is made
     animate = False #flag variable for when we should animate a move  
@@ -31,14 +42,25 @@ def main():
     sqSelected = () #no square is selected initially. Keeps track of the last click of the user (tuple: (row, col))
     playerClicks =  [] #keep track of player clicks (say, two tuples: [(6,4), (4,4))]). 
     gameOver = False
+    worker = engineWorker.EngineWorker(AI_HASH_MB, BACKEND, BOOK_PATH, TABLEBASE_PATH) if not (PLAYER_ONE and PLAYER_TWO) else None
+    aiThinking = False
+    engineFailed = False #the worker couldn't search this position; it isn't asked again until the position changes
+    predictedMove = None #the human reply the engine expects, pondered on while the human thinks
+    renderer = Renderer(screen)
+    renderer.draw(gs, validMoves, sqSelected)
     while running: #This is done in any pygame code for smoother processing
-        for e in p.event.get():
+        humanTurn = (gs.whiteToMove and PLAYER_ONE) or (not gs.whiteToMove and PLAYER_TWO)
+        #sleep until there is input, waking up now and then only while the engine has something to report
+        engineBusy = worker is not None and (aiThinking or worker.pondering or (not gameOver and not humanTurn and not engineFailed))
+        for e in [p.event.wait(ENGINE_POLL_MS if engineBusy else 0)] + p.event.get():
             if e.type == p.QUIT:
                 running = False
+            elif e.type in (p.VIDEOEXPOSE, p.WINDOWEXPOSED):
+                renderer.invalidate() #the window manager lost what was on screen
 
             # mouse handlers
             elif e.type == p.MOUSEBUTTONDOWN:
-                if not gameOver:
+                if not gameOver and humanTurn:
                     location = p.mouse.get_pos() #(x, y) location of mouse. Keeping it simple. We click on the piece and then click towards where it can go.
                     col = location[0]//SQ_SIZE #the col and row variables tell us precisely what piece has been selected
                     row = location[1]//SQ_SIZE
@@ -53,6 +75,8 @@ def main():
                         print(move.getChessNotation())
                         for i in range(len(validMoves)):
                             if move == validMoves[i]:
+                                if worker is not None and worker.pondering:
+                                    worker.cancel() #the table keeps what pondering found either way
                                 gs.makeMove(validMoves[i])
                                 moveMade = True
                                 animate = True
@@ -64,109 +88,221 @@ def main():
             #key handlers
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z: #Undo when 'z' is pressed
+                    if worker is not None:
+                        worker.cancel() #stop thinking about a position that is going away
+                        aiThinking = False
+                    engineFailed = False
                     gs.undoMove()
+                    if worker is not None and (PLAYER_ONE or PLAYER_TWO) and \
+                            not ((gs.whiteToMove and PLAYER_ONE) or (not gs.whiteToMove and PLAYER_TWO)):
+                        gs.undoMove() #against the engine, take back its reply too
                     moveMade = True
                     animate = False
+                    gameOver = False
+                    predictedMove = None
                 if e.key == p.K_r: #reset when board when 'r' is pressed
-                    gs = Engine.GameState()
+                    if worker is not None:
+                        worker.cancel()
+                        aiThinking = False
+                    engineFailed = False
+                    gs = Engine.GameState(backend=BACKEND)
                     validMoves = gs.getValidMoves()
                     sqSelected = ()
                     playerClicks = []
                     moveMade = False
                     animate = False
+                    gameOver = False
+                    predictedMove = None
+
+        #engine: start a search on its turn, then pick up progress and the answer without blocking
+        if worker is not None and not gameOver and not humanTurn and not aiThinking and not moveMade and not engineFailed:
+            worker.startSearch(gs, movetime=AI_MOVETIME)
+            aiThinking = True
+        if worker is not None and (aiThinking or worker.pondering):
+            for message in worker.poll():
+                if message[0] == 'info':
+                    _, _, depth, score, nodes, nps, pv = message
+                    p.display.set_caption("depth %d  score %d  nodes %d  nps %d  %s%s" % (
+                        depth, score, nodes, nps, "pondering " if worker.pondering else "", " ".join(pv[:6])))
+                elif message[0] == 'bestmove' and aiThinking:
+                    aiThinking = False
+                    pv = message[6]
+                    for move in validMoves:
+                        if move.getChessNotation() == message[2]:
+                            gs.makeMove(move)
+                            moveMade = True
+                            animate = True
+                            break
+                    predictedMove = pv[1] if PONDER and len(pv) > 1 else None
+                elif message[0] == 'error':
+                    aiThinking = False
+                    engineFailed = True
+                    worker.cancel() #a failed ponder ends the pondering too
+                    p.display.set_caption("engine error: %s" % message[2])
 
         if moveMade:
             if animate:
-                animateMove(gs.moveLog[-1], screen, gs.board, clock)
+                renderer.animateMove(gs.moveLog[-1], gs.board, clock)
             validMoves = gs.getValidMoves()
             moveMade = False
             animate = False
+            engineFailed = False
+            if predictedMove is not None and len(validMoves) > 0:
+                worker.startPonder(gs, predictedMove)
+            predictedMove = None
 
-        drawGameState(screen, gs, validMoves, sqSelected)
-
+        text = None
         if gs.checkMate or gs.staleMate:
             gameOver = True
-            drawEndGameText(screen, 'Stalemate' if gs.staleMate else 'Black wins by checkmate' if gs.whiteToMove else 'White wins by checkmate')
-            
-        
+            text = 'Stalemate' if gs.staleMate else 'Black wins by checkmate' if gs.whiteToMove else 'White wins by checkmate'
+        renderer.draw(gs, validMoves, sqSelected, text)
+
         clock.tick(MAX_FPS)
-        p.display.flip()
-
-#this class is responsible for all the graphics within a current game state
-def drawGameState(screen, gs, validMoves, sqSelected):
-    drawBoard(screen) #draws squares on the board
-    highlightSquares(screen, gs, validMoves, sqSelected)
-    #Can also be used in piece highlighting or move suggestions(later)
-    drawPieces(screen, gs.board) #draws pieces on top of those squares
-
-#Drawing the squares on the board.
-def drawBoard(screen):
-    global colors
-    colors = [p.Color("white"), p.Color("gray")]
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            color = colors[((r+c)%2)]
-            p.draw.rect(screen, color, p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE)) #the coordinates are col,row manner. This line does the shading for the individual boxes
-
-
-#Highlight square selected and moves for piece selected
-def highlightSquares(screen, gs, validMoves, sqSelected):
-    if sqSelected != ():
-        r, c = sqSelected
-        if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'): #sqSelected is a piece that can be moved
-            #highlight selected square
-            s = p.Surface((SQ_SIZE, SQ_SIZE))
-            s.set_alpha(100) #transparency value -> 0 transparent; 255 opaque
-            s.fill(p.Color('blue'))
-            screen.blit(s, (c*SQ_SIZE, r*SQ_SIZE))
-            #highlight moves that square
-            s.fill(p.Color('yellow'))
-            for move in validMoves:
-                if move.startRow == r and move.startCol == c:
-                    screen.blit(s, (move.endCol*SQ_SIZE, move.endRow*SQ_SIZE))
-
-
-#Drawing the pieces on the board using the current GameState.board
-def drawPieces(screen, board):
-    for r in range(DIMENSION):
-        for c in range(DIMENSION):
-            piece = board[r][c]
-            if piece != "--": #not empty spaces
-                screen.blit(IMAGES[piece], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-
-def animateMove(move, screen, board, clock):
-    global colors
-    coords = [] #list of coords that the animation will move through
-    dR = move.endRow - move.startRow
-    dC = move.endCol - move.startCol
-    framesPerSquare = 10 #frames to move one square
-    frameCount = (abs(dR) + abs(dC)) * framesPerSquare
-    for frame in range(frameCount + 1):
-        r, c = (move.startRow + dR*frame/frameCount, move.startCol + dC*frame/frameCount)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        #erase the piece moved from its ending square
-        color = colors[(move.endRow + move.endCol) % 2]
-        endSquare = p.Rect(move.endCol*SQ_SIZE, move.endRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
-        p.draw.rect(screen, color, endSquare)
-        #draw captured pieces onto rectangle
-        if move.pieceCaptured != '--':
-            if move.enpassant:
-                enpassantRow = (move.endRow + 1) if move.pieceCaptured[0] == 'b' else move.endRow - 1
-                endSquare = p.Rect(move.endCol*SQ_SIZE, enpassantRow*SQ_SIZE, SQ_SIZE, SQ_SIZE)
-            screen.blit(IMAGES[move.pieceCaptured], endSquare)
-        #draw moving pieces
-        screen.blit(IMAGES[move.pieceMoved], p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE))
-        p.display.flip()
-        clock.tick(60)
-
-def drawText(screen, text):
-    font = p.font.SysFont("Helvetica", 32, True, False)
-    textObject = font.render(text, 0, p.Color('Black'))
-    textLocation = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObject.get_width()/2, HEIGHT/2 - textObject.get_height()/2)
-    screen.blit(textObject, textLocation)
-    textObject = font.render(text, 0, p.Color('Black'))
-    screen.blit(textObject, textLocation.move(2, 2))
+
+    if worker is not None:
+        worker.close()
+
+#Draws the game in retained mode: the squares are rendered once into a background surface, and every call only
+#repaints the squares whose piece or highlight changed since the last one, then updates just those rectangles
+#of the display. An unchanged position costs 64 comparisons and no drawing at all
+NO_HIGHLIGHT, SELECTED, TARGET = 0, 1, 2
+
+class Renderer():
+    def __init__(self, screen):
+        self.screen = screen
+        self.background = p.Surface((WIDTH, HEIGHT))
+        colors = [p.Color("white"), p.Color("gray")]
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                self.background.fill(colors[(r + c) % 2], self.squareRect(r, c))
+        self.overlays = {}
+        for highlight, color in ((SELECTED, 'blue'), (TARGET, 'yellow')):
+            overlay = p.Surface((SQ_SIZE, SQ_SIZE))
+            overlay.set_alpha(100) #transparency value -> 0 transparent; 255 opaque
+            overlay.fill(p.Color(color))
+            self.overlays[highlight] = overlay
+        self.font = None #made the first time there is text to show
+        self.textImages = {} #text: (surface, rect it covers)
+        self.text = None
+        self.shown = [None] * 64 #(piece, highlight) on screen for every square, None to force a repaint
+        self.dirty = []
+
+    @staticmethod
+    def squareRect(r, c):
+        return p.Rect(c*SQ_SIZE, r*SQ_SIZE, SQ_SIZE, SQ_SIZE) #the coordinates are col,row manner
+
+    #forget what is on screen, the next draw repaints everything
+    def invalidate(self):
+        self.shown = [None] * 64
+
+    def drawSquare(self, r, c, piece, highlight=NO_HIGHLIGHT):
+        rect = self.squareRect(r, c)
+        self.screen.blit(self.background, rect, rect)
+        if highlight != NO_HIGHLIGHT:
+            self.screen.blit(self.overlays[highlight], rect)
+        if piece != "--":
+            self.screen.blit(IMAGES[piece], rect)
+        self.shown[r*8 + c] = (piece, highlight)
+        self.dirty.append(rect)
+
+    #squares the rectangle overlaps, as (row, col)
+    @staticmethod
+    def squaresUnder(rect):
+        rect = rect.clip(p.Rect(0, 0, WIDTH, HEIGHT))
+        return [(r, c) for r in range(rect.top // SQ_SIZE, (rect.bottom - 1) // SQ_SIZE + 1)
+                for c in range(rect.left // SQ_SIZE, (rect.right - 1) // SQ_SIZE + 1)]
+
+    def textImage(self, text):
+        if text not in self.textImages:
+            if self.font is None:
+                self.font = p.font.SysFont("Helvetica", 32, True, False)
+            textObject = self.font.render(text, 0, p.Color('Black'))
+            textLocation = p.Rect(0, 0, WIDTH, HEIGHT).move(WIDTH/2 - textObject.get_width()/2, HEIGHT/2 - textObject.get_height()/2)
+            textLocation.size = textObject.get_size()
+            self.textImages[text] = (textObject, textLocation)
+        return self.textImages[text]
+
+    #bring the screen up to date with gs: the selected square and where its piece can go highlighted, text on top
+    def draw(self, gs, validMoves, sqSelected, text=None):
+        highlights = {}
+        if sqSelected != ():
+            r, c = sqSelected
+            if gs.board[r][c][0] == ('w' if gs.whiteToMove else 'b'): #sqSelected is a piece that can be moved
+                highlights[r*8 + c] = SELECTED
+                for move in validMoves:
+                    if move.startRow == r and move.startCol == c:
+                        highlights[move.endRow*8 + move.endCol] = TARGET
+        textChanged = text != self.text
+        if textChanged:
+            if self.text is not None: #what was under the old text shows again
+                for r, c in self.squaresUnder(self.textArea(self.text)):
+                    self.shown[r*8 + c] = None
+            self.text = text
+        dirtyBefore = len(self.dirty)
+        for r in range(DIMENSION):
+            row = gs.board[r]
+            for c in range(DIMENSION):
+                state = (row[c], highlights.get(r*8 + c, NO_HIGHLIGHT))
+                if self.shown[r*8 + c] != state:
+                    self.drawSquare(r, c, *state)
+        #the text goes back on top when it is new or a square under it was just repainted
+        if text is not None and (textChanged or self.textArea(text).collidelist(self.dirty[dirtyBefore:]) != -1):
+            textObject, textLocation = self.textImage(text)
+            self.screen.blit(textObject, textLocation)
+            self.screen.blit(textObject, textLocation.move(2, 2))
+            self.dirty.append(self.textArea(text))
+        self.flush()
+
+    #the rectangle the text and its offset copy cover
+    def textArea(self, text):
+        textLocation = self.textImage(text)[1]
+        return textLocation.union(textLocation.move(2, 2))
+
+    def flush(self):
+        if self.dirty:
+            p.display.update(self.dirty)
+            self.dirty = []
+
+    #slide the moved piece from its start to its end square. board is after the move; until the piece arrives
+    #the end square shows what was captured there. Each frame repaints only the squares the piece leaves and covers
+    def animateMove(self, move, board, clock):
+        dR = move.endRow - move.startRow
+        dC = move.endCol - move.startCol
+        framesPerSquare = 10 #frames to move one square
+        frameCount = (abs(dR) + abs(dC)) * framesPerSquare
+        if frameCount == 0:
+            return
+        captureSquare = (move.endRow, move.endCol)
+        if move.enpassant:
+            captureSquare = ((move.endRow + 1) if move.pieceCaptured[0] == 'b' else move.endRow - 1, move.endCol)
+        def still(r, c): #what stands on a square while the piece is on its way
+            if (r, c) == captureSquare:
+                return move.pieceCaptured
+            if (r, c) == (move.endRow, move.endCol):
+                return "--"
+            return board[r][c]
+        if self.text is not None: #the text comes off while the piece moves
+            for r, c in self.squaresUnder(self.textArea(self.text)):
+                self.shown[r*8 + c] = None
+            self.text = None
+        for r in range(DIMENSION):
+            for c in range(DIMENSION):
+                if self.shown[r*8 + c] != (still(r, c), NO_HIGHLIGHT):
+                    self.drawSquare(r, c, still(r, c))
+        previous = None
+        for frame in range(frameCount + 1):
+            r, c = (move.startRow + dR*frame/frameCount, move.startCol + dC*frame/frameCount)
+            pieceRect = p.Rect(round(c*SQ_SIZE), round(r*SQ_SIZE), SQ_SIZE, SQ_SIZE)
+            if previous is not None:
+                for row, col in self.squaresUnder(previous):
+                    self.drawSquare(row, col, still(row, col))
+            self.screen.blit(IMAGES[move.pieceMoved], pieceRect)
+            self.dirty.append(pieceRect)
+            self.flush()
+            previous = pieceRect
+            clock.tick(60)
+        for row, col in self.squaresUnder(previous):
+            self.shown[row*8 + col] = None #the piece drawn over them isn't part of any square
 
 if __name__ == "__main__":
     main()
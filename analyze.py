@@ -0,0 +1,167 @@
+# Batch analysis: reads positions from a FEN or EPD file one line at a time, searches each one to a fixed depth
+# or for a fixed time on a pool of worker processes, and writes one JSON object per line in the same order as
+# the input.
+#
+#   python analyze.py positions.epd --depth 5 --workers 4 --output results.jsonl --checkpoint results.ckpt
+#
+# Only a few positions per worker are in flight at any time, so memory stays flat however big the input is.
+# With --checkpoint the byte offset of the first position not written yet is saved as results go out, and a
+# rerun with the same checkpoint carries on from there, appending to the output.
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import Engine
+import moveFinder
+
+IN_FLIGHT_PER_WORKER = 4
+CHECKPOINT_EVERY = 2.0 #seconds between checkpoint writes
+PROGRESS_EVERY = 10.0 #seconds between progress lines on stderr
+
+
+#(fen, {opcode: operand}) from one line of a FEN or EPD file. EPD lines have four position fields followed by
+#operations like 'bm Nf3; id "pos 1";', a FEN line has the two move counters instead
+def parseEpd(line):
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("not a FEN or EPD line: %r" % line)
+    rest = fields[4] if len(fields) > 4 else ''
+    counters = rest.split()
+    if len(counters) == 2 and counters[0].isdigit() and counters[1].isdigit():
+        return line, {}
+    operations = {}
+    for operation in rest.split(';'):
+        operation = operation.strip()
+        if not operation:
+            continue
+        opcode, _, operand = operation.partition(' ')
+        operations[opcode] = operand.strip().strip('"')
+    fen = ' '.join(fields[:4])
+    if 'hmvc' in operations and 'fmvn' in operations:
+        fen += ' %s %s' % (operations['hmvc'], operations['fmvn'])
+    return fen, operations
+
+
+_searcher = None
+_backend = None
+
+def _initWorker(ttSizeMb, backend):
+    global _searcher, _backend
+    _searcher = moveFinder.Searcher(ttSizeMb)
+    _backend = backend
+
+#analysis of one input line, run in a worker process
+def analyzeLine(line, depth, movetime):
+    try:
+        fen, operations = parseEpd(line)
+        gs = Engine.GameState(backend=_backend, fen=fen)
+        #every position starts from an empty table so results don't depend on which worker got what before
+        _searcher.tt.clear()
+        _searcher.clearHeuristics()
+        result = _searcher.search(gs, depth=depth, movetime=movetime)
+    except ValueError as error:
+        return {"input": line, "error": str(error)}
+    except Exception as error: #one broken position mustn't end a run over millions of them
+        return {"input": line, "error": "%s: %s" % (type(error).__name__, error)}
+    record = {"fen": gs.getFen(), "bestMove": result.bestMove.getChessNotation() if result.bestMove else None,
+              "score": result.score, "depth": result.depth, "nodes": result.nodes,
+              "pv": [move.getChessNotation() for move in result.pv], "seconds": round(result.seconds, 6)}
+    if 'id' in operations:
+        record["id"] = operations['id']
+    if 'bm' in operations:
+        record["bm"] = operations['bm']
+    return record
+
+
+#(offset after the line, line) for every position in path from offset on, skipping blank lines and # comments
+def readPositions(path, offset=0):
+    with open(path, 'rb') as f:
+        if offset:
+            f.seek(offset) #only files can resume, a pipe starts at 0
+        for raw in f:
+            offset += len(raw)
+            line = raw.decode('utf-8', 'replace').strip()
+            if line and not line.startswith('#'):
+                yield offset, line
+
+def readCheckpoint(path):
+    try:
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+def writeCheckpoint(path, offset):
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        f.write("%d\n" % offset)
+    os.replace(temporary, path) #a crash never leaves a half written checkpoint
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="analyze every position of a FEN/EPD file, JSON lines out in input order")
+    parser.add_argument("input", help="FEN or EPD file, one position per line")
+    parser.add_argument("--depth", type=int, help="search depth per position")
+    parser.add_argument("--movetime", type=float, help="seconds per position")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--hash", type=int, default=16, help="transposition table size in MB, per worker")
+    parser.add_argument("--backend", choices=Engine.GameState.BACKENDS, default="bitboard")
+    parser.add_argument("--output", help="JSON lines file, stdout when left out")
+    parser.add_argument("--checkpoint", help="file keeping the input offset to resume from")
+    parser.add_argument("--offset", type=int, help="start at this byte offset of the input, overrides the checkpoint")
+    args = parser.parse_args(argv)
+    if args.depth is None and args.movetime is None:
+        parser.error("give --depth, --movetime or both")
+
+    offset = args.offset if args.offset is not None else (readCheckpoint(args.checkpoint) if args.checkpoint else 0)
+    output = open(args.output, 'a' if offset else 'w') if args.output else sys.stdout
+    pending = collections.deque() #(offset after the line, future) in input order
+    maxPending = args.workers * IN_FLIGHT_PER_WORKER
+    written = 0
+    start = lastProgress = lastCheckpoint = time.perf_counter()
+
+    def writeOldest():
+        nonlocal written, offset, lastCheckpoint, lastProgress
+        offset, future = pending.popleft()
+        output.write(json.dumps(future.result()) + "\n")
+        written += 1
+        now = time.perf_counter()
+        if args.checkpoint and now - lastCheckpoint >= CHECKPOINT_EVERY:
+            output.flush()
+            writeCheckpoint(args.checkpoint, offset)
+            lastCheckpoint = now
+        if now - lastProgress >= PROGRESS_EVERY:
+            print("%d positions, %.2f positions/sec" % (written, written / (now - start)), file=sys.stderr)
+            lastProgress = now
+
+    with concurrent.futures.ProcessPoolExecutor(args.workers, mp_context=mp.get_context('spawn'),
+                                                initializer=_initWorker, initargs=(args.hash, args.backend)) as pool:
+        try:
+            for lineEnd, line in readPositions(args.input, offset):
+                pending.append((lineEnd, pool.submit(analyzeLine, line, args.depth, args.movetime)))
+                if len(pending) >= maxPending:
+                    writeOldest()
+            while pending:
+                writeOldest()
+        finally:
+            pool.shutdown(cancel_futures=True) #on an interrupt, don't finish what was queued
+            output.flush()
+            if args.checkpoint:
+                writeCheckpoint(args.checkpoint, offset)
+            if output is not sys.stdout:
+                output.close()
+
+    seconds = time.perf_counter() - start
+    print("%d positions in %.2fs, %.2f positions/sec" % (written, seconds, written / seconds if seconds else 0.0),
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
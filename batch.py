@@ -0,0 +1,438 @@
+# Batch move generation and evaluation with numpy, for scoring many positions at once (training data, test
+# suites) instead of one GameState at a time. A batch of N positions is an (N, 64) uint8 array of piece codes,
+# the indices of Engine.MOVE_PIECES by square (row * 8 + col), plus the side to move, castling rights and en
+# passant square of each position. Every function works on the whole batch with array operations; attack sets
+# are 64 bit bitboards like bitboard.py uses, one per position, or one per square of every position.
+#
+#   python batch.py --positions 20000 --seed 1
+#
+# builds positions from random games, runs the scalar path (getValidMoves, inCheck and evaluation.evaluate on
+# each GameState) and the batch path over them, checks that they agree and prints positions/sec for both.
+
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+
+import Engine
+import bitboard
+import evaluation
+
+#piece codes in the boards array
+EMPTY = 0
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6) #piece type, (code - 1) % 6
+WHITE_PAWN, WHITE_KING, BLACK_PAWN = 1, 6, 7
+CODES = {piece: code for code, piece in enumerate(Engine.MOVE_PIECES)}
+
+SQUARE_BITS = np.array([1 << sq for sq in range(64)], dtype=np.uint64)
+ALL = np.uint64((1 << 64) - 1)
+FILE_A = np.uint64(bitboard.FILE_A)
+#squares a shift by that many columns may land on without wrapping round to the other side of the board
+COLUMN_MASKS = {dc: np.uint64(sum(1 << sq for sq in range(64) if 0 <= (sq & 7) - dc < 8)) for dc in (-2, -1, 0, 1, 2)}
+ROW_4 = np.uint64(0xFF << 32) #where white double pushes land
+ROW_3 = np.uint64(0xFF << 24) #and black ones
+PROMOTION_ROWS = np.uint64(0xFF | (0xFF << 56))
+
+KNIGHT_TABLE = np.array(bitboard.KNIGHT_ATTACKS, dtype=np.uint64)
+KING_TABLE = np.array(bitboard.KING_ATTACKS, dtype=np.uint64)
+PAWN_TABLES = np.array([bitboard.PAWN_ATTACKS['w'], bitboard.PAWN_ATTACKS['b']], dtype=np.uint64) #[black to move][sq]
+BETWEEN_TABLE = np.array(bitboard.BETWEEN, dtype=np.uint64)
+RANK_TABLE = np.array(bitboard.RANK_ATTACKS, dtype=np.uint64)
+FILE_TABLE = np.array(bitboard.FILE_ATTACKS, dtype=np.uint64)
+DIAGONAL_TABLE = np.array(bitboard.DIAGONAL_ATTACKS, dtype=np.uint64)
+ANTI_DIAGONAL_TABLE = np.array(bitboard.ANTI_DIAGONAL_ATTACKS, dtype=np.uint64)
+DIAGONAL_MASKS = np.array(bitboard.DIAGONAL_MASKS, dtype=np.uint64)
+ANTI_DIAGONAL_MASKS = np.array(bitboard.ANTI_DIAGONAL_MASKS, dtype=np.uint64)
+FILE_GATHER = np.uint64(bitboard.FILE_GATHER)
+DIAGONAL_GATHER = np.uint64(bitboard.DIAGONAL_GATHER)
+KNIGHT_STEPS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_STEPS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+ORTHOGONAL = ((-1, 0), (1, 0), (0, -1), (0, 1))
+DIAGONAL = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+#material + piece-square values by code and square, and game phase weights by code
+MG_TABLE = np.array([[evaluation.unpack(evaluation.PST[piece][sq])[0] for sq in range(64)] for piece in Engine.MOVE_PIECES])
+EG_TABLE = np.array([[evaluation.unpack(evaluation.PST[piece][sq])[1] for sq in range(64)] for piece in Engine.MOVE_PIECES])
+PHASE_TABLE = np.array([evaluation.PHASE_WEIGHTS[piece] for piece in Engine.MOVE_PIECES])
+#(mg, eg) of a passed pawn by square, for white and black pawns
+PASSED_BONUS = np.array([[evaluation.PASSED_PAWN[min(max(6 - (sq >> 3), 0), 7)] for sq in range(64)],
+                         [evaluation.PASSED_PAWN[min(max((sq >> 3) - 1, 0), 7)] for sq in range(64)]])
+
+
+class Batch():
+    def __init__(self, boards, whiteToMove, castling=None, enpassant=None):
+        self.boards = np.asarray(boards, dtype=np.uint8).reshape(-1, 64)
+        count = len(self.boards)
+        self.whiteToMove = np.asarray(whiteToMove, dtype=bool).reshape(-1) * np.ones(count, dtype=bool)
+        self.castling = np.zeros(count, dtype=np.uint8) if castling is None else np.asarray(castling, dtype=np.uint8)
+        self.enpassant = np.full(count, -1, dtype=np.int8) if enpassant is None else np.asarray(enpassant, dtype=np.int8)
+
+    def __len__(self):
+        return len(self.boards)
+
+    def __getitem__(self, rows):
+        return Batch(self.boards[rows], self.whiteToMove[rows], self.castling[rows], self.enpassant[rows])
+
+    #GameState.board of position i
+    def toBoard(self, i):
+        return [[Engine.MOVE_PIECES[code] for code in self.boards[i, row * 8:row * 8 + 8]] for row in range(8)]
+
+    def toFen(self, i):
+        rows = []
+        for row in self.toBoard(i):
+            text = ''
+            empty = 0
+            for piece in row:
+                if piece == '--':
+                    empty += 1
+                    continue
+                if empty:
+                    text += str(empty)
+                    empty = 0
+                text += piece[1].upper() if piece[0] == 'w' else piece[1].lower()
+            rows.append(text + (str(empty) if empty else ''))
+        castling = ''.join(flag for flag, right in zip('KQkq', (Engine.CASTLE_WKS, Engine.CASTLE_WQS, Engine.CASTLE_BKS,
+                                                                 Engine.CASTLE_BQS)) if self.castling[i] & right) or '-'
+        enpassant = Engine.SQUARE_NAMES[self.enpassant[i]] if self.enpassant[i] >= 0 else '-'
+        return '%s %s %s %s 0 1' % ('/'.join(rows), 'w' if self.whiteToMove[i] else 'b', castling, enpassant)
+
+    def toGameState(self, i, backend='mailbox'):
+        return Engine.GameState(backend=backend, fen=self.toFen(i))
+
+
+#a batch of the positions of states
+def fromGameStates(states):
+    boards = np.array([[CODES[piece] for row in gs.board for piece in row] for gs in states], dtype=np.uint8)
+    enpassant = [gs.enpassantPossible[0] * 8 + gs.enpassantPossible[1] if gs.enpassantPossible else -1 for gs in states]
+    return Batch(boards, [gs.whiteToMove for gs in states], [gs.castlingRights for gs in states], enpassant)
+
+#a batch from GameState.board style lists, with the same side to move and rights for all when they're scalars
+def fromBoards(boards, whiteToMove=True, castling=0, enpassant=-1):
+    codes = np.array([[CODES[piece] for row in board for piece in row] for board in boards], dtype=np.uint8)
+    count = len(codes)
+    return Batch(codes, whiteToMove, np.broadcast_to(np.asarray(castling, dtype=np.uint8), (count,)).copy(),
+                 np.broadcast_to(np.asarray(enpassant, dtype=np.int8), (count,)).copy())
+
+def fromFens(fens):
+    return fromGameStates([Engine.GameState(fen=fen) for fen in fens])
+
+
+#(N, 12) bitboards, one per piece of Engine.MOVE_PIECES after '--'
+def bitboards(batch):
+    return np.stack([np.packbits(batch.boards == code, axis=1, bitorder='little').view('<u8')[:, 0]
+                     for code in range(1, 13)], axis=1)
+
+def popcount(bb):
+    return np.bitwise_count(bb).astype(np.int64) if hasattr(np, 'bitwise_count') else \
+        np.unpackbits(bb.view(np.uint8)).reshape(bb.shape + (64,)).sum(-1)
+
+#index of the single set bit of each bitboard (0 for an empty one)
+def bitIndex(bb):
+    return np.maximum(np.frexp(bb.astype(np.float64))[1] - 1, 0)
+
+def _shift(bb, dr, dc):
+    amount = dr * 8 + dc
+    moved = bb << np.uint64(amount) if amount >= 0 else bb >> np.uint64(-amount)
+    return moved & COLUMN_MASKS[dc]
+
+#squares a slider on the squares of gen reaches in one direction, the first occupied square included
+def _slide(gen, empty, dr, dc):
+    reached = np.zeros_like(gen)
+    for _ in range(7):
+        gen = _shift(gen, dr, dc)
+        reached |= gen
+        gen &= empty
+        if not gen.any():
+            break
+    return reached
+
+def _pawnAttacks(pawns, white):
+    up = _shift(pawns, -1, -1) | _shift(pawns, -1, 1)
+    down = _shift(pawns, 1, -1) | _shift(pawns, 1, 1)
+    return np.where(white, up, down)
+
+#squares attacked by the six piece bitboards of one side (pawn, knight, bishop, rook, queen, king)
+def _attacks(pieces, occupied, white):
+    empty = ~occupied
+    attacked = _pawnAttacks(pieces[:, PAWN], white)
+    for dr, dc in KNIGHT_STEPS:
+        attacked |= _shift(pieces[:, KNIGHT], dr, dc)
+    for dr, dc in KING_STEPS:
+        attacked |= _shift(pieces[:, KING], dr, dc)
+    rooks = pieces[:, ROOK] | pieces[:, QUEEN]
+    bishops = pieces[:, BISHOP] | pieces[:, QUEEN]
+    for dr, dc in ORTHOGONAL:
+        attacked |= _slide(rooks, empty, dr, dc)
+    for dr, dc in DIAGONAL:
+        attacked |= _slide(bishops, empty, dr, dc)
+    return attacked
+
+#(N, 2) squares attacked by white and by black
+def attackMaps(batch):
+    bb = bitboards(batch)
+    occupied = np.bitwise_or.reduce(bb, axis=1)
+    count = len(batch)
+    return np.stack([_attacks(bb[:, :6], occupied, np.ones(count, dtype=bool)),
+                     _attacks(bb[:, 6:], occupied, np.zeros(count, dtype=bool))], axis=1)
+
+#everything move generation needs about the side to move and its opponent
+class _Sides():
+    def __init__(self, batch):
+        bb = bitboards(batch)
+        white = batch.whiteToMove[:, None]
+        self.own = np.where(white, bb[:, :6], bb[:, 6:])
+        self.enemy = np.where(white, bb[:, 6:], bb[:, :6])
+        self.ownAll = np.bitwise_or.reduce(self.own, axis=1)
+        self.enemyAll = np.bitwise_or.reduce(self.enemy, axis=1)
+        self.occupied = self.ownAll | self.enemyAll
+        self.king = self.own[:, KING]
+        self.kingSquare = bitIndex(self.king)
+
+#pieces of the enemy attacking the own king in occupied, pawns and knights given separately so a capture can
+#take one away
+def _checkers(batch, sides, occupied, enemyPawns):
+    enemy = sides.enemy
+    kingSquare = sides.kingSquare
+    empty = ~occupied
+    found = (KNIGHT_TABLE[kingSquare] & enemy[:, KNIGHT]) | \
+        (PAWN_TABLES[(~batch.whiteToMove).astype(np.int64), kingSquare] & enemyPawns)
+    rooks = enemy[:, ROOK] | enemy[:, QUEEN]
+    bishops = enemy[:, BISHOP] | enemy[:, QUEEN]
+    for dr, dc in ORTHOGONAL:
+        found |= _slide(sides.king, empty, dr, dc) & rooks
+    for dr, dc in DIAGONAL:
+        found |= _slide(sides.king, empty, dr, dc) & bishops
+    return found
+
+def inCheck(batch):
+    sides = _Sides(batch)
+    return _checkers(batch, sides, sides.occupied, sides.enemy[:, PAWN]) != 0
+
+#sliding attacks from many squares at once with the kindergarten tables of bitboard.py, sq an int array and
+#occupied the matching occupancy
+def rookAttacks(sq, occupied):
+    sq = sq.astype(np.uint64)
+    rank = (occupied >> (sq - sq % np.uint64(8) + np.uint64(1))) & np.uint64(63)
+    file = ((((occupied >> (sq % np.uint64(8))) & FILE_A) * FILE_GATHER) >> np.uint64(57)) & np.uint64(63)
+    return RANK_TABLE[sq, rank] | FILE_TABLE[sq, file]
+
+def bishopAttacks(sq, occupied):
+    diagonal = (((occupied & DIAGONAL_MASKS[sq]) * DIAGONAL_GATHER) >> np.uint64(58)) & np.uint64(63)
+    antiDiagonal = (((occupied & ANTI_DIAGONAL_MASKS[sq]) * DIAGONAL_GATHER) >> np.uint64(58)) & np.uint64(63)
+    return DIAGONAL_TABLE[sq, diagonal] | ANTI_DIAGONAL_TABLE[sq, antiDiagonal]
+
+#(N, 64) pseudo-legal destinations of the piece of the side to move on each square, 0 for other squares.
+#Castling isn't included, it has conditions only legal generation checks. Only the squares with a piece on
+#them are worked on, as one flat list over the whole batch
+def pseudoLegalTargets(batch, sides=None):
+    sides = sides if sides is not None else _Sides(batch)
+    boards = batch.boards
+    white = batch.whiteToMove
+    rows, squares = np.nonzero((boards != EMPTY) & ((boards <= WHITE_KING) == white[:, None]))
+    kind = (boards[rows, squares].astype(np.int64) - 1) % 6
+    occupied = sides.occupied[rows]
+    moves = np.zeros(len(rows), dtype=np.uint64)
+
+    for piece, table in ((KNIGHT, KNIGHT_TABLE), (KING, KING_TABLE)):
+        these = kind == piece
+        moves[these] = table[squares[these]]
+    these = (kind == ROOK) | (kind == QUEEN)
+    moves[these] = rookAttacks(squares[these], occupied[these])
+    these = (kind == BISHOP) | (kind == QUEEN)
+    moves[these] |= bishopAttacks(squares[these], occupied[these])
+
+    these = np.nonzero(kind == PAWN)[0]
+    pawnWhite = white[rows[these]]
+    bits = SQUARE_BITS[squares[these]]
+    empty = ~occupied[these]
+    single = np.where(pawnWhite, bits >> np.uint64(8), bits << np.uint64(8)) & empty
+    double = np.where(pawnWhite, (single >> np.uint64(8)) & ROW_4, (single << np.uint64(8)) & ROW_3) & empty
+    epBits = np.where(batch.enpassant >= 0, SQUARE_BITS[np.maximum(batch.enpassant, 0)], np.uint64(0))
+    victims = (sides.enemyAll | epBits)[rows[these]]
+    moves[these] = single | double | (PAWN_TABLES[(~pawnWhite).astype(np.int64), squares[these]] & victims)
+
+    targets = np.zeros(boards.shape, dtype=np.uint64)
+    targets[rows, squares] = moves & ~sides.ownAll[rows]
+    return targets
+
+#(N, 64) legal destinations by start square for the side to move
+def legalTargets(batch):
+    sides = _Sides(batch)
+    count = len(batch)
+    rows = np.arange(count)
+    white = batch.whiteToMove
+    targets = pseudoLegalTargets(batch, sides)
+    empty = ~sides.occupied
+
+    checkers = _checkers(batch, sides, sides.occupied, sides.enemy[:, PAWN])
+    checks = popcount(checkers)
+    evasion = np.where(checks == 0, ALL, np.where(checks == 1, checkers | BETWEEN_TABLE[sides.kingSquare, bitIndex(checkers)],
+                                                  np.uint64(0)))
+    #pinned pieces may only move along the line between the king and the pinner
+    allowed = np.broadcast_to(evasion[:, None], (count, 64)).copy()
+    for directions, sliders in ((ORTHOGONAL, sides.enemy[:, ROOK] | sides.enemy[:, QUEEN]),
+                                (DIAGONAL, sides.enemy[:, BISHOP] | sides.enemy[:, QUEEN])):
+        for dr, dc in directions:
+            toBlocker = _slide(sides.king, empty, dr, dc)
+            blocker = toBlocker & sides.ownAll
+            beyond = _slide(blocker, empty, dr, dc)
+            pinned = np.nonzero((beyond & sliders) != 0)[0]
+            square = bitIndex(blocker[pinned])
+            allowed[pinned, square] &= toBlocker[pinned] | beyond[pinned]
+    legal = targets & allowed
+
+    #the king: squares nothing attacks once it has left its own, plus castling
+    enemyAttacks = _attacks(sides.enemy, sides.occupied & ~sides.king, ~white)
+    kingMoves = KING_TABLE[sides.kingSquare] & ~sides.ownAll & ~enemyAttacks
+    for right, kingFrom, path, safe, to, side in ((Engine.CASTLE_WKS, 60, 0x60 << 56, 0x70 << 56, 62, True),
+                                                  (Engine.CASTLE_WQS, 60, 0x0E << 56, 0x1C << 56, 58, True),
+                                                  (Engine.CASTLE_BKS, 4, 0x60, 0x70, 6, False),
+                                                  (Engine.CASTLE_BQS, 4, 0x0E, 0x1C, 2, False)):
+        can = (white == side) & ((batch.castling & right) != 0) & (sides.kingSquare == kingFrom) & \
+            ((sides.occupied & np.uint64(path)) == 0) & ((enemyAttacks & np.uint64(safe)) == 0)
+        kingMoves |= np.where(can, SQUARE_BITS[to], np.uint64(0))
+    legal[rows, sides.kingSquare] = kingMoves
+
+    #en passant takes two pawns off one line, so it is checked by playing it out
+    for index in np.nonzero(batch.enpassant >= 0)[0]:
+        ep = int(batch.enpassant[index])
+        captured = ep + 8 if white[index] else ep - 8
+        sources = int(PAWN_TABLES[1 if white[index] else 0, ep] & sides.own[index, PAWN]) #the enemy pattern seen from ep
+        for start in range(64):
+            if not sources >> start & 1:
+                continue
+            one = np.array([index])
+            occupied = np.uint64((int(sides.occupied[index]) ^ (1 << start) ^ (1 << captured)) | (1 << ep))
+            attackers = _checkers(batch[one], _sidesAt(sides, one), np.array([occupied]),
+                                  np.array([sides.enemy[index, PAWN] & ~np.uint64(1 << captured)]))
+            if attackers[0]:
+                legal[index, start] &= ~np.uint64(1 << ep)
+            else:
+                legal[index, start] |= np.uint64(1 << ep)
+    return legal
+
+def _sidesAt(sides, rows):
+    picked = _Sides.__new__(_Sides)
+    for name, value in vars(sides).items():
+        setattr(picked, name, value[rows])
+    return picked
+
+#number of legal moves of every position, each promotion counted once per piece it can become
+def legalMoveCounts(batch, legal=None):
+    legal = legal if legal is not None else legalTargets(batch)
+    kind = (batch.boards.astype(np.int64) - 1) % 6
+    promotions = np.where((batch.boards != EMPTY) & (kind == PAWN), legal & PROMOTION_ROWS, np.uint64(0))
+    return popcount(legal).sum(axis=1) + 3 * popcount(promotions).sum(axis=1)
+
+
+#(mg, eg) pawn structure of every position, positive for white, as evaluation.pawnStructure
+def _pawnStructure(batch):
+    grid = batch.boards.reshape(-1, 8, 8)
+    count = len(batch)
+    mg = np.zeros(count, dtype=np.int64)
+    eg = np.zeros(count, dtype=np.int64)
+    rows = np.arange(8)[None, :, None]
+    for side, (code, sign, enemyCode) in enumerate(((WHITE_PAWN, 1, BLACK_PAWN), (BLACK_PAWN, -1, WHITE_PAWN))):
+        own = grid == code
+        enemy = grid == enemyCode
+        perFile = own.sum(axis=1) #(N, 8)
+        doubled = np.maximum(perFile - 1, 0).sum(axis=1)
+        mg += sign * evaluation.DOUBLED_PAWN[0] * doubled
+        eg += sign * evaluation.DOUBLED_PAWN[1] * doubled
+        padded = np.pad(perFile, ((0, 0), (1, 1)))
+        isolated = np.where((padded[:, :-2] + padded[:, 2:]) == 0, perFile, 0).sum(axis=1)
+        mg += sign * evaluation.ISOLATED_PAWN[0] * isolated
+        eg += sign * evaluation.ISOLATED_PAWN[1] * isolated
+        #passed: no enemy pawn ahead on its own or a neighbouring file
+        if code == WHITE_PAWN:
+            front = np.where(enemy, rows, 8).min(axis=1) #most advanced enemy row by file, 8 for none
+            front = np.minimum(np.minimum(front, np.pad(front, ((0, 0), (1, 0)), constant_values=8)[:, :-1]),
+                               np.pad(front, ((0, 0), (0, 1)), constant_values=8)[:, 1:])
+            passed = own & (front[:, None, :] >= rows)
+        else:
+            front = np.where(enemy, rows, -1).max(axis=1)
+            front = np.maximum(np.maximum(front, np.pad(front, ((0, 0), (1, 0)), constant_values=-1)[:, :-1]),
+                               np.pad(front, ((0, 0), (0, 1)), constant_values=-1)[:, 1:])
+            passed = own & (front[:, None, :] <= rows)
+        bonus = passed.reshape(count, 64).astype(np.int64) @ PASSED_BONUS[side]
+        mg += sign * bonus[:, 0]
+        eg += sign * bonus[:, 1]
+    return mg, eg
+
+#static evaluation of every position from the side to move's point of view, the same numbers as
+#evaluation.evaluate with a pawn table (material, piece-square tables, pawn structure, tapered by phase)
+def evaluate(batch, pawns=True):
+    squares = np.arange(64)[None, :]
+    mg = MG_TABLE[batch.boards, squares].sum(axis=1)
+    eg = EG_TABLE[batch.boards, squares].sum(axis=1)
+    if pawns:
+        pawnMg, pawnEg = _pawnStructure(batch)
+        mg += pawnMg
+        eg += pawnEg
+    phase = np.minimum(PHASE_TABLE[batch.boards].sum(axis=1), evaluation.MAX_PHASE)
+    value = (mg * phase + eg * (evaluation.MAX_PHASE - phase)) // evaluation.MAX_PHASE
+    return np.where(batch.whiteToMove, value, -value)
+
+
+#FENs of positions along random games from the start and the perft reference positions
+def randomPositions(count, seed=1):
+    import perft
+    rng = random.Random(seed)
+    starts = [None] + [fen for _, fen, _ in perft.REFERENCE_POSITIONS]
+    fens = []
+    while len(fens) < count:
+        gs = Engine.GameState(backend='bitboard', fen=rng.choice(starts))
+        for _ in range(rng.randint(1, 160)):
+            moves = gs.getValidMoves()
+            if not moves:
+                break
+            gs.makeMove(rng.choice(moves))
+            fens.append(gs.getFen())
+            if len(fens) == count:
+                break
+    return fens
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="batch move generation and evaluation against the scalar GameState path")
+    parser.add_argument("--positions", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--chunk", type=int, default=4096, help="positions per batch call, bounds the memory used")
+    parser.add_argument("--backend", choices=Engine.GameState.BACKENDS, default="bitboard", help="backend of the scalar path")
+    args = parser.parse_args(argv)
+
+    fens = randomPositions(args.positions, args.seed)
+    states = [Engine.GameState(backend=args.backend, fen=fen) for fen in fens]
+
+    start = time.perf_counter()
+    pawnTable = evaluation.PawnHashTable()
+    scalar = [(len(gs.getValidMoves()), gs.inCheck(), evaluation.evaluate(gs, pawnTable)) for gs in states]
+    scalarSeconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    packed = fromGameStates(states)
+    packSeconds = time.perf_counter() - start
+    start = time.perf_counter()
+    counts, checks, scores = [], [], []
+    for first in range(0, len(packed), args.chunk):
+        chunk = packed[first:first + args.chunk]
+        counts.append(legalMoveCounts(chunk))
+        checks.append(inCheck(chunk))
+        scores.append(evaluate(chunk))
+    batchSeconds = time.perf_counter() - start
+    counts, checks, scores = np.concatenate(counts), np.concatenate(checks), np.concatenate(scores)
+
+    mismatches = [i for i, (moves, check, score) in enumerate(scalar)
+                  if (moves, check, score) != (counts[i], checks[i], scores[i])]
+    for i in mismatches[:10]:
+        print("mismatch %s: scalar %s batch %s" % (fens[i], scalar[i], (int(counts[i]), bool(checks[i]), int(scores[i]))))
+    print("%d positions, %d mismatches" % (len(fens), len(mismatches)))
+    print("scalar %8.0f positions/sec" % (len(fens) / scalarSeconds))
+    print("batch  %8.0f positions/sec (%.0f including packing), %.1fx" % (
+        len(fens) / batchSeconds, len(fens) / (batchSeconds + packSeconds), scalarSeconds / batchSeconds))
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
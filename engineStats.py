@@ -0,0 +1,353 @@
+# Opt-in instrumentation: counts calls and time of the move generation and make/undo hot paths, and search
+# level counters, without touching the code it measures. enable() swaps counting wrappers in for the methods
+# listed in HOT_PATHS and for the Searcher's negamax/quiescence/search, disable() puts the originals back, so
+# nothing costs anything unless it is on. Times are inclusive and carry the wrapper's own overhead, which
+# matters most for the cheapest calls (Move construction); compare them with each other, not with a clean run.
+#
+#   python engineStats.py --positions start kiwipete --depth 5 --json stats.json --every 1
+#   python engineStats.py --stacks perft.folded --script perft.py --positions kiwipete --depth 3 --backend bitboard
+#   python engineStats.py --cprofile search.prof --fen "<fen>" --movetime 5
+#
+# --script runs any script in this process with the stats on, only what runs here is counted, work a script
+# hands to a process pool isn't. --stacks samples the call stack while it runs and writes it in the collapsed
+# format flamegraph.pl and speedscope read, --cprofile writes cProfile data for pstats or snakeviz.
+
+import argparse
+import cProfile
+import collections
+import json
+import os
+import pstats
+import runpy
+import sys
+import threading
+import time
+
+import Engine
+import bitboard
+import moveFinder
+import perft
+
+#(class, method) pairs timed when the stats are on. Times include the timed calls underneath, so
+#GameState.movedIntoCheck and inCheck include the getAttackers of either backend they end in. Subclass overrides are
+#separate entries; the BitboardGameState.makeMove and undoMove do the whole move and don't call GameState's
+HOT_PATHS = [(Engine.GameState, name) for name in
+             ('getAllPossibleMoves', 'getValidMoves', 'getCaptureMoves', 'getQuietMoves', 'pseudoLegalMove',
+              'squareUnderAttack', 'inCheck', 'movedIntoCheck', 'getAttackers', 'makeMove', 'undoMove')] + \
+            [(bitboard.BitboardGameState, name) for name in
+             ('getValidMoves', 'getCaptureMoves', 'getQuietMoves', 'getAttackers', 'makeMove', 'undoMove')] + \
+            [(Engine.Move, '__init__'), (Engine.Move, 'fromPacked')]
+CUTOFF_BUCKETS = 16 #cutoffs by the index of the move that caused them, the last bucket takes the rest
+
+
+class Stats():
+    def __init__(self):
+        self.functions = {} #'Class.method': [calls, nanoseconds], the lists stay put so wrappers can hold them
+        self.reset()
+
+    def reset(self):
+        for counter in self.functions.values():
+            counter[0] = counter[1] = 0
+        self.movesGenerated = 0 #moves returned by getValidMoves, for the average branching
+        self.searches = 0
+        self.nodes = 0 #negamax calls
+        self.qnodes = 0 #quiescence calls
+        self.ttProbes = 0
+        self.ttHits = 0
+        self.cutoffs = [0] * CUTOFF_BUCKETS
+        self.iterationNodes = [] #nodes of each completed iteration, per search
+        self.started = time.perf_counter()
+
+    def counter(self, name):
+        return self.functions.setdefault(name, [0, 0])
+
+    #nodes of an iteration over nodes of the one before, averaged over every search
+    def effectiveBranchingFactor(self):
+        ratios = [nodes[i] / nodes[i - 1] for nodes in self.iterationNodes for i in range(1, len(nodes)) if nodes[i - 1]]
+        return sum(ratios) / len(ratios) if ratios else 0.0
+
+    def toDict(self):
+        functions = {name: {"calls": calls, "seconds": ns / 1e9, "usPerCall": ns / calls / 1000 if calls else 0.0}
+                     for name, (calls, ns) in sorted(self.functions.items(), key=lambda item: -item[1][1]) if calls}
+        generated = sum(self.functions[name][0] for name in self.functions if name.endswith('.getValidMoves'))
+        cutoffs = sum(self.cutoffs)
+        return {
+            "seconds": time.perf_counter() - self.started,
+            "functions": functions,
+            "search": {
+                "searches": self.searches,
+                "nodes": self.nodes,
+                "qnodes": self.qnodes,
+                "ttProbes": self.ttProbes,
+                "ttHits": self.ttHits,
+                "ttHitRate": self.ttHits / self.ttProbes if self.ttProbes else 0.0,
+                "cutoffs": cutoffs,
+                "cutoffIndex": self.cutoffs,
+                "firstMoveCutoffRate": self.cutoffs[0] / cutoffs if cutoffs else 0.0,
+                "averageMoves": self.movesGenerated / generated if generated else 0.0,
+                "effectiveBranchingFactor": self.effectiveBranchingFactor(),
+            },
+        }
+
+    def dump(self, path):
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.toDict(), f, indent=1)
+        os.replace(temporary, path)
+
+
+STATS = Stats()
+_originals = [] #(owner, name, original attribute) of everything enable() replaced
+
+
+def _timed(function, counter):
+    clock = time.perf_counter_ns
+    def wrapper(*args, **kwargs):
+        start = clock()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            counter[0] += 1
+            counter[1] += clock() - start
+    wrapper.__wrapped__ = function
+    return wrapper
+
+def _countMoves(function):
+    def wrapper(self):
+        moves = function(self)
+        STATS.movesGenerated += len(moves)
+        return moves
+    wrapper.__wrapped__ = function
+    return wrapper
+
+def _searchWrappers():
+    stats = STATS
+    children = [0] * (moveFinder.MAX_PLY + 2) #moves searched so far by the node at each ply
+    lastChild = [0] * (moveFinder.MAX_PLY + 2) #the last of them, so a PVS re-search isn't counted twice
+
+    negamax = moveFinder.Searcher.negamax
+    def countedNegamax(self, gs, depth, alpha, beta, ply):
+        stats.nodes += 1
+        if ply > 0:
+            move = gs.moveLog[-1].packed
+            if lastChild[ply - 1] != move:
+                children[ply - 1] += 1
+                lastChild[ply - 1] = move
+        children[ply] = 0
+        lastChild[ply] = 0
+        score = negamax(self, gs, depth, alpha, beta, ply)
+        if score >= beta and children[ply]: #a cutoff after searching moves, not one straight from the table
+            stats.cutoffs[min(children[ply], CUTOFF_BUCKETS) - 1] += 1
+        return score
+
+    quiescence = moveFinder.Searcher.quiescence
+    def countedQuiescence(self, gs, alpha, beta, ply):
+        stats.qnodes += 1
+        return quiescence(self, gs, alpha, beta, ply)
+
+    search = moveFinder.Searcher.search
+    def countedSearch(self, gs, *args, onIteration=None, **kwargs):
+        tt = self.tt
+        probes, hits = tt.probes, tt.hits
+        iterations = []
+        def recordIteration(result):
+            iterations.append(result.nodes - sum(iterations))
+            if onIteration is not None:
+                onIteration(result)
+        try:
+            return search(self, gs, *args, onIteration=recordIteration, **kwargs)
+        finally:
+            stats.searches += 1
+            stats.ttProbes += tt.probes - probes
+            stats.ttHits += tt.hits - hits
+            stats.iterationNodes.append(iterations)
+
+    return {'negamax': countedNegamax, 'quiescence': countedQuiescence, 'search': countedSearch}
+
+_WRAPPER_CODES = {_timed(None, None).__code__, _countMoves(None).__code__} | \
+                 {wrapper.__code__ for wrapper in _searchWrappers().values()}
+
+def _replace(owner, name, attribute):
+    _originals.append((owner, name, owner.__dict__[name]))
+    setattr(owner, name, attribute)
+
+#swap the counting wrappers in and return the Stats they count into. Calling it again changes nothing
+def enable():
+    if _originals:
+        return STATS
+    for owner, name in HOT_PATHS:
+        original = owner.__dict__[name]
+        counter = STATS.counter("%s.%s" % (owner.__name__, name))
+        if isinstance(original, classmethod):
+            _replace(owner, name, classmethod(_timed(original.__func__, counter)))
+        else:
+            function = _countMoves(original) if name == 'getValidMoves' else original
+            _replace(owner, name, _timed(function, counter))
+    for name, wrapper in _searchWrappers().items():
+        _replace(moveFinder.Searcher, name, wrapper)
+    STATS.reset()
+    return STATS
+
+def disable():
+    while _originals:
+        owner, name, original = _originals.pop()
+        setattr(owner, name, original)
+
+def enabled():
+    return bool(_originals)
+
+
+#writes the stats to path every every seconds while a run goes on, and once more when stopped
+class Dumper():
+    def __init__(self, path, every=1.0, stats=STATS):
+        self.path = path
+        self.every = every
+        self.stats = stats
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopEvent.wait(self.every):
+            self.stats.dump(self.path)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopEvent.set()
+        self.thread.join()
+        self.stats.dump(self.path)
+
+
+#statistical profiler: a thread looks at the stack of the profiled thread every interval seconds and counts
+#each distinct stack. Unlike cProfile it doesn't slow the code down per call, so deep recursions like the
+#search keep their real proportions
+class Sampler():
+    def __init__(self, interval=0.001, threadId=None):
+        self.interval = interval
+        self.threadId = threadId if threadId is not None else threading.get_ident()
+        self.stacks = collections.Counter()
+        self.stopEvent = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.switchInterval = None
+
+    def run(self):
+        frames = sys._current_frames
+        while not self.stopEvent.wait(self.interval):
+            frame = frames().get(self.threadId)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                if code not in _WRAPPER_CODES: #the counting wrappers would double the depth of every stack
+                    stack.append("%s:%s" % (os.path.basename(code.co_filename), code.co_name))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        #the sampling thread only runs when the interpreter switches threads, every 5ms by default
+        self.switchInterval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.switchInterval, self.interval))
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopEvent.set()
+        self.thread.join()
+        sys.setswitchinterval(self.switchInterval)
+
+    #one 'outer;...;inner count' line per stack, the input of flamegraph.pl
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write("%s %d\n" % (stack, count))
+
+
+def _runScript(argv):
+    path = argv[0]
+    savedArgv, savedPath = sys.argv, list(sys.path)
+    sys.argv = list(argv)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+    try:
+        runpy.run_path(path, run_name='__main__')
+    except SystemExit as exit:
+        if exit.code not in (None, 0):
+            print("%s exited with %s" % (path, exit.code), file=sys.stderr)
+    finally:
+        sys.argv, sys.path = savedArgv, savedPath
+
+def _runSearches(args):
+    fens = {name: fen for name, fen, _ in perft.REFERENCE_POSITIONS}
+    positions = [fens[name] for name in args.positions] + (args.fen or [])
+    searcher = moveFinder.Searcher(args.hash)
+    for fen in positions:
+        searcher.tt.clear()
+        searcher.clearHeuristics()
+        result = searcher.search(Engine.GameState(backend=args.backend, fen=fen), depth=args.depth, movetime=args.movetime)
+        print("%s: %s" % (fen, result), file=sys.stderr)
+
+def report(stats, out=sys.stdout):
+    record = stats.toDict()
+    out.write("%-34s %10s %10s %10s\n" % ("function", "calls", "seconds", "us/call"))
+    for name, entry in record["functions"].items():
+        out.write("%-34s %10d %10.3f %10.2f\n" % (name, entry["calls"], entry["seconds"], entry["usPerCall"]))
+    for key, value in record["search"].items():
+        out.write("%-26s %s\n" % (key, "%.3f" % value if isinstance(value, float) else value))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="count calls and time in the engine's hot paths during a run")
+    parser.add_argument("--positions", nargs="*", default=[], help="reference positions of perft.py to search")
+    parser.add_argument("--fen", action="append", help="another position to search, may be repeated")
+    parser.add_argument("--depth", type=int)
+    parser.add_argument("--movetime", type=float, help="seconds per position")
+    parser.add_argument("--hash", type=int, default=16)
+    parser.add_argument("--backend", choices=Engine.GameState.BACKENDS, default="bitboard")
+    parser.add_argument("--script", nargs=argparse.REMAINDER, help="run this script with its arguments instead")
+    parser.add_argument("--json", help="write the stats here as JSON")
+    parser.add_argument("--every", type=float, help="also rewrite the --json file every this many seconds")
+    parser.add_argument("--stacks", help="sample the stack and write collapsed stacks for a flame graph here")
+    parser.add_argument("--interval", type=float, default=0.001, help="seconds between stack samples")
+    parser.add_argument("--cprofile", help="run under cProfile and write its data here")
+    parser.add_argument("--off", action="store_true", help="don't count, only profile")
+    args = parser.parse_args(argv)
+    if not args.script and not args.positions and not args.fen:
+        args.positions = ["start"]
+    if not args.script and args.depth is None and args.movetime is None:
+        args.depth = 4
+    if args.every and not args.json:
+        parser.error("--every needs --json")
+
+    stats = STATS if args.off else enable()
+    dumper = Dumper(args.json, args.every).start() if args.every else None
+    sampler = Sampler(args.interval).start() if args.stacks else None
+    profiler = cProfile.Profile() if args.cprofile else None
+    if profiler is not None:
+        profiler.enable()
+    try:
+        if args.script:
+            _runScript(args.script)
+        else:
+            _runSearches(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.cprofile)
+        if sampler is not None:
+            sampler.stop()
+            sampler.write(args.stacks)
+        if dumper is not None:
+            dumper.stop()
+        elif args.json:
+            stats.dump(args.json)
+        disable()
+    if not args.off:
+        report(stats)
+    if profiler is not None:
+        pstats.Stats(args.cprofile, stream=sys.stderr).sort_stats("cumulative").print_stats(20)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+# Runs moveFinder searches in a separate process so the pygame loop keeps drawing and handling input while the
+# engine thinks. The position goes over as its starting FEN plus the moves played, progress and the best move
+# come back on a queue that the caller polls once per frame, and a search can be cancelled at any time.
+# The worker keeps one Searcher for its whole life, so pondering on the opponent's time fills the
+# transposition table the real search then starts from.
+
+import multiprocessing as mp
+import os
+import queue
+
+import Engine
+import moveFinder
+import openingBook
+import tablebase
+
+
+#(startFen, [move notation, ...]) for gs, optionally followed by extra moves
+def serializePosition(gs, extraMoves=()):
+    return (gs.startFen, [move.getChessNotation() for move in gs.moveLog] + list(extraMoves))
+
+def loadPosition(position, backend='mailbox'):
+    startFen, moves = position
+    gs = Engine.GameState(backend=backend, fen=startFen)
+    for notation in moves:
+        for move in gs.getValidMoves():
+            if move.getChessNotation() == notation:
+                gs.makeMove(move)
+                break
+        else:
+            raise ValueError("illegal move %s in serialized position" % notation)
+    return gs
+
+
+#the stop flag for one search: it is cancelled once the shared counter reaches its id, so a cancel can't be
+#lost between the parent sending a search and the worker picking it up
+class _Cancelled():
+    def __init__(self, cancelledUpTo, searchId):
+        self.cancelledUpTo = cancelledUpTo
+        self.searchId = searchId
+
+    def is_set(self):
+        return self.cancelledUpTo.value >= self.searchId
+
+
+def _workerMain(commands, results, cancelledUpTo, ttSizeMb, backend, bookPath, tablebasePath):
+    tablebases = tablebase.Tablebases(tablebasePath) if tablebasePath and os.path.isdir(tablebasePath) else None
+    searcher = moveFinder.Searcher(ttSizeMb, tablebases=tablebases)
+    book = openingBook.OpeningBook(bookPath) if bookPath and os.path.exists(bookPath) else None
+    while True:
+        command = commands.get()
+        if command is None:
+            return
+        searchId, position, limits = command
+        if cancelledUpTo.value >= searchId:
+            continue #cancelled before it started
+        try:
+            gs = loadPosition(position, backend)
+        except ValueError as error:
+            results.put(('error', searchId, str(error)))
+            continue
+        if book is not None and limits: #a real search, pondering has no limits and is never answered from the book
+            move = book.pickMove(gs)
+            if move is not None:
+                notation = move.getChessNotation()
+                results.put(('bestmove', searchId, notation, 0, 0, 0, [notation]))
+                continue
+        def onIteration(result):
+            results.put(('info', searchId, result.depth, result.score, result.nodes, result.nps(),
+                         [move.getChessNotation() for move in result.pv]))
+        try:
+            result = searcher.search(gs, stopEvent=_Cancelled(cancelledUpTo, searchId), onIteration=onIteration, **limits)
+        except Exception as error: #the caller waits for an answer to every search, so a failure has to answer too
+            results.put(('error', searchId, "%s: %s" % (type(error).__name__, error)))
+            continue
+        results.put(('bestmove', searchId, result.bestMove.getChessNotation() if result.bestMove else None,
+                     result.score, result.depth, result.nodes, [move.getChessNotation() for move in result.pv]))
+
+
+class EngineWorker():
+    #bookPath is an opening book file, its moves are played without searching while the game is in book.
+    #tablebasePath is a directory of tablebase.py tables the search probes
+    def __init__(self, ttSizeMb=64, backend='bitboard', bookPath=None, tablebasePath=None):
+        context = mp.get_context('spawn') #a fresh interpreter, nothing of pygame's state gets copied over
+        self.commands = context.Queue()
+        self.results = context.Queue()
+        self.cancelledUpTo = context.Value('i', 0)
+        self.process = context.Process(target=_workerMain, daemon=True, args=(self.commands, self.results, self.cancelledUpTo,
+                                                                              ttSizeMb, backend, bookPath, tablebasePath))
+        self.process.start()
+        self.searchId = 0
+        self.pondering = False
+        self.latestInfo = None #last ('info', ...) message of the current search
+
+    #start searching gs, cancelling whatever was running. Returns the id messages for it will carry
+    def startSearch(self, gs, movetime=None, depth=None, nodes=None):
+        return self._start(serializePosition(gs), {'movetime': movetime, 'depth': depth, 'nodes': nodes}, False)
+
+    #think about the position after the reply we expect, with no limit, until cancelled
+    def startPonder(self, gs, predictedMove):
+        return self._start(serializePosition(gs, [predictedMove]), {}, True)
+
+    def _start(self, position, limits, pondering):
+        self.cancel()
+        self.searchId += 1
+        self.pondering = pondering
+        self.latestInfo = None
+        self.commands.put((self.searchId, position, limits))
+        return self.searchId
+
+    def cancel(self):
+        with self.cancelledUpTo.get_lock():
+            self.cancelledUpTo.value = self.searchId
+        self.pondering = False
+
+    #messages for the current search that arrived since the last poll, never blocks.
+    #('info', id, depth, score, nodes, nps, pv) for progress, ('bestmove', id, move, score, depth, nodes, pv) at the end,
+    #('error', id, text) if the position couldn't be rebuilt or the search failed
+    def poll(self):
+        messages = []
+        while True:
+            try:
+                message = self.results.get_nowait()
+            except queue.Empty:
+                return messages
+            if message[1] != self.searchId or self.cancelledUpTo.value >= self.searchId:
+                continue #left over from a cancelled search
+            if message[0] == 'info':
+                self.latestInfo = message
+            messages.append(message)
+
+    def close(self):
+        self.cancel()
+        self.commands.put(None)
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
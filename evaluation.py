@@ -0,0 +1,240 @@
+# Static evaluation: material and piece-square tables for the middlegame and the endgame, blended by how much
+# material is left (a tapered eval), plus pawn structure terms.
+#
+# GameState keeps the material + piece-square sum and the game phase up to date in makeMove the way it keeps
+# the zobrist key, so a leaf only has to blend two numbers. A middlegame and an endgame score travel together
+# as one packed int, mg + (eg << 16), which adds and subtracts like a single score. Pawn structure only changes
+# when pawns move, so it is cached in a PawnHashTable keyed by a hash of the pawns alone.
+# test_evaluation.py checks the incremental scores against computeScores after every make and undo.
+
+from array import array
+
+import zobrist
+
+#piece-square tables from white's side, indexed by row*8 + col (a8 first). Values from PeSTO
+_MG_TABLES = {
+    'p': (
+          0,   0,   0,   0,   0,   0,   0,   0,
+         98, 134,  61,  95,  68, 126,  34, -11,
+         -6,   7,  26,  31,  65,  56,  25, -20,
+        -14,  13,   6,  21,  23,  12,  17, -23,
+        -27,  -2,  -5,  12,  17,   6,  10, -25,
+        -26,  -4,  -4, -10,   3,   3,  33, -12,
+        -35,  -1, -20, -23, -15,  24,  38, -22,
+          0,   0,   0,   0,   0,   0,   0,   0),
+    'N': (
+        -167, -89, -34, -49,  61, -97, -15, -107,
+         -73, -41,  72,  36,  23,  62,   7,  -17,
+         -47,  60,  37,  65,  84, 129,  73,   44,
+          -9,  17,  19,  53,  37,  69,  18,   22,
+         -13,   4,  16,  13,  28,  19,  21,   -8,
+         -23,  -9,  12,  10,  19,  17,  25,  -16,
+         -29, -53, -12,  -3,  -1,  18, -14,  -19,
+        -105, -21, -58, -33, -17, -28, -19,  -23),
+    'B': (
+        -29,   4, -82, -37, -25, -42,   7,  -8,
+        -26,  16, -18, -13,  30,  59,  18, -47,
+        -16,  37,  43,  40,  35,  50,  37,  -2,
+         -4,   5,  19,  50,  37,  37,   7,  -2,
+         -6,  13,  13,  26,  34,  12,  10,   4,
+          0,  15,  15,  15,  14,  27,  18,  10,
+          4,  15,  16,   0,   7,  21,  33,   1,
+        -33,  -3, -14, -21, -13, -12, -39, -21),
+    'R': (
+         32,  42,  32,  51,  63,   9,  31,  43,
+         27,  32,  58,  62,  80,  67,  26,  44,
+         -5,  19,  26,  36,  17,  45,  61,  16,
+        -24, -11,   7,  26,  24,  35,  -8, -20,
+        -36, -26, -12,  -1,   9,  -7,   6, -23,
+        -45, -25, -16, -17,   3,   0,  -5, -33,
+        -44, -16, -20,  -9,  -1,  11,  -6, -71,
+        -19, -13,   1,  17,  16,   7, -37, -26),
+    'Q': (
+        -28,   0,  29,  12,  59,  44,  43,  45,
+        -24, -39,  -5,   1, -16,  57,  28,  54,
+        -13, -17,   7,   8,  29,  56,  47,  57,
+        -27, -27, -16, -16,  -1,  17,  -2,   1,
+         -9, -26,  -9, -10,  -2,  -4,   3,  -3,
+        -14,   2, -11,  -2,  -5,   2,  14,   5,
+        -35,  -8,  11,   2,   8,  15,  -3,   1,
+         -1, -18,  -9,  10, -15, -25, -31, -50),
+    'K': (
+        -65,  23,  16, -15, -56, -34,   2,  13,
+         29,  -1, -20,  -7,  -8,  -4, -38, -29,
+         -9,  24,   2, -16, -20,   6,  22, -22,
+        -17, -20, -12, -27, -30, -25, -14, -36,
+        -49,  -1, -27, -39, -46, -44, -33, -51,
+        -14, -14, -22, -46, -44, -30, -15, -27,
+          1,   7,  -8, -64, -43, -16,   9,   8,
+        -15,  36,  12, -54,   8, -28,  24,  14),
+}
+_EG_TABLES = {
+    'p': (
+          0,   0,   0,   0,   0,   0,   0,   0,
+        178, 173, 158, 134, 147, 132, 165, 187,
+         94, 100,  85,  67,  56,  53,  82,  84,
+         32,  24,  13,   5,  -2,   4,  17,  17,
+         13,   9,  -3,  -7,  -7,  -8,   3,  -1,
+          4,   7,  -6,   1,   0,  -5,  -1,  -8,
+         13,   8,   8,  10,  13,   0,   2,  -7,
+          0,   0,   0,   0,   0,   0,   0,   0),
+    'N': (
+        -58, -38, -13, -28, -31, -27, -63, -99,
+        -25,  -8, -25,  -2,  -9, -25, -24, -52,
+        -24, -20,  10,   9,  -1,  -9, -19, -41,
+        -17,   3,  22,  22,  22,  11,   8, -18,
+        -18,  -6,  16,  25,  16,  17,   4, -18,
+        -23,  -3,  -1,  15,  10,  -3, -20, -22,
+        -42, -20, -10,  -5,  -2, -20, -23, -44,
+        -29, -51, -23, -15, -22, -18, -50, -64),
+    'B': (
+        -14, -21, -11,  -8,  -7,  -9, -17, -24,
+         -8,  -4,   7, -12,  -3, -13,  -4, -14,
+          2,  -8,   0,  -1,  -2,   6,   0,   4,
+         -3,   9,  12,   9,  14,  10,   3,   2,
+         -6,   3,  13,  19,   7,  10,  -3,  -9,
+        -12,  -3,   8,  10,  13,   3,  -7, -15,
+        -14, -18,  -7,  -1,   4,  -9, -15, -27,
+        -23,  -9, -23,  -5,  -9, -16,  -5, -17),
+    'R': (
+         13,  10,  18,  15,  12,  12,   8,   5,
+         11,  13,  13,  11,  -3,   3,   8,   3,
+          7,   7,   7,   5,   4,  -3,  -5,  -3,
+          4,   3,  13,   1,   2,   1,  -1,   2,
+          3,   5,   8,   4,  -5,  -6,  -8, -11,
+         -4,   0,  -5,  -1,  -7, -12,  -8, -16,
+         -6,  -6,   0,   2,  -9,  -9, -11,  -3,
+         -9,   2,   3,  -1,  -5, -13,   4, -20),
+    'Q': (
+         -9,  22,  22,  27,  27,  19,  10,  20,
+        -17,  20,  32,  41,  58,  25,  30,   0,
+        -20,   6,   9,  49,  47,  35,  19,   9,
+          3,  22,  24,  45,  57,  40,  57,  36,
+        -18,  28,  19,  47,  31,  34,  39,  23,
+        -16, -27,  15,   6,   9,  17,  10,   5,
+        -22, -23, -30, -16, -16, -23, -36, -32,
+        -33, -28, -22, -43,  -5, -32, -20, -41),
+    'K': (
+        -74, -35, -18, -18, -11,  15,   4, -17,
+        -12,  17,  14,  17,  17,  38,  23,  11,
+         10,  17,  23,  15,  20,  45,  44,  13,
+         -8,  22,  24,  27,  26,  33,  26,   3,
+        -18,  -4,  21,  24,  27,  23,   9, -11,
+        -19,  -3,  11,  21,  23,  16,   7,  -9,
+        -27, -11,   4,  13,  14,   4,  -5, -17,
+        -53, -34, -21, -11, -28, -14, -24, -43),
+}
+MG_VALUES = {'p': 82, 'N': 337, 'B': 365, 'R': 477, 'Q': 1025, 'K': 0}
+EG_VALUES = {'p': 94, 'N': 281, 'B': 297, 'R': 512, 'Q': 936, 'K': 0}
+
+MAX_PHASE = 24 #the phase with all the pieces on the board, a pure middlegame
+PHASE_WEIGHTS = {'--': 0, 'wp': 0, 'bp': 0, 'wN': 1, 'bN': 1, 'wB': 1, 'bB': 1, 'wR': 2, 'bR': 2, 'wQ': 4, 'bQ': 4,
+                 'wK': 0, 'bK': 0}
+
+#pawn structure, (mg, eg) per pawn
+DOUBLED_PAWN = (-10, -20)
+ISOLATED_PAWN = (-12, -16)
+PASSED_PAWN = [(0, 0), (5, 10), (10, 20), (15, 35), (25, 60), (40, 100), (60, 150), (0, 0)] #by ranks advanced
+
+
+def pack(mg, eg):
+    return mg + (eg << 16)
+
+def unpack(score):
+    mg = ((score + 0x8000) & 0xFFFF) - 0x8000
+    return mg, (score - mg) >> 16
+
+#packed material + piece-square score of every piece on every square, positive for white. Black mirrors white
+PST = {'--': [0] * 64}
+for _piece in MG_VALUES:
+    PST['w' + _piece] = [pack(MG_VALUES[_piece] + _MG_TABLES[_piece][sq], EG_VALUES[_piece] + _EG_TABLES[_piece][sq])
+                         for sq in range(64)]
+    PST['b' + _piece] = [-PST['w' + _piece][sq ^ 56] for sq in range(64)]
+
+
+#(packed score, phase, pawn key) of the position in gs, built from scratch
+def computeScores(gs):
+    score = 0
+    phase = 0
+    pawnKey = 0
+    for r in range(8):
+        for c in range(8):
+            piece = gs.board[r][c]
+            score += PST[piece][r * 8 + c]
+            phase += PHASE_WEIGHTS[piece]
+            if piece[1] == 'p':
+                pawnKey ^= zobrist.PIECE_KEYS[piece][r * 8 + c]
+    return score, phase, pawnKey
+
+#packed pawn structure score of board, positive for white
+def pawnStructure(board):
+    files = {'w': [[] for _ in range(8)], 'b': [[] for _ in range(8)]} #rows of the pawns on each file
+    for r in range(8):
+        for c in range(8):
+            if board[r][c][1] == 'p':
+                files[board[r][c][0]][c].append(r)
+    mg = eg = 0
+    for color, sign in (('w', 1), ('b', -1)):
+        own, enemy = files[color], files['b' if color == 'w' else 'w']
+        for c in range(8):
+            rows = own[c]
+            if not rows:
+                continue
+            if len(rows) > 1:
+                mg += sign * DOUBLED_PAWN[0] * (len(rows) - 1)
+                eg += sign * DOUBLED_PAWN[1] * (len(rows) - 1)
+            neighbours = [f for f in (c - 1, c + 1) if 0 <= f < 8]
+            if not any(own[f] for f in neighbours):
+                mg += sign * ISOLATED_PAWN[0] * len(rows)
+                eg += sign * ISOLATED_PAWN[1] * len(rows)
+            for r in rows:
+                #passed: no enemy pawn in front of it on its own or a neighbouring file
+                if color == 'w':
+                    passed = all(enemyRow >= r for f in [c] + neighbours for enemyRow in enemy[f])
+                    advanced = 6 - r
+                else:
+                    passed = all(enemyRow <= r for f in [c] + neighbours for enemyRow in enemy[f])
+                    advanced = r - 1
+                if passed:
+                    mg += sign * PASSED_PAWN[advanced][0]
+                    eg += sign * PASSED_PAWN[advanced][1]
+    return pack(mg, eg)
+
+
+#pawn structure scores by pawn key in flat arrays. An empty slot has key 0, which is also the key of a
+#position without pawns, whose structure score really is 0
+class PawnHashTable():
+    def __init__(self, sizeKb=256):
+        slots = 1
+        while slots * 2 * 16 <= sizeKb * 1024:
+            slots *= 2
+        self.slotMask = slots - 1
+        self.keys = array('Q', [0]) * slots
+        self.scores = array('q', [0]) * slots
+        self.hits = 0
+        self.misses = 0
+
+    def probe(self, gs):
+        key = gs.pawnKey
+        slot = key & self.slotMask
+        if self.keys[slot] == key:
+            self.hits += 1
+            return self.scores[slot]
+        self.misses += 1
+        score = pawnStructure(gs.board)
+        self.keys[slot] = key
+        self.scores[slot] = score
+        return score
+
+
+#evaluation of gs in centipawns from the point of view of the side to move. Leaves the board alone: it blends
+#the incrementally kept scores, and looks the pawn structure up in pawnTable when one is given
+def evaluate(gs, pawnTable=None):
+    score = gs.pstScore
+    if pawnTable is not None:
+        score += pawnTable.probe(gs)
+    mg, eg = unpack(score)
+    phase = min(gs.gamePhase, MAX_PHASE) #early promotions can push it past a full board
+    value = (mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE
+    return value if gs.whiteToMove else -value
+
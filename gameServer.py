@@ -0,0 +1,496 @@
+# Game server: hosts many games at once for clients speaking line delimited JSON over TCP or a Unix socket,
+# with engine moves computed on a process pool.
+#
+#   python gameServer.py serve --port 8765 --workers 2 --store sessions.db --idle 300
+#   python gameServer.py load --port 8765 --sessions 2000 --connections 20 --requests 20000 --go-every 200
+#
+# Every request is one JSON object on a line, answered by one line carrying the same "id":
+#   {"id": 1, "op": "new", "fen": "<optional>"}            -> {"id": 1, "ok": true, "session": 7, "fen": ..., "status": ...}
+#   {"id": 2, "op": "move", "session": 7, "move": "e2e4"}  same answer, or {"ok": false, "error": ...} if illegal
+#   {"id": 3, "op": "undo" | "reset" | "state" | "close", "session": 7}
+#   {"id": 4, "op": "go", "session": 7, "movetime": 0.1, "depth": null, "nodes": null, "play": true}
+#                                                          -> bestMove, score, depth, nodes, pv, and the new state if played
+#   {"id": 5, "op": "stats"}                               -> sessions in memory and on disk, resident memory
+# "legal": true in a request adds the legal moves of the resulting position. undo takes back one move and reset
+# goes back to the start position, like z and r in Main.py. "status" is "ongoing", "checkmate" or "stalemate".
+#
+# A session is only its packed position, the start FEN when it isn't the standard one and the moves as 2 byte
+# compact ids, a few hundred bytes in all; a GameState is built from the packed position for each request and
+# dropped again. Sessions idle for --idle seconds move to a dbm file and come back on their next request, and
+# every session is written there on shutdown, so games survive a restart.
+# The load generator reports latency percentiles per operation and sessions per GB of server memory.
+
+import argparse
+import array
+import asyncio
+import concurrent.futures
+import dbm
+import json
+import multiprocessing as mp
+import os
+import random
+import signal
+import struct
+import sys
+import time
+
+import Engine
+import moveFinder
+
+BACKEND = 'mailbox' #built for one request and thrown away, the bitboards aren't worth setting up
+POSITION = struct.Struct('>32sBBHH') #board as 4 bit MOVE_PIECES indices, side to move | castling << 1,
+                                     #en passant square or NO_SQUARE, halfmove clock, fullmove number
+NO_SQUARE = 255
+_STORED = struct.Struct('>%dsH' % POSITION.size) #position, length of the start FEN; the FEN and moves follow
+NEXT_ID_KEY = 'nextId'
+EVICT_EVERY = 5.0 #seconds between scans for idle sessions
+DEFAULT_MOVETIME = 0.1 #seconds, for a go with no limits
+MAX_MOVETIME = 10.0
+ENGINE_JOBS_PER_WORKER = 2 #engine requests handed to the pool at once, the rest wait in the server
+
+
+def packPosition(gs):
+    board = gs.board
+    index = Engine.MOVE_PIECE_INDEX
+    squares = bytes(index[board[r][c]] | (index[board[r][c + 1]] << 4) for r in range(8) for c in range(0, 8, 2))
+    ep = gs.enpassantPossible
+    return POSITION.pack(squares, gs.whiteToMove | (gs.castlingRights << 1), ep[0] * 8 + ep[1] if ep else NO_SQUARE,
+                         min(gs.halfmoveClock, 0xFFFF), (gs.startPly + len(gs.moveLog)) // 2 + 1)
+
+def positionFen(data):
+    squares, flags, ep, halfmove, fullmove = POSITION.unpack(data)
+    rows = []
+    for r in range(8):
+        text = ''
+        empty = 0
+        for c in range(8):
+            piece = Engine.MOVE_PIECES[(squares[r * 4 + c // 2] >> (4 * (c & 1))) & 15]
+            if piece == '--':
+                empty += 1
+                continue
+            if empty:
+                text += str(empty)
+                empty = 0
+            text += piece[1].upper() if piece[0] == 'w' else piece[1].lower()
+        rows.append(text + (str(empty) if empty else ''))
+    castling = ''.join(char for char, right in (('K', Engine.CASTLE_WKS), ('Q', Engine.CASTLE_WQS),
+                                                ('k', Engine.CASTLE_BKS), ('q', Engine.CASTLE_BQS))
+                       if (flags >> 1) & right) or '-'
+    return "%s %s %s %s %d %d" % ('/'.join(rows), 'w' if flags & 1 else 'b', castling,
+                                  Engine.SQUARE_NAMES[ep] if ep != NO_SQUARE else '-', halfmove, fullmove)
+
+START_POSITION = packPosition(Engine.GameState(backend=BACKEND))
+
+
+class Session():
+    __slots__ = ('position', 'startFen', 'moves', 'lastUsed')
+
+    def __init__(self, position, startFen=None, moves=None):
+        self.position = position
+        self.startFen = startFen #None for the standard start position
+        self.moves = moves if moves is not None else array.array('H') #compact move ids
+        self.lastUsed = time.monotonic()
+
+    def gameState(self):
+        return Engine.GameState(backend=BACKEND, fen=positionFen(self.position))
+
+    #the whole game from its start, with the repetition history a GameState of the position alone lacks
+    def replay(self):
+        gs = Engine.GameState(backend=BACKEND, fen=self.startFen)
+        for compactID in self.moves:
+            gs.makeMove(Engine.Move.fromCompactID(compactID, gs.board))
+        return gs
+
+    def encode(self):
+        startFen = (self.startFen or '').encode()
+        return _STORED.pack(self.position, len(startFen)) + startFen + self.moves.tobytes()
+
+    @classmethod
+    def decode(cls, data):
+        position, length = _STORED.unpack_from(data)
+        start = _STORED.size
+        moves = array.array('H')
+        moves.frombytes(data[start + length:])
+        return cls(position, data[start:start + length].decode() or None, moves)
+
+
+#sessions that went idle, in a dbm file keyed by session id. A restored session is left in the file rather
+#than deleted (deleting is slow in some dbm flavours); it is written over when it goes idle again
+class SessionStore():
+    def __init__(self, path):
+        self.db = dbm.open(path, 'c')
+
+    def put(self, sessionId, session):
+        self.db[str(sessionId)] = session.encode()
+
+    def get(self, sessionId):
+        data = self.db.get(str(sessionId))
+        return Session.decode(data) if data is not None else None
+
+    def delete(self, sessionId):
+        if str(sessionId) in self.db:
+            del self.db[str(sessionId)]
+
+    def __len__(self):
+        return len(self.db) - (NEXT_ID_KEY in self.db)
+
+    def close(self):
+        self.db.close()
+
+
+_searcher = None
+
+def _initWorker(ttSizeMb):
+    global _searcher
+    _searcher = moveFinder.Searcher(ttSizeMb)
+
+#search the game of a session in a worker process, replayed from its start so repetitions count
+def searchGame(startFen, moves, limits):
+    session = Session(START_POSITION, startFen, array.array('H', moves))
+    gs = session.replay()
+    result = _searcher.search(gs, **limits)
+    return {"bestMove": result.bestMove.getChessNotation() if result.bestMove else None, "score": result.score,
+            "depth": result.depth, "nodes": result.nodes, "pv": [move.getChessNotation() for move in result.pv]}
+
+#resident set size of this process in bytes
+def residentBytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource #not on Windows
+    except ImportError:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 #the peak, on systems without /proc
+
+
+class RequestError(Exception):
+    pass
+
+
+class GameServer():
+    def __init__(self, storePath, workers=1, ttSizeMb=16, idleSeconds=300.0):
+        self.sessions = {} #id: Session, the ones in memory
+        self.store = SessionStore(storePath)
+        self.nextId = int(self.store.db.get(NEXT_ID_KEY, b'1'))
+        self.idleSeconds = idleSeconds
+        self.workers = workers
+        self.ttSizeMb = ttSizeMb
+        self.pool = self.newPool()
+        self.engineSlots = asyncio.Semaphore(workers * ENGINE_JOBS_PER_WORKER)
+        self.requests = 0
+        self.evictions = 0
+        self.restores = 0
+
+    def newPool(self):
+        return concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=mp.get_context('spawn'),
+                                                      initializer=_initWorker, initargs=(self.ttSizeMb,))
+
+    def session(self, request):
+        sessionId = request.get('session')
+        if not isinstance(sessionId, int):
+            raise RequestError("a session id is needed")
+        session = self.sessions.get(sessionId)
+        if session is None:
+            session = self.store.get(sessionId)
+            if session is None:
+                raise RequestError("no session %s" % sessionId)
+            self.sessions[sessionId] = session
+            self.restores += 1
+        session.lastUsed = time.monotonic()
+        return session
+
+    #the answer to every request that changes or shows a game
+    def state(self, session, gs=None, legal=False):
+        if gs is None:
+            gs = session.gameState()
+        moves = gs.getValidMoves()
+        reply = {"fen": gs.getFen(), "ply": len(session.moves),
+                 "status": "checkmate" if gs.checkMate else "stalemate" if gs.staleMate else "ongoing"}
+        if legal:
+            reply["legal"] = [move.getChessNotation() for move in moves]
+        return reply
+
+    def play(self, session, notation):
+        gs = session.gameState()
+        for move in gs.getValidMoves():
+            if move.getChessNotation() == notation:
+                gs.makeMove(move)
+                session.position = packPosition(gs)
+                session.moves.append(move.getCompactID())
+                return gs
+        raise RequestError("illegal move %s" % notation)
+
+    #every request but go, answered straight away
+    def handle(self, request):
+        op = request.get('op')
+        legal = bool(request.get('legal'))
+        if op == 'new':
+            fen = request.get('fen')
+            if fen is not None and not isinstance(fen, str):
+                raise RequestError("fen is a string")
+            try:
+                gs = Engine.GameState(backend=BACKEND, fen=fen) #rejects positions without both kings too
+            except ValueError as error:
+                raise RequestError("bad fen: %s" % error)
+            sessionId = self.nextId
+            self.nextId += 1
+            session = Session(packPosition(gs), fen)
+            self.sessions[sessionId] = session
+            return dict(self.state(session, gs, legal), session=sessionId)
+        if op == 'stats':
+            return {"sessions": len(self.sessions), "stored": len(self.store), "requests": self.requests,
+                    "evictions": self.evictions, "restores": self.restores, "residentBytes": residentBytes()}
+        session = self.session(request)
+        if op == 'move':
+            return self.state(session, self.play(session, str(request.get('move', '')).lower()), legal)
+        if op == 'undo':
+            if not session.moves:
+                raise RequestError("no move to undo")
+            session.moves.pop()
+            gs = session.replay()
+            session.position = packPosition(gs)
+            return self.state(session, gs, legal)
+        if op == 'reset':
+            session.moves = array.array('H')
+            gs = Engine.GameState(backend=BACKEND, fen=session.startFen)
+            session.position = packPosition(gs)
+            return self.state(session, gs, legal)
+        if op == 'state':
+            return self.state(session, None, legal)
+        if op == 'close':
+            del self.sessions[request['session']]
+            self.store.delete(request['session'])
+            return {}
+        raise RequestError("unknown op %r" % op)
+
+    #search on the pool. With play the move is made, unless the game changed while the engine thought
+    async def go(self, request):
+        session = self.session(request)
+        limits = {'movetime': request.get('movetime'), 'depth': request.get('depth'), 'nodes': request.get('nodes')}
+        if limits['movetime'] is None and limits['depth'] is None and limits['nodes'] is None:
+            limits['movetime'] = DEFAULT_MOVETIME
+        if limits['movetime'] is not None:
+            limits['movetime'] = min(float(limits['movetime']), MAX_MOVETIME)
+        moves = session.moves.tobytes()
+        async with self.engineSlots:
+            pool = self.pool
+            try:
+                reply = await asyncio.get_running_loop().run_in_executor(
+                    pool, searchGame, session.startFen, list(session.moves), limits)
+            except concurrent.futures.process.BrokenProcessPool:
+                if self.pool is pool: #a worker died; this request fails but the next gets fresh workers
+                    self.pool = self.newPool()
+                    pool.shutdown(wait=False)
+                raise
+        if request.get('play') and reply["bestMove"] is not None:
+            session = self.session(request) #it may have gone to the store and back meanwhile
+            if session.moves.tobytes() != moves:
+                raise RequestError("the game changed during the search")
+            reply.update(self.state(session, self.play(session, reply["bestMove"]), bool(request.get('legal'))))
+        return reply
+
+    async def answer(self, request, send):
+        self.requests += 1
+        reply = {"id": request.get('id') if isinstance(request, dict) else None}
+        try:
+            if not isinstance(request, dict):
+                raise RequestError("a request is a JSON object")
+            if request.get('op') == 'go':
+                reply.update(await self.go(request))
+            else:
+                reply.update(self.handle(request))
+            reply["ok"] = True
+        except (RequestError, ValueError, TypeError) as error:
+            reply.update(ok=False, error=str(error))
+        except Exception as error: #a bug or a broken pool fails the request, not the connection
+            reply.update(ok=False, error="%s: %s" % (type(error).__name__, error))
+        await send(reply)
+
+    async def serveClient(self, reader, writer):
+        pending = set() #go requests still running, the connection keeps reading meanwhile
+        lock = asyncio.Lock()
+        async def send(reply):
+            async with lock:
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    await send({"id": None, "ok": False, "error": "not JSON"})
+                    continue
+                if isinstance(request, dict) and request.get('op') == 'go':
+                    task = asyncio.ensure_future(self.answer(request, send))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                else:
+                    await self.answer(request, send)
+            if pending:
+                await asyncio.wait(pending)
+        except (ConnectionError, ValueError): #ValueError: a line past the stream limit
+            pass
+        finally:
+            writer.close()
+
+    #move sessions idle for idleSeconds to the store
+    def evictIdle(self):
+        cutoff = time.monotonic() - self.idleSeconds
+        idle = [sessionId for sessionId, session in self.sessions.items() if session.lastUsed < cutoff]
+        for sessionId in idle:
+            self.store.put(sessionId, self.sessions.pop(sessionId))
+        self.evictions += len(idle)
+
+    async def evictLoop(self):
+        while True:
+            await asyncio.sleep(EVICT_EVERY)
+            self.evictIdle()
+
+    #everything to the store, so the games are there after a restart
+    def close(self):
+        for sessionId, session in self.sessions.items():
+            self.store.put(sessionId, session)
+        self.sessions.clear()
+        self.store.db[NEXT_ID_KEY] = str(self.nextId)
+        self.store.close()
+        self.pool.shutdown(cancel_futures=True)
+
+
+async def serve(args):
+    server = GameServer(args.store, args.workers, args.hash, args.idle)
+    if args.unix:
+        listener = await asyncio.start_unix_server(server.serveClient, path=args.unix)
+    else:
+        listener = await asyncio.start_server(server.serveClient, args.host, args.port)
+    print("serving on %s" % (args.unix or "%s:%d" % (args.host, args.port)), file=sys.stderr)
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+        except NotImplementedError:
+            pass #Windows, where ctrl-c still ends up in KeyboardInterrupt
+    evictor = asyncio.ensure_future(server.evictLoop())
+    try:
+        async with listener:
+            await stop.wait()
+    finally:
+        evictor.cancel()
+        server.close()
+
+
+#percentile p (0-100) of sorted values
+def percentile(values, p):
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+async def _connect(args):
+    if args.unix:
+        return await asyncio.open_unix_connection(args.unix)
+    return await asyncio.open_connection(args.host, args.port)
+
+async def _request(reader, writer, request):
+    writer.write(json.dumps(request).encode() + b'\n')
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+#load generator: connections play random legal moves in sessions of their own, with the odd undo and engine move
+async def load(args):
+    rng = random.Random(args.seed)
+    latencies = {}
+    failures = 0
+    connections = [await _connect(args) for _ in range(args.connections)]
+    reader, writer = connections[0]
+    before = await _request(reader, writer, {"id": 0, "op": "stats"})
+    perConnection = [args.sessions // args.connections + (i < args.sessions % args.connections) for i in range(args.connections)]
+    requestsLeft = args.requests
+
+    async def timed(reader, writer, request):
+        nonlocal failures
+        start = time.perf_counter()
+        reply = await _request(reader, writer, request)
+        latencies.setdefault(request["op"], []).append(time.perf_counter() - start)
+        if not reply.get("ok"):
+            failures += 1
+        return reply
+
+    async def client(reader, writer, sessionCount):
+        nonlocal requestsLeft
+        games = {} #session id: (legal moves, ply)
+        for i in range(sessionCount):
+            reply = await timed(reader, writer, {"id": i, "op": "new", "legal": True})
+            games[reply["session"]] = (reply["legal"], reply["ply"])
+        sessionIds = list(games)
+        while requestsLeft > 0 and sessionIds:
+            requestsLeft -= 1
+            sessionId = rng.choice(sessionIds)
+            request = {"id": requestsLeft, "session": sessionId, "legal": True}
+            legal, ply = games[sessionId]
+            if not legal:
+                request["op"] = "reset"
+            elif args.go_every and rng.randrange(args.go_every) == 0:
+                request.update(op="go", movetime=args.movetime, play=True)
+            elif args.undo_every and ply and rng.randrange(args.undo_every) == 0:
+                request["op"] = "undo"
+            else:
+                request.update(op="move", move=rng.choice(legal))
+            reply = await timed(reader, writer, request)
+            if reply.get("ok") and "legal" in reply:
+                games[sessionId] = (reply["legal"], reply["ply"])
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(reader, writer, count) for (reader, writer), count in zip(connections, perConnection)])
+    seconds = time.perf_counter() - start
+    after = await _request(reader, writer, {"id": 0, "op": "stats"})
+    for _, writer in connections:
+        writer.close()
+
+    total = sum(len(values) for values in latencies.values())
+    print("%d requests in %.2fs, %.0f requests/sec, %d failed" % (total, seconds, total / seconds if seconds else 0.0, failures))
+    print("%-6s %8s %9s %9s %9s %9s" % ("op", "count", "p50 ms", "p90 ms", "p99 ms", "max ms"))
+    for op, values in sorted(latencies.items()):
+        values.sort()
+        print("%-6s %8d %9.2f %9.2f %9.2f %9.2f" % (op, len(values), percentile(values, 50) * 1000,
+                                                    percentile(values, 90) * 1000, percentile(values, 99) * 1000, values[-1] * 1000))
+    grown = after["residentBytes"] - before["residentBytes"]
+    sessions = after["sessions"] - before["sessions"]
+    print("%d sessions in memory, server grew by %.1f MB: %s sessions per GB" % (
+        after["sessions"], grown / 2 ** 20, "%.0f" % (sessions * 2 ** 30 / grown) if grown > 0 and sessions > 0 else "n/a"))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="multi-game server with line delimited JSON, and a load generator for it")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serveParser = commands.add_parser("serve", help="run the server")
+    loadParser = commands.add_parser("load", help="put load on a running server")
+    for sub in (serveParser, loadParser):
+        sub.add_argument("--host", default="127.0.0.1")
+        sub.add_argument("--port", type=int, default=8765)
+        sub.add_argument("--unix", help="Unix socket path, instead of TCP")
+    serveParser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="engine processes")
+    serveParser.add_argument("--hash", type=int, default=16, help="transposition table size in MB, per engine process")
+    serveParser.add_argument("--store", default="sessions.db", help="dbm file idle sessions are kept in")
+    serveParser.add_argument("--idle", type=float, default=300.0, help="seconds before an unused session goes to disk")
+    loadParser.add_argument("--sessions", type=int, default=1000)
+    loadParser.add_argument("--connections", type=int, default=10)
+    loadParser.add_argument("--requests", type=int, default=10000, help="requests after the sessions are made")
+    loadParser.add_argument("--go-every", type=int, default=200, help="one engine request in this many, 0 for none")
+    loadParser.add_argument("--undo-every", type=int, default=20, help="one undo in this many, 0 for none")
+    loadParser.add_argument("--movetime", type=float, default=0.05, help="seconds per engine request")
+    loadParser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args) if args.command == "serve" else load(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,326 @@
+# Self-play matches: plays two engine configurations against each other from an opening suite on a pool of
+# worker processes, with a sequential probability ratio test deciding when there are enough games.
+#
+#   python match.py --first name=new tc=10+0.1 hash=16 --second name=base tc=10+0.1 hash=16 backend=mailbox \
+#       --openings openings.epd --games 2000 --sprt 0 5 --pgn games.pgn --json games.jsonl
+#
+# A configuration is a list of key=value settings: name, tc (seconds+increment for the game), movetime
+# (seconds per move), depth, nodes, hash (MB), backend and book (an openingBook.py file). Every opening is
+# played twice with colours reversed. Openings come from a FEN/EPD file, or from a PGN file cut off after
+# --opening-plies; the start position is used without --openings.
+#
+# Games end on checkmate and stalemate, threefold repetition, the 50 move rule, a flag fall or --max-plies.
+# They are written to the PGN and JSON lines outputs as they finish, so the order is that of completion and the
+# Round tag gives the game number. With --sprt ELO0 ELO1 the match stops as soon as the log likelihood ratio
+# leaves its bounds. Progress, then the Elo difference, games/hour and nodes/sec of each side go to stderr.
+
+import argparse
+import concurrent.futures
+import json
+import math
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import Engine
+import analyze
+import engineWorker
+import moveFinder
+import openingBook
+import pgn
+
+IN_FLIGHT_PER_WORKER = 2 #games queued per worker, so one is always ready when another ends
+PROGRESS_EVERY = 10.0 #seconds between progress lines on stderr
+MOVES_TO_GO = 30 #moves the remaining clock time is shared between
+MOVE_OVERHEAD = 0.02 #seconds kept back from every move for what happens outside the search
+SPRT_PRIOR = 0.5 #games of each result added to the SPRT variance estimate
+RESULT_SCORES = {'1-0': (1.0, 0.0), '0-1': (0.0, 1.0), '1/2-1/2': (0.5, 0.5)} #(white, black)
+
+
+class PlayerConfig():
+    SETTINGS = {'name': str, 'tc': str, 'movetime': float, 'depth': int, 'nodes': int, 'hash': int,
+                'backend': str, 'book': str}
+
+    def __init__(self, name, tc=None, movetime=None, depth=None, nodes=None, hash=16, backend='bitboard', book=None):
+        self.name = name
+        self.base = self.increment = None #game clock in seconds when tc is given
+        if tc is not None:
+            base, _, increment = tc.partition('+')
+            self.base, self.increment = float(base), float(increment or 0)
+        self.movetime = movetime
+        self.depth = depth
+        self.nodes = nodes
+        self.hash = hash
+        if backend not in Engine.GameState.BACKENDS:
+            raise ValueError("unknown backend %s" % backend)
+        self.backend = backend
+        self.book = book
+        if self.base is None and movetime is None and depth is None and nodes is None:
+            raise ValueError("%s needs a limit: tc, movetime, depth or nodes" % name)
+
+    #a config from ['name=new', 'tc=10+0.1', ...]
+    @classmethod
+    def parse(cls, settings, defaultName):
+        values = {'name': defaultName}
+        for setting in settings:
+            key, _, value = setting.partition('=')
+            if key not in cls.SETTINGS or not value:
+                raise ValueError("bad setting %r, expected one of %s as key=value" % (setting, ', '.join(cls.SETTINGS)))
+            values[key] = cls.SETTINGS[key](value)
+        return cls(**values)
+
+    #the search limits for the next move, with clock seconds left on our clock
+    def limits(self, clock):
+        movetime = self.movetime
+        if self.base is not None:
+            budget = clock / MOVES_TO_GO + self.increment * 0.8
+            budget = max(0.001, min(budget, clock - MOVE_OVERHEAD))
+            movetime = budget if movetime is None else min(movetime, budget)
+        return {'movetime': movetime, 'depth': self.depth, 'nodes': self.nodes}
+
+
+#(startFen, [move notation, ...]) for every opening in path. FEN/EPD lines are positions, PGN games are cut
+#after plies moves. Openings that don't load are left out
+def loadOpenings(path, plies=8):
+    if path is None:
+        return [(None, [])]
+    openings = []
+    if path.lower().endswith('.pgn'):
+        for text in pgn.readGames(path):
+            headers, sans, _ = pgn.parseGame(text)
+            try:
+                gs = Engine.GameState(fen=headers.get('FEN'))
+                for san in sans[:plies]:
+                    gs.makeMove(pgn.resolveSan(gs, san))
+            except ValueError: #a bad FEN tag or a PgnError
+                continue
+            openings.append(engineWorker.serializePosition(gs))
+    else:
+        for _, line in analyze.readPositions(path):
+            try:
+                fen, _ = analyze.parseEpd(line)
+                gs = Engine.GameState(fen=fen)
+            except ValueError:
+                continue
+            openings.append((gs.getFen(), []))
+    return openings
+
+
+_players = {} #name: (Searcher, OpeningBook or None), kept by a worker across games
+
+def _player(config):
+    if config.name not in _players:
+        book = openingBook.OpeningBook(config.book) if config.book else None
+        _players[config.name] = (moveFinder.Searcher(config.hash), book)
+    return _players[config.name]
+
+#play one game in a worker process and return (record, PGN text). Each backend gets its own GameState,
+#the moves chosen on one are replayed on the others
+def playGame(index, opening, white, black, maxPlies):
+    configs = (white, black)
+    states = {}
+    for config in configs:
+        if config.backend not in states:
+            states[config.backend] = engineWorker.loadPosition(opening, config.backend)
+        searcher, _ = _player(config)
+        searcher.tt.clear() #a new game, as after ucinewgame
+        searcher.clearHeuristics()
+    gs = states[white.backend]
+    clocks = [config.base for config in configs]
+    nodes = [0, 0]
+    seconds = [0.0, 0.0]
+    result = reason = None
+    while result is None:
+        moves = gs.getValidMoves()
+        if gs.checkMate:
+            result, reason = ('0-1' if gs.whiteToMove else '1-0'), 'checkmate'
+        elif gs.staleMate:
+            result, reason = '1/2-1/2', 'stalemate'
+        elif gs.isThreefoldRepetition():
+            result, reason = '1/2-1/2', 'repetition'
+        elif gs.halfmoveClock >= 100:
+            result, reason = '1/2-1/2', '50 move rule'
+        elif len(gs.moveLog) >= maxPlies:
+            result, reason = '1/2-1/2', 'max plies'
+        if result is not None:
+            break
+        side = 0 if gs.whiteToMove else 1
+        config = configs[side]
+        searcher, book = _player(config)
+        own = states[config.backend]
+        start = time.perf_counter()
+        move = book.pickMove(own) if book is not None else None
+        if move is None:
+            found = searcher.search(own, **config.limits(clocks[side]))
+            move = found.bestMove
+            nodes[side] += found.nodes
+            seconds[side] += found.seconds
+        spent = time.perf_counter() - start
+        if config.base is not None:
+            clocks[side] -= spent
+            if clocks[side] < 0:
+                result, reason = ('0-1' if side == 0 else '1-0'), 'time forfeit'
+                break
+            clocks[side] += config.increment
+        compactID = move.getCompactID()
+        for state in states.values():
+            for reply in (moves if state is gs else state.getValidMoves()):
+                if reply.getCompactID() == compactID:
+                    state.makeMove(reply)
+                    break
+
+    headers = {'Event': 'match', 'Round': index + 1, 'White': white.name, 'Black': black.name,
+               'Termination': reason}
+    record = {"index": index, "white": white.name, "black": black.name, "result": result, "reason": reason,
+              "plies": len(gs.moveLog), "fen": gs.getFen(), "nodes": nodes, "seconds": [round(s, 6) for s in seconds]}
+    return record, pgn.writeGame(gs, headers, result)
+
+
+#(elo, 95% error margin) from a score between 0 and 1 over games, with its per game variance
+def eloEstimate(wins, draws, losses):
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, 0.0
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    def elo(s):
+        s = min(max(s, 1e-6), 1 - 1e-6)
+        return -400 * math.log10(1 / s - 1)
+    margin = 1.96 * math.sqrt(variance / games)
+    return elo(score), (elo(score + margin) - elo(score - margin)) / 2
+
+#log likelihood ratio of elo1 against elo0 for the results so far, in the normal approximation of the
+#trinomial GSPRT. The test passes above log((1 - beta) / alpha) and fails below log(beta / (1 - alpha))
+def sprtLLR(wins, draws, losses, elo0, elo1):
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0
+    score = (wins + draws / 2) / games
+    #the variance takes SPRT_PRIOR games of each result on top, so one sided results like 60-40-0 still count
+    w, d, l = wins + SPRT_PRIOR, draws + SPRT_PRIOR, losses + SPRT_PRIOR
+    variance = (w * (1 - score) ** 2 + d * (0.5 - score) ** 2 + l * score ** 2) / (w + d + l)
+    s0 = 1 / (1 + 10 ** (-elo0 / 400))
+    s1 = 1 / (1 + 10 ** (-elo1 / 400))
+    return games * (s1 - s0) * (2 * score - s0 - s1) / (2 * variance)
+
+def sprtBounds(alpha, beta):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+#(index, opening, white, black) for games games, every opening played once with each colour
+def _schedule(openings, first, second, games):
+    for index in range(games):
+        opening = openings[(index // 2) % len(openings)]
+        yield (index, opening) + ((first, second) if index % 2 == 0 else (second, first))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="play two engine configurations against each other")
+    parser.add_argument("--first", nargs="+", default=["movetime=0.1"], metavar="KEY=VALUE",
+                        help="the configuration being tested: name, tc, movetime, depth, nodes, hash, backend, book")
+    parser.add_argument("--second", nargs="+", default=["movetime=0.1"], metavar="KEY=VALUE",
+                        help="the configuration it is measured against")
+    parser.add_argument("--openings", help="FEN/EPD or PGN file, the start position when left out")
+    parser.add_argument("--opening-plies", type=int, default=8, help="moves taken from each game of a PGN suite")
+    parser.add_argument("--games", type=int, default=100, help="most games to play, an SPRT may stop sooner")
+    parser.add_argument("--max-plies", type=int, default=400, help="adjudicate a draw after this many plies")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--sprt", type=float, nargs=2, metavar=("ELO0", "ELO1"), help="stop when elo1 or elo0 is accepted")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--pgn", help="PGN file the games are written to")
+    parser.add_argument("--json", help="JSON lines file with a record per game")
+    args = parser.parse_args(argv)
+    try:
+        first = PlayerConfig.parse(args.first, 'first')
+        second = PlayerConfig.parse(args.second, 'second')
+    except ValueError as error:
+        parser.error(str(error))
+    if first.name == second.name:
+        parser.error("the two configurations need different names")
+    openings = loadOpenings(args.openings, args.opening_plies)
+    if not openings:
+        parser.error("no usable openings in %s" % args.openings)
+
+    pgnOutput = open(args.pgn, 'w') if args.pgn else None
+    jsonOutput = open(args.json, 'w') if args.json else None
+    wins = draws = losses = 0 #for first
+    nodes = {first.name: 0, second.name: 0}
+    seconds = {first.name: 0.0, second.name: 0.0}
+    lower, upper = sprtBounds(args.alpha, args.beta)
+    verdict = None
+    start = lastProgress = time.perf_counter()
+
+    def summary():
+        games = wins + draws + losses
+        elo, margin = eloEstimate(wins, draws, losses)
+        line = "%d games +%d =%d -%d, elo %+.1f +/- %.1f" % (games, wins, draws, losses, elo, margin)
+        if args.sprt:
+            line += ", llr %.2f (%.2f, %.2f)" % (sprtLLR(wins, draws, losses, *args.sprt), lower, upper)
+        return line
+
+    def tally(record, text):
+        nonlocal wins, draws, losses
+        whiteScore = RESULT_SCORES[record["result"]][0]
+        score = whiteScore if record["white"] == first.name else 1 - whiteScore
+        if score == 1:
+            wins += 1
+        elif score == 0:
+            losses += 1
+        else:
+            draws += 1
+        for side, name in enumerate((record["white"], record["black"])):
+            nodes[name] += record["nodes"][side]
+            seconds[name] += record["seconds"][side]
+        if jsonOutput is not None:
+            jsonOutput.write(json.dumps(record) + "\n")
+        if pgnOutput is not None:
+            pgnOutput.write(text + "\n")
+
+    schedule = _schedule(openings, first, second, args.games)
+    pending = set()
+    with concurrent.futures.ProcessPoolExecutor(args.workers, mp_context=mp.get_context('spawn')) as pool:
+        try:
+            for task in schedule:
+                pending.add(pool.submit(playGame, *task, args.max_plies))
+                if len(pending) >= args.workers * IN_FLIGHT_PER_WORKER:
+                    break
+            while pending:
+                done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    tally(*future.result())
+                if args.sprt:
+                    llr = sprtLLR(wins, draws, losses, *args.sprt)
+                    if llr >= upper or llr <= lower:
+                        verdict = "H1 accepted: %s is at least %g elo better" % (first.name, args.sprt[1]) if llr >= upper \
+                            else "H0 accepted: %s is not %g elo better" % (first.name, args.sprt[1])
+                        break
+                for task in schedule: #as many new games as finished
+                    pending.add(pool.submit(playGame, *task, args.max_plies))
+                    if len(pending) >= args.workers * IN_FLIGHT_PER_WORKER:
+                        break
+                now = time.perf_counter()
+                if now - lastProgress >= PROGRESS_EVERY:
+                    print(summary(), file=sys.stderr)
+                    lastProgress = now
+        finally:
+            pool.shutdown(cancel_futures=True) #an SPRT stop or an interrupt doesn't wait for queued games
+            for output in (pgnOutput, jsonOutput):
+                if output is not None:
+                    output.close()
+
+    elapsed = time.perf_counter() - start
+    games = wins + draws + losses
+    print(summary(), file=sys.stderr)
+    if verdict:
+        print(verdict, file=sys.stderr)
+    print("%.2fs, %.0f games/hour" % (elapsed, games * 3600 / elapsed if elapsed else 0.0), file=sys.stderr)
+    for name in (first.name, second.name):
+        print("%s: %d nodes, %.0f nodes/sec" % (name, nodes[name], nodes[name] / seconds[name] if seconds[name] else 0.0),
+              file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
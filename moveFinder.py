@@ -0,0 +1,292 @@
+# Search: picks a move for the side to move in a GameState.
+# Negamax alpha-beta with principal variation search, iterative deepening, a transposition table and
+# moves picked in stages (hash move, MVV-LVA captures, killers, history ordered quiets) so a cutoff saves
+# generating the rest, plus a captures only quiescence search at the leaves.
+# A search can be limited by depth, time and nodes, and stopped from outside, always returning the
+# result of the last completed iteration.
+
+import time
+
+import Engine
+import evaluation
+import transposition
+
+CHECKMATE = 100000 #scores above CHECKMATE - MAX_PLY are mates, the closer to CHECKMATE the sooner
+STALEMATE = 0
+MAX_PLY = 128
+pieceScore = {'K': 0, 'Q': 900, 'R': 500, 'B': 330, 'N': 320, 'p': 100} #for move ordering, evaluation has its own values
+PACKED_PIECE_SCORES = [0] + [pieceScore[piece[1]] for piece in Engine.MOVE_PIECES[1:]] #by the piece indices of packed moves
+PROMOTION_SCORES = [pieceScore[piece] for piece in Engine.Move.promotionPieces]
+
+HISTORY_LIMIT = 1 << 26 #history scores are halved once one passes this
+
+CHECK_EVERY = 1024 #nodes between checks of the time, node and stop limits
+TABLEBASE_PHASE = 4 #game phase at or below which the tablebases can have the position, a queen is the most
+
+
+class SearchAborted(Exception):
+    pass
+
+
+class SearchResult():
+    def __init__(self, bestMove, score, depth, nodes, pv, seconds):
+        self.bestMove = bestMove
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.pv = pv #list of Move, starting with bestMove
+        self.seconds = seconds
+
+    def nps(self):
+        return int(self.nodes / self.seconds) if self.seconds > 0 else 0
+
+    def __repr__(self):
+        return "SearchResult(bestMove=%s, score=%d, depth=%d, nodes=%d, pv=%s)" % (
+            self.bestMove.getChessNotation() if self.bestMove else None, self.score, self.depth, self.nodes,
+            " ".join(move.getChessNotation() for move in self.pv))
+
+
+#mate scores are stored relative to the node they were found at, so they stay right at any ply
+def scoreToTT(score, ply):
+    if score > CHECKMATE - MAX_PLY:
+        return score + ply
+    if score < -CHECKMATE + MAX_PLY:
+        return score - ply
+    return score
+
+def scoreFromTT(score, ply):
+    if score > CHECKMATE - MAX_PLY:
+        return score - ply
+    if score < -CHECKMATE + MAX_PLY:
+        return score + ply
+    return score
+
+
+class Searcher():
+    #tablebases is a tablebase.Tablebases whose results replace searching below the root
+    def __init__(self, ttSizeMb=16, tt=None, tablebases=None):
+        self.tt = tt if tt is not None else transposition.TranspositionTable(ttSizeMb)
+        self.tablebases = tablebases
+        self.pawnTable = evaluation.PawnHashTable()
+        self.stopRequested = False
+        self.clearHeuristics()
+
+    def clearHeuristics(self):
+        self.killers = [[0, 0] for _ in range(MAX_PLY)] #two quiet compact move ids per ply that caused cutoffs
+        self.history = [0] * 4096 #by start and end square of quiet moves that caused cutoffs
+
+    #ask a running search to stop, from another thread
+    def stop(self):
+        self.stopRequested = True
+
+    #search gs and return a SearchResult. Any mix of limits works, with none it searches to depth MAX_PLY
+    #until stopped. stopEvent is anything with is_set() (threading or multiprocessing Event) and
+    #onIteration is called with the SearchResult of every completed depth. startDepth skips the first
+    #iterations, which parallel helpers use to stay out of step with each other
+    def search(self, gs, depth=None, movetime=None, nodes=None, stopEvent=None, onIteration=None, startDepth=1):
+        self.startTime = time.perf_counter()
+        self.deadline = self.startTime + movetime if movetime is not None else None
+        self.nodeLimit = nodes
+        self.stopEvent = stopEvent
+        self.stopRequested = False
+        self.nodes = 0
+        self.nextCheck = CHECK_EVERY
+        self.tt.newSearch()
+        self.pvTable = [[] for _ in range(MAX_PLY + 1)]
+        maxDepth = min(depth, MAX_PLY - 1) if depth is not None else MAX_PLY - 1
+
+        rootPly = len(gs.moveLog)
+        checkMate, staleMate = gs.checkMate, gs.staleMate
+        rootMoves = gs.getValidMoves()
+        result = SearchResult(rootMoves[0] if rootMoves else None, 0, 0, 0, rootMoves[:1], 0.0)
+        try:
+            if len(rootMoves) > 1:
+                for currentDepth in range(min(startDepth, maxDepth), maxDepth + 1):
+                    score = self.negamax(gs, currentDepth, -CHECKMATE - 1, CHECKMATE + 1, 0)
+                    pv = list(self.pvTable[0])
+                    result = SearchResult(pv[0], score, currentDepth, self.nodes, pv, time.perf_counter() - self.startTime)
+                    if onIteration is not None:
+                        onIteration(result)
+                    if abs(score) > CHECKMATE - MAX_PLY and currentDepth >= CHECKMATE - abs(score):
+                        break #found the shortest mate there is
+                    if self.deadline is not None and time.perf_counter() > self.startTime + (self.deadline - self.startTime) / 2:
+                        break #the next iteration would not finish in time
+        except SearchAborted:
+            while len(gs.moveLog) > rootPly: #unwind the moves the search was in the middle of
+                gs.undoMove()
+        gs.checkMate, gs.staleMate = checkMate, staleMate
+        result.nodes = self.nodes
+        result.seconds = time.perf_counter() - self.startTime
+        return result
+
+    def checkLimits(self):
+        self.nextCheck = self.nodes + CHECK_EVERY
+        if self.stopRequested or (self.stopEvent is not None and self.stopEvent.is_set()):
+            raise SearchAborted()
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            raise SearchAborted()
+        if self.nodeLimit is not None and self.nodes >= self.nodeLimit:
+            raise SearchAborted()
+
+    def negamax(self, gs, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes >= self.nextCheck:
+            self.checkLimits()
+        self.pvTable[ply] = []
+        if ply > 0 and gs.repetitionCount() >= 2:
+            return STALEMATE #a repeated position is treated as a draw inside the tree
+        if ply >= MAX_PLY - 1:
+            return evaluation.evaluate(gs, self.pawnTable)
+        if ply > 0 and self.tablebases is not None and gs.gamePhase <= TABLEBASE_PHASE:
+            known = self.tablebases.probe(gs)
+            if known is not None: #exact, scored like the mate it leads to
+                wdl, dtm = known
+                return STALEMATE if wdl == 0 else wdl * (CHECKMATE - ply - dtm)
+
+        key = gs.zobristKey
+        entry = self.tt.probe(key)
+        ttMove = 0
+        if entry is not None:
+            ttMove, ttDepth, ttScore, ttBound = entry
+            if ply > 0 and ttDepth >= depth:
+                ttScore = scoreFromTT(ttScore, ply)
+                if ttBound == transposition.EXACT or \
+                        (ttBound == transposition.LOWER and ttScore >= beta) or \
+                        (ttBound == transposition.UPPER and ttScore <= alpha):
+                    return ttScore
+
+        inCheck = gs.inCheck()
+        if inCheck:
+            depth += 1 #check extension, so forced lines aren't cut off at the horizon
+        if depth <= 0:
+            return self.quiescence(gs, alpha, beta, ply)
+
+        alphaOriginal = alpha
+        bestScore = -CHECKMATE - 1
+        bestMove = None
+        legalMoves = 0
+        for move in self.pickMoves(gs, ttMove, ply):
+            gs.makeMove(move)
+            if gs.movedIntoCheck():
+                gs.undoMove()
+                continue
+            legalMoves += 1
+            if legalMoves == 1:
+                score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            else: #principal variation search: prove the move is worse with a null window, re-search if not
+                score = -self.negamax(gs, depth - 1, -alpha - 1, -alpha, ply + 1)
+                if alpha < score < beta:
+                    score = -self.negamax(gs, depth - 1, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score > bestScore:
+                bestScore = score
+                bestMove = move
+                if score > alpha:
+                    alpha = score
+                    self.pvTable[ply] = [move] + self.pvTable[ply + 1]
+                    if alpha >= beta:
+                        if not move.isCapture:
+                            self.recordCutoff(move, depth, ply)
+                        break
+        if legalMoves == 0:
+            return -CHECKMATE + ply if inCheck else STALEMATE
+
+        if bestScore >= beta:
+            bound = transposition.LOWER
+        elif bestScore > alphaOriginal:
+            bound = transposition.EXACT
+        else:
+            bound = transposition.UPPER
+        self.tt.store(key, bestMove.getCompactID(), depth, scoreToTT(bestScore, ply), bound)
+        return bestScore
+
+    #only captures and promotions past the horizon, so the leaf evaluation isn't taken in the middle of an exchange
+    def quiescence(self, gs, alpha, beta, ply):
+        self.nodes += 1
+        if self.nodes >= self.nextCheck:
+            self.checkLimits()
+        self.pvTable[ply] = []
+        if ply >= MAX_PLY - 1:
+            return evaluation.evaluate(gs, self.pawnTable)
+        if gs.inCheck(): #no standing pat in check: every evasion is searched, quiet ones too, and none is mate
+            moves = gs.getValidMoves()
+            if len(moves) == 0:
+                return -CHECKMATE + ply
+        else:
+            standPat = evaluation.evaluate(gs, self.pawnTable)
+            if standPat >= beta:
+                return standPat
+            if standPat > alpha:
+                alpha = standPat
+            moves = gs.getCaptureMoves()
+        moves.sort(key=self.captureOrder, reverse=True)
+        for move in moves:
+            gs.makeMove(move)
+            if gs.movedIntoCheck():
+                gs.undoMove()
+                continue
+            score = -self.quiescence(gs, -beta, -alpha, ply + 1)
+            gs.undoMove()
+            if score > alpha:
+                alpha = score
+                self.pvTable[ply] = [move] + self.pvTable[ply + 1]
+                if alpha >= beta:
+                    break
+        return alpha
+
+    #most valuable victim first, cheapest attacker breaking ties
+    def captureOrder(self, move):
+        packed = move.packed
+        captured = packed >> 21
+        order = PACKED_PIECE_SCORES[captured] * 10 - PACKED_PIECE_SCORES[(packed >> 17) & 15] // 10 if captured else 0
+        if packed & Engine.MOVE_PROMOTION:
+            order += PROMOTION_SCORES[(packed >> 12) & 3]
+        return order
+
+    #the moves of gs in search order, each stage generated only once the one before is used up: the hash move,
+    #captures and promotions by MVV-LVA, the killers, then quiet moves by history. The moves are pseudo legal,
+    #the search makes each one and skips it when movedIntoCheck
+    def pickMoves(self, gs, ttMove, ply):
+        if ttMove:
+            move = gs.pseudoLegalMove(ttMove) #the table can hold a move of another position with the same key
+            if move is not None:
+                yield move
+        captures = gs.getCaptureMoves()
+        captures.sort(key=self.captureOrder, reverse=True)
+        for move in captures:
+            if move.packed & 0x3FFF != ttMove:
+                yield move
+        killers = list(self.killers[ply]) #a cutoff deeper down mustn't change them under us
+        for killer in killers:
+            if killer and killer != ttMove:
+                move = gs.pseudoLegalMove(killer)
+                if move is not None and not (move.packed >> 21 or move.packed & Engine.MOVE_PROMOTION):
+                    yield move
+        history = self.history
+        quiets = gs.getQuietMoves()
+        quiets.sort(key=lambda move: history[move.packed & 4095], reverse=True)
+        for move in quiets:
+            compactID = move.packed & 0x3FFF
+            if compactID != ttMove and compactID != killers[0] and compactID != killers[1]:
+                yield move
+
+    def recordCutoff(self, move, depth, ply):
+        compactID = move.getCompactID()
+        killers = self.killers[ply]
+        if killers[0] != compactID:
+            killers[1] = killers[0]
+            killers[0] = compactID
+        self.history[compactID & 4095] += depth * depth
+        if self.history[compactID & 4095] > HISTORY_LIMIT:
+            self.history = [h // 2 for h in self.history]
+
+
+#convenience wrapper: best move for gs within the limits, or None when there are no legal moves.
+#With an openingBook.OpeningBook, a book move is played without searching
+def findBestMove(gs, depth=None, movetime=None, nodes=None, searcher=None, book=None):
+    if book is not None:
+        move = book.pickMove(gs)
+        if move is not None:
+            return move
+    searcher = searcher if searcher is not None else Searcher()
+    return searcher.search(gs, depth=depth, movetime=movetime, nodes=nodes).bestMove
@@ -0,0 +1,255 @@
+# Opening book: a sorted file of 16 byte records in the Polyglot layout,
+#   key (8 bytes) | move (2) | weight (2) | learn (4), all big endian,
+# ordered by key and then by weight, best first. The key is our own Zobrist key (zobrist.py) and the move is
+# Move.getCompactID, so the file has the shape of a Polyglot book but not its hashes; real Polyglot books
+# can't be read with it.
+#
+#   python openingBook.py build games.pgn more.pgn --output book.bin --plies 20 --min-games 2
+#   python openingBook.py probe book.bin --fen "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq - 0 1"
+#
+# A move gets 2 points for every game its side won after playing it and 1 for every draw, scaled so the best
+# move of each position fits in 16 bits. Opening a book only opens the file; lookups binary search it through
+# mmap, so startup costs the same for a book of any size and only the pages a probe touches are read.
+
+import argparse
+import heapq
+import mmap
+import os
+import random
+import struct
+import sys
+import tempfile
+
+import Engine
+import pgn
+
+RECORD = struct.Struct('>QHHI')
+RECORD_BYTES = RECORD.size
+_KEY = struct.Struct('>Q')
+_RUN_RECORD = struct.Struct('>QHII') #key, move, games, points in the temporary runs of the builder
+RUN_ENTRIES = 500000 #(position, move) pairs counted in memory before they are sorted out to a run file
+MAX_WEIGHT = 0xFFFF
+POINTS = {'1-0': (2, 0), '0-1': (0, 2), '1/2-1/2': (1, 1)} #(white, black)
+
+
+class OpeningBook():
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.buffer = None
+        self.count = os.path.getsize(path) // RECORD_BYTES
+
+    #the file is mapped on the first probe rather than when the book is opened
+    def _map(self):
+        self.file = open(self.path, 'rb')
+        if self.count:
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    #[(compact move id, weight, learn), ...] stored for key, best first
+    def entries(self, key):
+        if self.file is None:
+            self._map()
+        if not self.count:
+            return []
+        buffer = self.buffer
+        low, high = 0, self.count
+        while low < high: #first record with a key >= key
+            middle = (low + high) // 2
+            if _KEY.unpack_from(buffer, middle * RECORD_BYTES)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        while low < self.count:
+            recordKey, move, weight, learn = RECORD.unpack_from(buffer, low * RECORD_BYTES)
+            if recordKey != key:
+                break
+            found.append((move, weight, learn))
+            low += 1
+        return found
+
+    #[(move, weight), ...] for the legal book moves of gs, best first. An entry that isn't legal here (a key
+    #collision or a damaged file) is skipped
+    def probe(self, gs, moves=None):
+        found = self.entries(gs.zobristKey)
+        if not found:
+            return []
+        if moves is None:
+            moves = gs.getValidMoves()
+        byID = {move.getCompactID(): move for move in moves}
+        return [(byID[move], weight) for move, weight, _ in found if move in byID]
+
+    #a book move for gs or None when out of book. 'weighted' picks at random in proportion to the weights,
+    #'best' always takes the heaviest
+    def pickMove(self, gs, mode='weighted', rng=random):
+        candidates = [(move, weight) for move, weight in self.probe(gs) if weight > 0]
+        if not candidates:
+            return None
+        if mode == 'best':
+            return candidates[0][0]
+        if mode != 'weighted':
+            raise ValueError("unknown book mode %r" % mode)
+        pick = rng.randrange(sum(weight for _, weight in candidates))
+        for move, weight in candidates:
+            pick -= weight
+            if pick < 0:
+                return move
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+#(key << 16 | move, games + (points << 32)) for the first plies of every game in paths; pairs from games
+#without a result still count as games
+def _countMoves(paths, plies, backend, onGame=None):
+    counts = {}
+    for path in paths:
+        for text in pgn.readGames(path):
+            headers, sans, result = pgn.parseGame(text)
+            try:
+                gs = Engine.GameState(backend=backend, fen=headers['FEN'] if 'FEN' in headers else None)
+            except ValueError:
+                continue
+            points = POINTS.get(result, (0, 0))
+            for san in sans[:plies]:
+                try:
+                    move = pgn.resolveSan(gs, san)
+                except pgn.PgnError:
+                    break #keep what came before the bad move
+                pair = (gs.zobristKey << 16) | move.getCompactID()
+                counts[pair] = counts.get(pair, 0) + 1 + (points[0 if gs.whiteToMove else 1] << 32)
+                gs.makeMove(move)
+            if onGame is not None:
+                onGame()
+            if len(counts) >= RUN_ENTRIES:
+                yield counts
+                counts = {}
+    yield counts
+
+def _writeRun(counts, directory):
+    run = tempfile.TemporaryFile(dir=directory)
+    for pair in sorted(counts):
+        value = counts[pair]
+        run.write(_RUN_RECORD.pack(pair >> 16, pair & 0xFFFF, value & 0xFFFFFFFF, value >> 32))
+    run.seek(0)
+    return run
+
+def _readRun(run):
+    size = _RUN_RECORD.size
+    while True:
+        chunk = run.read(size * 4096)
+        if not chunk:
+            return
+        for offset in range(0, len(chunk), size):
+            key, move, games, points = _RUN_RECORD.unpack_from(chunk, offset)
+            yield (key << 16) | move, games + (points << 32)
+
+#the records of one position, best first, with the weights scaled into 16 bits
+def _positionRecords(key, moves, minGames):
+    moves = [(points, move) for move, games, points in moves if games >= minGames and points > 0]
+    if not moves:
+        return []
+    top = max(points for points, _ in moves)
+    scale = MAX_WEIGHT / top if top > MAX_WEIGHT else 1
+    moves.sort(key=lambda entry: (-entry[0], entry[1]))
+    return [RECORD.pack(key, move, max(1, int(points * scale)), 0) for points, move in moves]
+
+#build a book from the PGN files in paths. Counts are spilled to sorted runs on disk every RUN_ENTRIES pairs
+#and merged at the end, so memory stays bounded for any number of games. Returns (games, positions, records)
+def buildBook(paths, output, plies=20, minGames=1, backend='bitboard'):
+    directory = os.path.dirname(os.path.abspath(output))
+    games = 0
+    def onGame():
+        nonlocal games
+        games += 1
+    runs = []
+    counts = {}
+    for counts in _countMoves(paths, plies, backend, onGame):
+        if runs or len(counts) >= RUN_ENTRIES:
+            runs.append(_writeRun(counts, directory))
+    if runs: #the last chunk went out as a run too
+        merged = heapq.merge(*[_readRun(run) for run in runs])
+    else: #everything fit in one chunk, it is sorted in memory
+        merged = ((pair, counts[pair]) for pair in sorted(counts))
+
+    positions = records = 0
+    temporary = output + '.tmp'
+    with open(temporary, 'wb') as out:
+        currentKey = None
+        moves = [] #(move, games, points) of currentKey
+        def flush():
+            nonlocal positions, records
+            packed = _positionRecords(currentKey, moves, minGames)
+            if packed:
+                positions += 1
+                records += len(packed)
+                out.write(b''.join(packed))
+        for pair, value in merged:
+            key, move = pair >> 16, pair & 0xFFFF
+            if key != currentKey:
+                if moves:
+                    flush()
+                currentKey, moves = key, []
+            if moves and moves[-1][0] == move: #the same pair from another run
+                _, seen, points = moves[-1]
+                moves[-1] = (move, seen + (value & 0xFFFFFFFF), points + (value >> 32))
+            else:
+                moves.append((move, value & 0xFFFFFFFF, value >> 32))
+        if moves:
+            flush()
+    for run in runs:
+        run.close()
+    os.replace(temporary, output)
+    return games, positions, records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="build or probe an opening book")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build a book from PGN files")
+    build.add_argument("inputs", nargs="+", help="PGN files")
+    build.add_argument("--output", default="book.bin")
+    build.add_argument("--plies", type=int, default=20, help="book moves taken from the start of every game")
+    build.add_argument("--min-games", type=int, default=1, help="leave out moves played in fewer games")
+    build.add_argument("--backend", choices=Engine.GameState.BACKENDS, default="bitboard")
+    probe = commands.add_parser("probe", help="list the book moves of a position")
+    probe.add_argument("book")
+    probe.add_argument("--fen", help="position to look up, the start position when left out")
+    probe.add_argument("--pick", choices=("weighted", "best"), help="also pick a move the way the engine would")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        games, positions, records = buildBook(args.inputs, args.output, args.plies, args.min_games, args.backend)
+        print("%d games, %d positions, %d moves, %d bytes written to %s" % (
+            games, positions, records, records * RECORD_BYTES, args.output))
+        return 0
+
+    with OpeningBook(args.book) as book:
+        gs = Engine.GameState(fen=args.fen)
+        found = book.probe(gs)
+        total = sum(weight for _, weight in found)
+        for move, weight in found:
+            print("%-8s %6d %6.1f%%" % (pgn.toSan(gs, move), weight, 100.0 * weight / total if total else 0.0))
+        if not found:
+            print("out of book")
+        elif args.pick:
+            print("pick: %s" % pgn.toSan(gs, book.pickMove(gs, args.pick)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
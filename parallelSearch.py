@@ -0,0 +1,196 @@
+# Lazy SMP: N worker processes search the same root position at the same time and share one transposition
+# table in multiprocessing.shared_memory. Nothing else is shared; the workers help each other only through
+# the table, and every other worker starts one iteration deeper so they don't all walk the same tree in step.
+# The first worker to finish stops the rest and the deepest completed result wins.
+#
+#   python parallelSearch.py --threads 1 2 4 8 --depth 5 --positions start kiwipete
+#
+# reports time to depth, nodes/sec and per worker node counts for every thread count, with the speedup over
+# the first thread count given.
+
+import argparse
+import json
+import multiprocessing as mp
+import queue
+import sys
+import time
+from multiprocessing import shared_memory
+
+import engineWorker
+import moveFinder
+import transposition
+
+RESULT_POLL_SECONDS = 0.5 #how long the parent waits on the result queue before checking the workers are still alive
+
+
+def _workerMain(workerId, commands, results, stopEvent, shmName, ttSizeMb, backend):
+    shm = shared_memory.SharedMemory(name=shmName)
+    tt = transposition.TranspositionTable(ttSizeMb, buffer=shm.buf)
+    searcher = moveFinder.Searcher(tt=tt)
+    try:
+        while True:
+            command = commands.get()
+            if command is None:
+                return
+            if command == 'clear': #the parent wipes the shared table, each worker only starts its own ages over
+                tt.age = 0
+                tt.resetStats()
+                searcher.clearHeuristics()
+                continue
+            position, limits = command
+            try:
+                gs = engineWorker.loadPosition(position, backend)
+                result = searcher.search(gs, stopEvent=stopEvent, startDepth=1 + workerId % 2, **limits)
+            except Exception as error: #the parent waits for a reply from every worker, so a failure must answer too
+                results.put((workerId, None, 0, -1, 0, [], 0.0, "%s: %s" % (type(error).__name__, error)))
+                continue
+            stopEvent.set() #the first one done ends the search for everyone
+            results.put((workerId, result.bestMove.getChessNotation() if result.bestMove else None, result.score,
+                         result.depth, result.nodes, [move.getChessNotation() for move in result.pv], result.seconds, None))
+    finally:
+        del searcher, tt #drop every view of the buffer before closing it
+        shm.close()
+
+
+class ParallelResult():
+    def __init__(self, bestMove, score, depth, nodes, pv, seconds, workerNodes):
+        self.bestMove = bestMove #move notation, as the workers only send strings back
+        self.score = score
+        self.depth = depth
+        self.nodes = nodes
+        self.pv = pv
+        self.seconds = seconds
+        self.workerNodes = workerNodes #nodes searched by each worker, by worker id
+
+    def nps(self):
+        return int(self.nodes / self.seconds) if self.seconds > 0 else 0
+
+    def toDict(self):
+        return {"bestMove": self.bestMove, "score": self.score, "depth": self.depth, "nodes": self.nodes,
+                "pv": self.pv, "seconds": round(self.seconds, 6), "nps": self.nps(), "workerNodes": self.workerNodes}
+
+
+class ParallelSearcher():
+    def __init__(self, threads=2, ttSizeMb=64, backend='bitboard'):
+        context = mp.get_context('spawn')
+        self.threads = threads
+        self.shm = shared_memory.SharedMemory(create=True, size=transposition.TranspositionTable.bytesNeeded(ttSizeMb))
+        self.tt = transposition.TranspositionTable(ttSizeMb, buffer=self.shm.buf) #the parent's view, for stats
+        self.stopEvent = context.Event()
+        self.results = context.Queue()
+        self.commands = [context.Queue() for _ in range(threads)]
+        self.processes = [context.Process(target=_workerMain, daemon=True,
+                                          args=(i, self.commands[i], self.results, self.stopEvent, self.shm.name, ttSizeMb, backend))
+                          for i in range(threads)]
+        for process in self.processes:
+            process.start()
+
+    #search gs on every worker and return a ParallelResult. A node limit is split between the workers.
+    #Workers that fail or die are left out; RuntimeError if none of them came back with a result
+    def search(self, gs, depth=None, movetime=None, nodes=None):
+        limits = {'depth': depth, 'movetime': movetime, 'nodes': nodes // self.threads if nodes is not None else None}
+        position = engineWorker.serializePosition(gs)
+        self.stopEvent.clear()
+        self.tt.newSearch() #the workers age their views of the table the same way
+        start = time.perf_counter()
+        for commands in self.commands:
+            commands.put((position, limits))
+        replies, errors = self._collect()
+        seconds = time.perf_counter() - start
+        if not replies:
+            raise RuntimeError("every search worker failed: %s" % "; ".join(errors))
+        workerNodes = [0] * self.threads
+        for reply in replies:
+            workerNodes[reply[0]] = reply[4]
+        #deepest completed iteration wins, the main worker breaking ties
+        best = max(replies, key=lambda reply: (reply[3], reply[0] == 0))
+        return ParallelResult(best[1], best[2], best[3], sum(workerNodes), best[5], seconds, workerNodes)
+
+    #one reply per worker: (workerId, move, score, depth, nodes, pv, seconds, error). Never waits on a dead
+    #process, whose reply can't come
+    def _collect(self):
+        waiting = set(range(self.threads))
+        replies, errors = [], []
+        while waiting:
+            try:
+                reply = self.results.get(timeout=RESULT_POLL_SECONDS)
+            except queue.Empty:
+                for workerId in sorted(waiting):
+                    if not self.processes[workerId].is_alive():
+                        waiting.discard(workerId)
+                        errors.append("worker %d exited with code %s" % (workerId, self.processes[workerId].exitcode))
+                continue
+            if reply[0] not in waiting:
+                continue #a late reply from a worker already given up on
+            waiting.discard(reply[0])
+            if reply[7] is not None:
+                errors.append("worker %d: %s" % (reply[0], reply[7]))
+            else:
+                replies.append(reply)
+        return replies, errors
+
+    #forget everything learnt so far, for a new game: the shared table, and in every worker its table age,
+    #killers and history. Each worker keeps its own count of searches for the entry ages, so clearing only the
+    #parent's view would leave them storing under ages the parent's hashfull no longer counts
+    def clear(self):
+        self.tt.clear()
+        for commands in self.commands:
+            commands.put('clear')
+
+    def stop(self):
+        self.stopEvent.set()
+
+    def close(self):
+        self.stopEvent.set()
+        for commands in self.commands:
+            commands.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        del self.tt
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main(argv=None):
+    import Engine
+    import perft
+    parser = argparse.ArgumentParser(description="Lazy SMP time to depth and nodes/sec scaling")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--positions", nargs="*", default=["start", "kiwipete", "position3", "position4", "position5", "position6"])
+    parser.add_argument("--hash", type=int, default=64, help="transposition table size in MB")
+    parser.add_argument("--backend", choices=Engine.GameState.BACKENDS, default="bitboard")
+    parser.add_argument("--json", action="store_true", help="print one JSON record per run")
+    args = parser.parse_args(argv)
+
+    fens = {name: fen for name, fen, _ in perft.REFERENCE_POSITIONS}
+    baseline = {}
+    for threads in args.threads:
+        with ParallelSearcher(threads, args.hash, args.backend) as searcher:
+            for name in args.positions:
+                searcher.clear() #every run starts cold so the times compare
+                result = searcher.search(Engine.GameState(fen=fens[name]), depth=args.depth)
+                baseline.setdefault(name, result)
+                record = result.toDict()
+                record.update({"position": name, "threads": threads,
+                               "speedup": baseline[name].seconds / result.seconds if result.seconds else None,
+                               "npsScaling": result.nps() / baseline[name].nps() if baseline[name].nps() else None})
+                if args.json:
+                    print(json.dumps(record))
+                else:
+                    print("%-10s threads %2d depth %2d %8.2fs %9d nodes %8d nps  speedup %.2fx  nps x%.2f  per worker %s" % (
+                        name, threads, result.depth, result.seconds, result.nodes, result.nps(), record["speedup"],
+                        record["npsScaling"], result.workerNodes))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
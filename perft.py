@@ -0,0 +1,188 @@
+# Perft: counts the leaf nodes of the legal move tree to a fixed depth. The counts for the reference positions
+# below are known, so any difference points at a move generator bug, and timing the walk gives nodes/sec.
+#
+#   python perft.py                                   #every reference position to depth 3 on both backends
+#   python perft.py --positions kiwipete --depth 4 --backend bitboard
+#   python perft.py --fen "<fen>" --depth 3 --divide  #per root move counts, to hunt down a wrong total
+#   python perft.py --json results.jsonl              #one JSON record per run, to compare commits
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import Engine
+
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+
+#(name, fen, {depth: nodes})
+REFERENCE_POSITIONS = [
+    ("start", STARTING_FEN,
+     {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+    #edge cases: en passant that exposes the king, castling rights and promotions. The shallow counts are there so
+    #the default depth 3 run checks them too
+    ("illegal-ep-1", "3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1", {1: 18, 2: 92, 3: 1670, 6: 1134888}),
+    ("illegal-ep-2", "8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1", {1: 13, 2: 102, 3: 1266, 6: 1015133}),
+    ("ep-capture-checks", "8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1", {1: 15, 2: 126, 3: 1928, 6: 1440467}),
+    ("short-castle-check", "5k2/8/8/8/8/8/8/4K2R w K - 0 1", {1: 15, 2: 66, 3: 1198, 6: 661072}),
+    ("long-castle-check", "3k4/8/8/8/8/8/8/R3K3 w Q - 0 1", {1: 16, 2: 71, 3: 1286, 6: 803711}),
+    ("castle-rights", "r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1", {1: 26, 2: 1141, 3: 27826, 4: 1274206}),
+    ("castle-prevented", "r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1", {1: 44, 2: 1494, 3: 50509, 4: 1720476}),
+    ("promote-out-of-check", "2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1", {1: 11, 2: 133, 3: 1442, 6: 3821001}),
+    ("discovered-check", "8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1", {1: 29, 2: 165, 3: 5160, 5: 1004658}),
+    ("promote-to-check", "4k3/1P6/8/8/8/8/K7/8 w - - 0 1", {1: 9, 2: 40, 3: 472, 6: 217342}),
+    ("underpromote-to-check", "8/P1k5/K7/8/8/8/8/8 w - - 0 1", {1: 6, 2: 27, 3: 273, 6: 92683}),
+    ("self-stalemate", "K1k5/8/P7/8/8/8/8/8 w - - 0 1", {1: 2, 2: 6, 3: 13, 6: 2217}),
+    ("stalemate-checkmate-1", "8/k1P5/8/1K6/8/8/8/8 w - - 0 1", {1: 10, 2: 25, 3: 268, 7: 567584}),
+    ("stalemate-checkmate-2", "8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1", {1: 37, 2: 183, 3: 6559, 4: 23527}),
+]
+
+
+#number of leaf nodes depth plies below the current position. The last ply is counted straight from the
+#move list (bulk counting) instead of making every leaf move
+#the move lists of the plies above the leaves are kept packed in buffers, one array('I') reused at every node
+def perft(gs, depth, buffers=None, ply=0):
+    if depth == 0:
+        return 1
+    if depth == 1:
+        return gs.countValidMoves()
+    if buffers is None:
+        buffers = Engine.MoveBuffers(depth)
+    buffers.store(ply, gs.getValidMoves())
+    nodes = 0
+    for i in range(buffers.count(ply)):
+        move = buffers.get(ply, i)
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1, buffers, ply + 1)
+        gs.undoMove()
+    return nodes
+
+#perft split by root move, {notation: nodes}
+def divide(gs, depth):
+    counts = {}
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        counts[move.getChessNotation()] = perft(gs, depth - 1)
+        gs.undoMove()
+    return counts
+
+
+def gitRevision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+#run perft on one position for every depth up to maxDepth, returning one result record per depth
+def benchmark(name, fen, expected, maxDepth, backend='mailbox', legalMoveGen=True, traceMemory=False):
+    results = []
+    for depth in range(1, maxDepth + 1):
+        gs = Engine.GameState(legalMoveGen=legalMoveGen, backend=backend, fen=fen)
+        if traceMemory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        nodes = perft(gs, depth)
+        seconds = time.perf_counter() - start
+        peakMemory = None
+        if traceMemory:
+            peakMemory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        results.append({
+            "position": name,
+            "fen": fen,
+            "backend": backend,
+            "legalMoveGen": legalMoveGen,
+            "depth": depth,
+            "nodes": nodes,
+            "expected": expected.get(depth),
+            "ok": None if expected.get(depth) is None else expected[depth] == nodes, #None: no reference count
+            "seconds": round(seconds, 6),
+            "nps": round(nodes / seconds) if seconds > 0 else None,
+            "peakMemory": peakMemory,
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft move generator checks and benchmarks")
+    parser.add_argument("--depth", type=int, default=3, help="deepest ply to count (default 3)")
+    parser.add_argument("--positions", nargs="*", help="reference positions to run, by name (default all)")
+    parser.add_argument("--fen", help="run a custom position instead of the reference ones")
+    parser.add_argument("--backend", choices=Engine.GameState.BACKENDS + ("all",), default="all")
+    parser.add_argument("--legacy", action="store_true", help="use the make/undo legal move filter")
+    parser.add_argument("--divide", action="store_true", help="print the node count for every root move")
+    parser.add_argument("--memory", action="store_true", help="record peak memory with tracemalloc (slow)")
+    parser.add_argument("--json", help="append one JSON record per depth to this file, '-' for stdout")
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        positions = [("custom", args.fen, {})]
+    else:
+        names = {name for name, _, _ in REFERENCE_POSITIONS}
+        for name in args.positions or ():
+            if name not in names:
+                parser.error("unknown position %r, expected one of %s" % (name, ", ".join(sorted(names))))
+        positions = [p for p in REFERENCE_POSITIONS if not args.positions or p[0] in args.positions]
+    backends = Engine.GameState.BACKENDS if args.backend == "all" else (args.backend,)
+
+    if args.divide:
+        for name, fen, _ in positions:
+            for backend in backends:
+                gs = Engine.GameState(legalMoveGen=not args.legacy, backend=backend, fen=fen)
+                counts = divide(gs, args.depth)
+                print("%s (%s) depth %d" % (name, backend, args.depth))
+                for notation in sorted(counts):
+                    print("  %s: %d" % (notation, counts[notation]))
+                print("  total: %d" % sum(counts.values()))
+        return 0
+
+    revision = gitRevision()
+    out = None
+    if args.json == "-":
+        out = sys.stdout
+    elif args.json:
+        out = open(args.json, "a")
+    failures = 0
+    unchecked = 0
+    try:
+        for name, fen, expected in positions:
+            for backend in backends:
+                depth = min(args.depth, max(expected)) if expected and not args.fen else args.depth
+                for result in benchmark(name, fen, expected, depth, backend, not args.legacy, args.memory):
+                    result["revision"] = revision
+                    if result["ok"] is False:
+                        failures += 1
+                    elif result["ok"] is None:
+                        unchecked += 1
+                    if out is not None:
+                        out.write(json.dumps(result) + "\n")
+                    if out is not sys.stdout:
+                        print("%-22s %-8s depth %d %10d nodes %8.3fs %9s nps%s%s" % (
+                            name, backend, result["depth"], result["nodes"], result["seconds"], result["nps"],
+                            "" if result["peakMemory"] is None else " %8.1f KiB peak" % (result["peakMemory"] / 1024),
+                            "" if result["ok"] else "  no reference" if result["ok"] is None else
+                            "  MISMATCH, expected %d" % result["expected"]))
+    finally:
+        if out is not None and out is not sys.stdout:
+            out.close()
+    if out is not sys.stdout:
+        print("%d mismatched, %d with no reference count" % (failures, unchecked))
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
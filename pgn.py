@@ -0,0 +1,310 @@
+# PGN reading and writing: splits a PGN file into games as it reads it, turns each game's movetext into SAN
+# tokens, and replays them on a GameState, resolving every SAN move against getValidMoves. Files are read
+# through mmap, one game at a time, so memory doesn't grow with the size of the database.
+#
+#   python pgn.py games.pgn --workers 4 --output results.jsonl
+#
+# replays every game on a process pool and writes one JSON line per game, in file order, with its tags, the
+# number of plies, the final FEN, or the ply and move where it went wrong. games/minute goes to stderr.
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import mmap
+import multiprocessing as mp
+import os
+import re
+import sys
+import time
+
+import Engine
+
+Move = Engine.Move
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+GAMES_PER_TASK = 32 #games sent to a worker at once, fewer round trips than one game per task
+IN_FLIGHT_PER_WORKER = 4
+
+_TAG = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+#comments, variations and NAGs are skipped; what's left are move numbers, moves and the result
+_TOKEN = re.compile(r'\{[^}]*\}|;[^\n]*|\$\d+|\(|\)|\d+\.(?:\.\.)?|[^\s(){};]+')
+_MOVE_NUMBER = re.compile(r'\d+\.+$')
+
+
+class PgnError(ValueError):
+    pass
+
+
+#raw text of each game in source, a path, a file object opened in binary mode or a bytes-like buffer.
+#A game ends where the tags of the next one start
+def readGames(source):
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                yield from readGames(buffer)
+        return
+    readline = source.readline if hasattr(source, 'readline') else iter(bytes(source).splitlines(True)).__next__
+    lines = []
+    inMoves = False
+    while True:
+        try:
+            raw = readline()
+        except StopIteration:
+            raw = b''
+        if not raw:
+            break
+        line = raw.decode('utf-8', 'replace') if isinstance(raw, bytes) else raw
+        stripped = line.strip()
+        if stripped.startswith('[') and inMoves:
+            yield ''.join(lines)
+            lines = []
+            inMoves = False
+        elif stripped and not stripped.startswith('[') and not stripped.startswith('%'):
+            inMoves = True
+        lines.append(line)
+    if any(line.strip() for line in lines):
+        yield ''.join(lines)
+
+#({tag: value}, [san, ...], result) of the text of one game
+def parseGame(text):
+    headers = {}
+    movetext = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith('['):
+            match = _TAG.match(stripped)
+            if match:
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+        elif not stripped.startswith('%'): #% escape lines are ignored
+            movetext.append(line)
+    sans = []
+    result = headers.get('Result', '*')
+    depth = 0 #inside how many variations
+    for token in _TOKEN.findall('\n'.join(movetext)):
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth = max(depth - 1, 0)
+        elif depth or token[0] in '{;$' or _MOVE_NUMBER.match(token):
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            sans.append(token)
+    return headers, sans, result
+
+
+#the move in moves (gs.getValidMoves() when left out) that san stands for. Raises PgnError when there is none
+#or more than one, and when a promotion piece is missing or given for a move that isn't a promotion
+def resolveSan(gs, san, moves=None):
+    if moves is None:
+        moves = gs.getValidMoves()
+    text = san.rstrip('+#!?')
+    if text in ('O-O', '0-0', 'O-O-O', '0-0-0'):
+        endCol = 6 if len(text) == 3 else 2
+        for move in moves:
+            if move.isCastleMove and move.endCol == endCol:
+                return move
+        raise PgnError("illegal castling %s" % san)
+
+    promotion = None
+    if '=' in text:
+        text, promotion = text.split('=', 1)
+    elif len(text) > 2 and text[-1] in 'QRBN' and text[-2] in '18':
+        text, promotion = text[:-1], text[-1] #e8Q without the '='
+    if promotion is not None and promotion not in Engine.Move.promotionPieces:
+        raise PgnError("bad promotion piece in %s" % san)
+    if text and text[0] in 'KQRBN':
+        piece, text = text[0], text[1:]
+    else:
+        piece = 'p'
+    text = text.replace('x', '').replace(':', '').replace('-', '')
+    if len(text) < 2 or text[-2] not in Move.filesToCols or text[-1] not in Move.ranksToRows:
+        raise PgnError("can't read move %s" % san)
+    endRow, endCol = Move.ranksToRows[text[-1]], Move.filesToCols[text[-2]]
+    fromFile = fromRank = None
+    for char in text[:-2]: #disambiguation: a file, a rank or both
+        if char in Move.filesToCols:
+            fromFile = Move.filesToCols[char]
+        elif char in Move.ranksToRows:
+            fromRank = Move.ranksToRows[char]
+        else:
+            raise PgnError("can't read move %s" % san)
+
+    found = None
+    toSq = endRow * 8 + endCol
+    for move in moves:
+        if (move.packed >> 6) & 63 != toSq: #cheapest test first, most moves go somewhere else
+            continue
+        if move.pieceMoved[1] != piece or move.isCastleMove:
+            continue
+        if (fromFile is not None and move.startCol != fromFile) or (fromRank is not None and move.startRow != fromRank):
+            continue
+        if move.pawnPromotion != (promotion is not None): #a promotion needs its piece, and nothing else takes one
+            continue
+        if promotion is not None and move.promotionChoice != promotion:
+            continue
+        if found is not None:
+            raise PgnError("ambiguous move %s" % san)
+        found = move
+    if found is None:
+        raise PgnError("illegal move %s" % san)
+    return found
+
+#standard algebraic notation of move in gs, before it is made. moves are gs.getValidMoves() if known already.
+#With checks, + or # is added, which costs making the move and generating the replies
+def toSan(gs, move, moves=None, checks=True):
+    if moves is None:
+        moves = gs.getValidMoves()
+    if move.isCastleMove:
+        san = 'O-O' if move.endCol == 6 else 'O-O-O'
+    else:
+        destination = move.getRankFile(move.endRow, move.endCol)
+        piece = move.pieceMoved[1]
+        if piece == 'p':
+            san = (move.colsToFiles[move.startCol] + 'x' if move.isCapture else '') + destination
+            if move.pawnPromotion:
+                san += '=' + move.promotionChoice
+        else:
+            rivals = [other for other in moves if other.pieceMoved == move.pieceMoved and other.endRow == move.endRow
+                      and other.endCol == move.endCol and other != move]
+            disambiguation = ''
+            if rivals:
+                if all(other.startCol != move.startCol for other in rivals):
+                    disambiguation = move.colsToFiles[move.startCol]
+                elif all(other.startRow != move.startRow for other in rivals):
+                    disambiguation = move.rowsToRanks[move.startRow]
+                else:
+                    disambiguation = move.getRankFile(move.startRow, move.startCol)
+            san = piece + disambiguation + ('x' if move.isCapture else '') + destination
+    if checks:
+        gs.makeMove(move)
+        if gs.inCheck():
+            replies = gs.getValidMoves()
+            san += '#' if len(replies) == 0 else '+'
+        gs.undoMove()
+    return san
+
+
+#PGN text of the game played in gs, tags first (Event, Site, Date, Round, White, Black, Result in that order)
+def writeGame(gs, headers=None, result='*'):
+    tags = {'Event': '?', 'Site': '?', 'Date': '????.??.??', 'Round': '?', 'White': '?', 'Black': '?'}
+    tags.update(headers or {})
+    tags['Result'] = result
+    if gs.startFen is not None:
+        tags['SetUp'] = '1'
+        tags['FEN'] = gs.startFen
+    order = ['Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result']
+    lines = ['[%s "%s"]' % (tag, str(tags[tag]).replace('\\', '\\\\').replace('"', '\\"'))
+             for tag in order + [tag for tag in tags if tag not in order]]
+
+    replay = Engine.GameState(backend=gs.backend, fen=gs.startFen)
+    words = []
+    for move in gs.moveLog:
+        ply = replay.startPly + len(replay.moveLog)
+        if replay.whiteToMove:
+            words.append('%d.' % (ply // 2 + 1))
+        elif not words:
+            words.append('%d...' % (ply // 2 + 1))
+        moves = replay.getValidMoves()
+        words.append(toSan(replay, move, moves))
+        replay.makeMove(move)
+    words.append(result)
+    movetext = []
+    line = ''
+    for word in words: #wrapped at 80 columns
+        if line and len(line) + 1 + len(word) > 80:
+            movetext.append(line)
+            line = word
+        else:
+            line = line + ' ' + word if line else word
+    movetext.append(line)
+    return '\n'.join(lines) + '\n\n' + '\n'.join(movetext) + '\n'
+
+
+#replay the text of one game and describe the outcome as a dict
+def replayGame(text, backend='bitboard'):
+    headers, sans, result = parseGame(text)
+    record = {"white": headers.get('White'), "black": headers.get('Black'), "result": result}
+    try:
+        gs = Engine.GameState(backend=backend, fen=headers['FEN'] if 'FEN' in headers else None)
+    except ValueError as error:
+        record["error"] = "bad FEN tag: %s" % error
+        record["plies"] = 0
+        return record
+    for ply, san in enumerate(sans):
+        try:
+            move = resolveSan(gs, san)
+        except PgnError as error:
+            record["error"] = str(error)
+            record["errorPly"] = ply
+            break
+        gs.makeMove(move)
+    record["plies"] = len(gs.moveLog)
+    record["fen"] = gs.getFen()
+    return record
+
+def replayGames(texts, backend='bitboard'):
+    return [replayGame(text, backend) for text in texts]
+
+
+#lists of up to size games from source
+def _batches(source, size):
+    batch = []
+    for text in readGames(source):
+        batch.append(text)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+#replay every game in source on a pool of workers, yielding the records in file order.
+#With workers=1 it all happens in this process
+def replayFile(source, workers=1, backend='bitboard'):
+    if workers <= 1:
+        for text in readGames(source):
+            yield replayGame(text, backend)
+        return
+    pending = collections.deque()
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=mp.get_context('spawn')) as pool:
+        for batch in _batches(source, GAMES_PER_TASK):
+            pending.append(pool.submit(replayGames, batch, backend))
+            if len(pending) >= workers * IN_FLIGHT_PER_WORKER:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="replay and validate every game of a PGN file")
+    parser.add_argument("input", help="PGN file")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--backend", choices=Engine.GameState.BACKENDS, default="bitboard")
+    parser.add_argument("--output", help="JSON lines file with a record per game, none when left out")
+    args = parser.parse_args(argv)
+
+    output = open(args.output, 'w') if args.output else None
+    games = errors = plies = 0
+    start = time.perf_counter()
+    try:
+        for index, record in enumerate(replayFile(args.input, args.workers, args.backend)):
+            games += 1
+            plies += record["plies"]
+            errors += "error" in record
+            if output is not None:
+                record["index"] = index
+                output.write(json.dumps(record) + "\n")
+    finally:
+        if output is not None:
+            output.close()
+    seconds = time.perf_counter() - start
+    print("%d games, %d plies, %d with errors in %.2fs: %.0f games/minute" % (
+        games, plies, errors, seconds, games * 60 / seconds if seconds else 0.0), file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
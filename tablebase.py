@@ -0,0 +1,522 @@
+# Endgame tablebases for KQK, KRK, KPK and KBNK: every legal placement of the pieces is given win, draw or
+# loss and the distance to mate by retrograde analysis, starting from the mates and walking moves backwards.
+# The stronger side is stored as white; a position where black has the pieces is probed colour flipped.
+#
+#   python tablebase.py generate --dir tablebases --workers 4
+#   python tablebase.py probe --dir tablebases --fen "8/8/8/4k3/8/8/8/KQ6 w - - 0 1"
+#
+# Positions are numbered by a placement index: white king square (reduced by symmetry to the 10 squares of
+# the a1-d1-d4 triangle, or to files a-d when there is a pawn), black king square, then the other pieces,
+# with a block for each side to move. A file is a 16 byte header, 2 bits of WDL per position and one byte of
+# distance to mate in plies per position. Probing maps the file and reads two bytes, no numpy needed for that.
+#
+# Generation needs numpy. Tables run in parallel on a process pool, each one written to a temporary file
+# and renamed when done, so an interrupted run picks up with the tables that are missing. KPK needs KQK and
+# KRK for its promotions and waits for them.
+
+import argparse
+import concurrent.futures
+import mmap
+import multiprocessing as mp
+import os
+import struct
+import sys
+import time
+
+import Engine
+
+try:
+    import numpy as np
+except ImportError: #probing works without it, only generate() needs it
+    np = None
+
+TABLES = {'KQK': 'Q', 'KRK': 'R', 'KPK': 'p', 'KBNK': 'BN'} #name: white pieces besides the king
+DEPENDENCIES = {'KPK': ('KQK', 'KRK')}
+HEADER = struct.Struct('<4s8sI') #magic, table name, positions per side to move
+MAGIC = b'CTB1'
+HEADER_BYTES = 16
+#WDL codes, for the side to move
+ILLEGAL, DRAW, WIN, LOSS = 0, 1, 2, 3
+MAX_DTM = 255
+
+KING_STEPS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+KNIGHT_STEPS = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+ROOK_DIRECTIONS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+#the 8 symmetries of the board as square maps, squares numbered row * 8 + col like packed moves
+_TRANSFORMS = (lambda r, c: (r, c), lambda r, c: (r, 7 - c), lambda r, c: (7 - r, c), lambda r, c: (7 - r, 7 - c),
+               lambda r, c: (c, r), lambda r, c: (c, 7 - r), lambda r, c: (7 - c, r), lambda r, c: (7 - c, 7 - r))
+SQUARE_MAPS = [[(lambda r, c: r * 8 + c)(*transform(sq >> 3, sq & 7)) for sq in range(64)] for transform in _TRANSFORMS]
+TRIANGLE = [sq for sq in range(64) if (sq & 7) <= 3 and 7 - (sq >> 3) <= (sq & 7)] #a1-d1-d4
+LEFT_HALF = [sq for sq in range(64) if (sq & 7) <= 3]
+DIAGONAL_MIRROR = 7 #the symmetry that keeps the a1-h8 diagonal in place
+
+
+#placement index of one table, as plain lists so probing doesn't need numpy
+class Layout():
+    def __init__(self, name):
+        self.name = name
+        self.pieces = TABLES[name]
+        self.hasPawn = 'p' in self.pieces
+        #symmetries allowed: all 8 without pawns, only the left-right mirror with them
+        transforms = (0, 1) if self.hasPawn else range(8)
+        self.kingSquares = LEFT_HALF if self.hasPawn else TRIANGLE
+        self.slotOf = [-1] * 64
+        for slot, sq in enumerate(self.kingSquares):
+            self.slotOf[sq] = slot
+        #the symmetry that brings a white king on each square into kingSquares, identity when it is already there
+        self.canonical = [next(t for t in transforms if SQUARE_MAPS[t][sq] in self.kingSquares) for sq in range(64)]
+        self.axes = [48 if piece == 'p' else 64 for piece in self.pieces] #pawns only on ranks 2-7
+        self.size = len(self.kingSquares) * 64
+        for axis in self.axes:
+            self.size *= axis
+
+    #index of a placement in the block of one side to move, mapped by symmetry first. With the white king on the
+    #a1-h8 diagonal the placement is also mirrored in it, so the first piece off the diagonal ends up below it
+    def index(self, wk, bk, others):
+        squareMap = SQUARE_MAPS[self.canonical[wk]]
+        squares = [squareMap[sq] for sq in [wk, bk] + list(others)]
+        if not self.hasPawn and (squares[0] >> 3) + (squares[0] & 7) == 7:
+            for sq in squares[1:]:
+                if (sq >> 3) + (sq & 7) != 7:
+                    if 7 - (sq >> 3) > (sq & 7):
+                        squares = [SQUARE_MAPS[DIAGONAL_MIRROR][sq] for sq in squares]
+                    break
+        index = self.slotOf[squares[0]] * 64 + squares[1]
+        for piece, axis, sq in zip(self.pieces, self.axes, squares[2:]):
+            index = index * axis + sq - (8 if piece == 'p' else 0)
+        return index
+
+
+class Tablebases():
+    def __init__(self, directory):
+        self.directory = directory
+        self.layouts = {name: Layout(name) for name in TABLES}
+        self.tables = {} #name: (file, mmap, positions per side to move), filled on first use
+        self.bySignature = {''.join(sorted(pieces)): name for name, pieces in TABLES.items()}
+
+    def _table(self, name):
+        table = self.tables.get(name)
+        if table is None:
+            path = os.path.join(self.directory, name + '.tb')
+            if not os.path.exists(path):
+                table = self.tables[name] = (None, None, 0)
+                return table
+            f = open(path, 'rb')
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, tableName, size = HEADER.unpack_from(buffer, 0)
+            if magic != MAGIC or tableName.rstrip(b'\0').decode() != name:
+                raise ValueError("%s is not a %s tablebase" % (path, name))
+            table = self.tables[name] = (f, buffer, size)
+        return table
+
+    #(wdl, dtm) for the side to move of gs: wdl 1 win, 0 draw, -1 loss, dtm plies to mate (0 for a draw).
+    #None when the material has no table, the table is missing or castling rights are left
+    def probe(self, gs):
+        if gs.castlingRights:
+            return None
+        white = []
+        black = []
+        wk = bk = -1
+        for row, pieces in enumerate(gs.board):
+            for col, piece in enumerate(pieces):
+                if piece == '--':
+                    continue
+                if piece[1] == 'K':
+                    if piece[0] == 'w':
+                        wk = row * 8 + col
+                    else:
+                        bk = row * 8 + col
+                elif piece[0] == 'w':
+                    white.append((piece[1], row * 8 + col))
+                else:
+                    black.append((piece[1], row * 8 + col))
+                if len(white) + len(black) > 2:
+                    return None
+        whiteToMove = gs.whiteToMove
+        if white and black:
+            return None
+        if black: #colour flip: black's pieces become white's, ranks mirrored
+            wk, bk = bk ^ 56, wk ^ 56
+            white = [(piece, sq ^ 56) for piece, sq in black]
+            whiteToMove = not whiteToMove
+        name = self.bySignature.get(''.join(sorted(piece for piece, _ in white)))
+        if name is None:
+            return None
+        f, buffer, size = self._table(name)
+        if buffer is None:
+            return None
+        layout = self.layouts[name]
+        squares = dict(white)
+        position = layout.index(wk, bk, [squares[piece] for piece in layout.pieces]) + (0 if whiteToMove else size)
+        wdl = (buffer[HEADER_BYTES + (position >> 2)] >> ((position & 3) * 2)) & 3
+        if wdl == ILLEGAL:
+            return None
+        dtm = buffer[HEADER_BYTES + (2 * size + 3) // 4 + position]
+        return (1 if wdl == WIN else -1 if wdl == LOSS else 0), dtm
+
+    #the legal move of gs that keeps the best result: the fastest win, any draw, or the slowest loss.
+    #None when gs isn't in the tables
+    def bestMove(self, gs):
+        if self.probe(gs) is None:
+            return None
+        best = None
+        bestKey = None
+        for move in gs.getValidMoves():
+            gs.makeMove(move)
+            result = self.probe(gs)
+            gs.undoMove()
+            wdl, dtm = (-result[0], result[1] + 1) if result is not None else (0, 0) #captures and minor promotions draw
+            key = (wdl, -dtm if wdl > 0 else dtm)
+            if bestKey is None or key > bestKey:
+                best, bestKey = move, key
+        return best
+
+    def close(self):
+        for f, buffer, _ in self.tables.values():
+            if buffer is not None:
+                buffer.close()
+                f.close()
+        self.tables = {}
+
+
+#move tables for generation, built when numpy is there
+def _moveTables():
+    def step(sq, dr, dc):
+        r, c = (sq >> 3) + dr, (sq & 7) + dc
+        return r * 8 + c if 0 <= r < 8 and 0 <= c < 8 else -1
+    kings = np.array([[step(sq, dr, dc) for dr, dc in KING_STEPS] for sq in range(64)])
+    knights = np.array([[step(sq, dr, dc) for dr, dc in KNIGHT_STEPS] for sq in range(64)])
+    rays = np.full((64, 8, 7), -1)
+    between = np.zeros((64, 64), dtype=np.uint64)
+    rookLine = np.zeros((64, 64), dtype=bool)
+    bishopLine = np.zeros((64, 64), dtype=bool)
+    for sq in range(64):
+        for d, (dr, dc) in enumerate(ROOK_DIRECTIONS + BISHOP_DIRECTIONS):
+            passed = 0
+            target = sq
+            for distance in range(7):
+                target = step(target, dr, dc)
+                if target < 0:
+                    break
+                rays[sq, d, distance] = target
+                between[sq, target] = passed
+                (rookLine if d < 4 else bishopLine)[sq, target] = True
+                passed |= 1 << target
+    kingMask = np.zeros((64, 64), dtype=bool)
+    knightMask = np.zeros((64, 64), dtype=bool)
+    pawnMask = np.zeros((64, 64), dtype=bool)
+    for sq in range(64):
+        kingMask[sq, kings[sq][kings[sq] >= 0]] = True
+        knightMask[sq, knights[sq][knights[sq] >= 0]] = True
+        for dc in (-1, 1): #white pawns capture towards row 0
+            if step(sq, -1, dc) >= 0:
+                pawnMask[sq, step(sq, -1, dc)] = True
+    return {'kings': kings, 'knights': knights, 'rays': rays, 'between': between, 'K': kingMask, 'N': knightMask,
+            'p': pawnMask, 'R': rookLine, 'B': bishopLine, 'Q': rookLine | bishopLine}
+
+
+class _Generator():
+    def __init__(self, name, directory):
+        self.layout = Layout(name)
+        self.directory = directory
+        self.moves = _moveTables()
+        self.squareMaps = np.array(SQUARE_MAPS)
+        self.canonical = np.array(self.layout.canonical)
+        self.slotOf = np.array(self.layout.slotOf)
+        self.kingSquares = np.array(self.layout.kingSquares)
+
+    def index(self, wk, bk, others):
+        transform = self.canonical[wk]
+        squares = [self.squareMaps[transform, sq] for sq in [wk, bk] + list(others)]
+        if not self.layout.hasPawn:
+            undecided = (squares[0] >> 3) + (squares[0] & 7) == 7
+            mirror = np.zeros(len(wk), dtype=bool)
+            for sq in squares[1:]:
+                off = (sq >> 3) + (sq & 7) != 7
+                mirror |= undecided & off & (7 - (sq >> 3) > (sq & 7))
+                undecided &= ~off
+            squares = [np.where(mirror, self.squareMaps[DIAGONAL_MIRROR, sq], sq) for sq in squares]
+        index = self.slotOf[squares[0]] * 64 + squares[1]
+        for piece, axis, sq in zip(self.layout.pieces, self.layout.axes, squares[2:]):
+            index = index * axis + sq - (8 if piece == 'p' else 0)
+        return index
+
+    #(wk, bk, [other squares]) of indices
+    def decode(self, index):
+        others = []
+        for piece, axis in reversed(list(zip(self.layout.pieces, self.layout.axes))):
+            index, sq = np.divmod(index, axis)
+            others.insert(0, sq + (8 if piece == 'p' else 0))
+        slot, bk = np.divmod(index, 64)
+        return self.kingSquares[slot], bk, others
+
+    #is target attacked by white piece on frm, given the occupied squares
+    def attacks(self, piece, frm, target, occupied):
+        hit = self.moves[piece][frm, target]
+        if piece in 'RBQ':
+            hit &= (self.moves['between'][frm, target] & occupied) == 0
+        return hit
+
+    @staticmethod
+    def bits(*squares):
+        occupied = np.zeros(len(squares[0]), dtype=np.uint64)
+        for sq in squares:
+            occupied |= np.left_shift(np.uint64(1), sq.astype(np.uint64))
+        return occupied
+
+    #(legal, check) for the placements of index: every square different, kings apart, and whether the black
+    #king is attacked (legal with black to move, not with white to move)
+    def placement(self, index):
+        wk, bk, others = self.decode(index)
+        legal = ~self.moves['K'][wk, bk] & (wk != bk)
+        for i, sq in enumerate(others):
+            legal &= (sq != wk) & (sq != bk)
+            for other in others[:i]:
+                legal &= sq != other
+        occupied = self.bits(wk, bk, *others)
+        check = np.zeros(len(index), dtype=bool)
+        for piece, sq in zip(self.layout.pieces, others):
+            check |= self.attacks(piece, sq, bk, occupied)
+        return legal, check
+
+    #for btm placements: (successors, moveLegal, escape) where successors[i, d] is the white to move index after
+    #the black king steps in direction d, moveLegal says if that is a legal non-capture, and escape marks
+    #placements where black can take a piece safely, which draws all of these endgames
+    def blackMoves(self, index):
+        wk, bk, others = self.decode(index)
+        count = len(index)
+        successors = np.zeros((count, 8), dtype=np.int64)
+        moveLegal = np.zeros((count, 8), dtype=bool)
+        escape = np.zeros(count, dtype=bool)
+        for d in range(8):
+            dest = self.moves['kings'][bk, d]
+            onBoard = dest >= 0
+            dest = np.where(onBoard, dest, 0)
+            empty = onBoard & (dest != wk)
+            for i, sq in enumerate(others):
+                taken = onBoard & (dest == sq)
+                empty &= ~taken
+                rest = [other for j, other in enumerate(others) if j != i]
+                occupied = self.bits(wk, *rest) if rest else self.bits(wk)
+                attacked = self.moves['K'][wk, dest]
+                for piece, other in zip(self.layout.pieces[:i] + self.layout.pieces[i + 1:], rest):
+                    attacked |= self.attacks(piece, other, dest, occupied) & (other != dest)
+                escape |= taken & ~attacked
+            successors[:, d] = self.index(wk, dest, others)
+            moveLegal[:, d] = empty & self.legalW[successors[:, d]]
+        return successors, moveLegal, escape
+
+    #white to move predecessors of the btm placements in index: every white piece moved back to where it could
+    #have come from. Returns unique canonical indices
+    def whiteUnmoves(self, index):
+        wk, bk, others = self.decode(index)
+        occupied = self.bits(wk, bk, *others)
+        found = []
+        pieces = [('K', wk)] + list(zip(self.layout.pieces, others))
+        for moving, (piece, sq) in enumerate(pieces):
+            sources = []
+            #(source squares, whether the path in between must be empty)
+            if piece == 'K':
+                sources = [(self.moves['kings'][sq, d], False) for d in range(8)]
+            elif piece == 'N':
+                sources = [(self.moves['knights'][sq, d], False) for d in range(8)]
+            elif piece == 'p': #pushed from one row behind, never from row 7, or two rows from row 6
+                sources = [(np.where(sq < 48, sq + 8, -1), False), (np.where((sq >= 32) & (sq < 40), sq + 16, -1), True)]
+            else:
+                directions = {'R': range(4), 'B': range(4, 8), 'Q': range(8)}[piece]
+                sources = [(self.moves['rays'][sq, d, distance], True) for d in directions for distance in range(7)]
+            for source, clearPath in sources:
+                ok = source >= 0
+                src = np.where(ok, source, 0)
+                ok &= ((occupied >> src.astype(np.uint64)) & np.uint64(1)) == 0
+                if clearPath:
+                    ok &= (self.moves['between'][sq, src] & occupied) == 0
+                if not ok.any():
+                    continue
+                moved = [p[1][ok] for p in pieces]
+                moved[moving] = src[ok]
+                found.append(self.index(moved[0], bk[ok], moved[1:]))
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    #btm predecessors of the white to move placements in index, the black king stepped back
+    def blackUnmoves(self, index):
+        wk, bk, others = self.decode(index)
+        occupied = self.bits(wk, *others)
+        found = []
+        for d in range(8):
+            src = self.moves['kings'][bk, d]
+            ok = src >= 0
+            src = np.where(ok, src, 0)
+            ok &= ((occupied >> src.astype(np.uint64)) & np.uint64(1)) == 0
+            if ok.any():
+                found.append(self.index(wk[ok], src[ok], [sq[ok] for sq in others]))
+        if not found:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(found))
+
+    #{ply: white to move indices} won by promoting, from the tables of the promoted material
+    def promotionWins(self):
+        size = self.layout.size
+        wk, bk, (pawn,) = self.decode(np.arange(size))
+        promotes = self.legalW & (pawn < 16) & (wk != pawn - 8) & (bk != pawn - 8)
+        best = np.full(size, MAX_DTM + 1, dtype=np.int64)
+        where = np.nonzero(promotes)[0]
+        for name in DEPENDENCIES[self.layout.name]:
+            other = _Generator(name, self.directory)
+            wdl, dtm = readTable(self.directory, name)
+            target = other.index(wk[where], bk[where], [pawn[where] - 8]) + other.layout.size #black to move
+            lost = wdl[target] == LOSS
+            best[where[lost]] = np.minimum(best[where[lost]], dtm[target[lost]].astype(np.int64) + 1)
+        seeds = {}
+        for ply in np.unique(best[best <= MAX_DTM]):
+            seeds[int(ply)] = np.nonzero(best == ply)[0]
+        return seeds
+
+    def run(self):
+        size = self.layout.size
+        everything = np.arange(size)
+        legal, check = self.placement(everything)
+        wk, bk, others = self.decode(everything)
+        legal &= self.index(wk, bk, others) == everything #the mirror images of canonical placements are left out
+        del wk, bk, others
+        self.legalW = legal & ~check
+        legalB = legal
+        wtm = np.full(size, -1, dtype=np.int16) #plies to mate for white, -1 unknown
+        btm = np.full(size, -1, dtype=np.int16) #plies to be mated for black
+        escape = np.zeros(size, dtype=bool)
+        mated = []
+        for start in range(0, size, 1 << 20):
+            chunk = everything[start:start + (1 << 20)]
+            _, moveLegal, chunkEscape = self.blackMoves(chunk)
+            escape[chunk] = chunkEscape
+            stuck = legalB[chunk] & check[chunk] & ~moveLegal.any(axis=1) & ~chunkEscape
+            mated.append(chunk[stuck])
+        frontier = np.concatenate(mated)
+        btm[frontier] = 0
+        seeds = self.promotionWins() if self.layout.hasPawn else {}
+
+        ply = 0
+        while True:
+            won = self.whiteUnmoves(frontier) if len(frontier) else np.zeros(0, dtype=np.int64)
+            if ply + 1 in seeds:
+                won = np.union1d(won, seeds.pop(ply + 1))
+            won = won[self.legalW[won] & (wtm[won] < 0)]
+            wtm[won] = ply + 1
+            if len(won) == 0 and not any(seed > ply for seed in seeds):
+                break
+            candidates = self.blackUnmoves(won) if len(won) else np.zeros(0, dtype=np.int64)
+            candidates = candidates[legalB[candidates] & (btm[candidates] < 0) & ~escape[candidates]]
+            if len(candidates):
+                successors, moveLegal, _ = self.blackMoves(candidates)
+                allLost = np.all(~moveLegal | (wtm[successors] >= 0), axis=1)
+                candidates = candidates[allLost]
+            btm[candidates] = ply + 2
+            frontier = candidates
+            ply += 2
+
+        wdl = np.zeros(2 * size, dtype=np.uint8)
+        wdl[:size] = np.where(self.legalW, np.where(wtm >= 0, WIN, DRAW), ILLEGAL)
+        wdl[size:] = np.where(legalB, np.where(btm >= 0, LOSS, DRAW), ILLEGAL)
+        dtm = np.concatenate([np.maximum(wtm, 0), np.maximum(btm, 0)]).clip(0, MAX_DTM).astype(np.uint8)
+        return wdl, dtm
+
+
+#(wdl codes, dtm) of a generated table as numpy arrays, both sides to move
+def readTable(directory, name):
+    with open(os.path.join(directory, name + '.tb'), 'rb') as f:
+        data = f.read()
+    _, _, size = HEADER.unpack_from(data, 0)
+    packed = np.frombuffer(data, dtype=np.uint8, count=(2 * size + 3) // 4, offset=HEADER_BYTES)
+    wdl = ((packed[:, None] >> np.array([0, 2, 4, 6], dtype=np.uint8)) & 3).reshape(-1)[:2 * size]
+    dtm = np.frombuffer(data, dtype=np.uint8, count=2 * size, offset=HEADER_BYTES + len(packed))
+    return wdl, dtm
+
+def writeTable(directory, name, wdl, dtm):
+    padded = np.zeros((len(wdl) + 3) // 4 * 4, dtype=np.uint8)
+    padded[:len(wdl)] = wdl
+    quads = padded.reshape(-1, 4)
+    packed = quads[:, 0] | (quads[:, 1] << 2) | (quads[:, 2] << 4) | (quads[:, 3] << 6)
+    path = os.path.join(directory, name + '.tb')
+    with open(path + '.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, name.encode(), len(wdl) // 2).ljust(HEADER_BYTES, b'\0'))
+        f.write(packed.astype(np.uint8).tobytes())
+        f.write(dtm.tobytes())
+    os.replace(path + '.tmp', path) #a table is either all there or not at all
+
+#is there a complete table for name in directory
+def isComplete(directory, name):
+    path = os.path.join(directory, name + '.tb')
+    if not os.path.exists(path):
+        return False
+    size = Layout(name).size
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_BYTES)
+    return len(header) == HEADER_BYTES and HEADER.unpack_from(header, 0) == (MAGIC, name.encode().ljust(8, b'\0'), size) and \
+        os.path.getsize(path) == HEADER_BYTES + (2 * size + 3) // 4 + 2 * size
+
+#generate one table, run in a worker process. Returns (name, seconds, wins, positions)
+def generateTable(name, directory):
+    start = time.perf_counter()
+    wdl, dtm = _Generator(name, directory).run()
+    writeTable(directory, name, wdl, dtm)
+    return name, time.perf_counter() - start, int(np.count_nonzero(wdl == WIN)), int(np.count_nonzero(wdl))
+
+#generate the tables in names that aren't in directory yet on a pool of workers, each table as soon as the
+#ones it needs are done. Yields what generateTable returns as tables finish
+def generate(names, directory, workers=1):
+    if np is None:
+        raise RuntimeError("tablebase generation needs numpy")
+    os.makedirs(directory, exist_ok=True)
+    todo = [name for name in names if not isComplete(directory, name)]
+    for name in todo: #dependencies get built too
+        todo.extend(dependency for dependency in DEPENDENCIES.get(name, ())
+                    if dependency not in todo and not isComplete(directory, dependency))
+    running = {}
+    with concurrent.futures.ProcessPoolExecutor(max(1, workers), mp_context=mp.get_context('spawn')) as pool:
+        while todo or running:
+            for name in list(todo):
+                if not any(dependency in todo or dependency in running.values() for dependency in DEPENDENCIES.get(name, ())):
+                    todo.remove(name)
+                    running[pool.submit(generateTable, name, directory)] = name
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                yield future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="generate or probe the endgame tablebases")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("generate", help="generate the tables that are missing")
+    build.add_argument("--tables", nargs="+", choices=sorted(TABLES), default=sorted(TABLES))
+    build.add_argument("--dir", default="tablebases")
+    build.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    probe = commands.add_parser("probe", help="look up a position")
+    probe.add_argument("--dir", default="tablebases")
+    probe.add_argument("--fen", required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        for name, seconds, wins, positions in generate(args.tables, args.dir, args.workers):
+            print("%-5s %9d positions %9d won for the side to move %8.2fs" % (name, positions, wins, seconds))
+        return 0
+
+    tablebases = Tablebases(args.dir)
+    gs = Engine.GameState(fen=args.fen)
+    result = tablebases.probe(gs)
+    if result is None:
+        print("not in the tablebases")
+        return 1
+    wdl, dtm = result
+    move = tablebases.bestMove(gs)
+    print("%s%s, best move %s" % ({1: "win", 0: "draw", -1: "loss"}[wdl], " in %d plies" % dtm if wdl else "",
+                                 move.getChessNotation() if move else "none"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
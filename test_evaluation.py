@@ -0,0 +1,69 @@
+#the scores GameState keeps up to date in makeMove and undoMove must always equal a from-scratch computation
+import random
+
+import pytest
+
+import Engine
+import evaluation
+
+BACKENDS = Engine.GameState.BACKENDS
+
+
+def assertScores(gs):
+    assert (gs.pstScore, gs.gamePhase, gs.pawnKey) == evaluation.computeScores(gs)
+
+def isSpecial(move):
+    return move.isCastleMove or move.enpassant or move.pawnPromotion
+
+def kind(move):
+    return 'castle' if move.isCastleMove else 'enpassant' if move.enpassant else 'promotion'
+
+
+#random games, checked after every make and undo. Castling, en passant and promotions are picked more often than
+#chance would, so every game run covers them
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_random_games(backend):
+    rng = random.Random(1)
+    seen = set()
+    for game in range(20):
+        gs = Engine.GameState(backend=backend)
+        assertScores(gs)
+        for ply in range(200):
+            moves = gs.getValidMoves()
+            if not moves:
+                break
+            special = [move for move in moves if isSpecial(move)]
+            move = rng.choice(special) if special and rng.random() < 0.5 else rng.choice(moves)
+            if isSpecial(move):
+                seen.add(kind(move))
+            gs.makeMove(move)
+            assertScores(gs)
+            if rng.random() < 0.2:
+                gs.undoMove()
+                assertScores(gs)
+        while gs.moveLog:
+            gs.undoMove()
+            assertScores(gs)
+    assert seen == {'castle', 'enpassant', 'promotion'}
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("fen, notation", [
+    ("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1", "e1g1"),
+    ("r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1", "e1c1"),
+    ("r3k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1", "e8g8"),
+    ("r3k2r/8/8/8/8/8/8/R3K2R b KQkq - 0 1", "e8c8"),
+    ("4k3/8/8/3pP3/8/8/8/4K3 w - d6 0 1", "e5d6"),
+    ("4k3/8/8/8/3Pp3/8/8/4K3 b - d3 0 1", "e4d3"),
+    ("1r2k3/P7/8/8/8/8/8/4K3 w - - 0 1", "a7a8q"),
+    ("1r2k3/P7/8/8/8/8/8/4K3 w - - 0 1", "a7b8n"),
+    ("4k3/8/8/8/8/8/p7/1R2K3 b - - 0 1", "a2b1r"),
+])
+def test_special_moves(backend, fen, notation):
+    gs = Engine.GameState(backend=backend, fen=fen)
+    assertScores(gs)
+    move = next(move for move in gs.getValidMoves() if move.getChessNotation() == notation)
+    gs.makeMove(move)
+    assertScores(gs)
+    gs.undoMove()
+    assertScores(gs)
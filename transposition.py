@@ -0,0 +1,173 @@
+# Transposition table: remembers search results by Zobrist key so positions reached through different move
+# orders are only searched once. The table is a preallocated flat array of 64 bit words sized in megabytes,
+# so even a large table costs its size in memory rather than one Python object per entry.
+#
+# Each entry is two words. The second holds the data:
+#   bits 0-15  best move (Move.getCompactID, 0 for none)
+#   bits 16-23 depth
+#   bits 24-25 bound type (EXACT, LOWER, UPPER, 0 for an empty slot)
+#   bits 26-31 age (the search generation that stored it)
+#   bits 32-63 score + 2**31
+# and the first holds key ^ data. A probe only accepts the entry when both words XOR back to the key, which
+# also throws away entries torn by another process writing the same slot of a shared table.
+#
+# Entries come in buckets of two: the first slot keeps the deepest result (or anything from an older search),
+# the second is always replaced.
+
+from array import array
+
+import Engine
+
+EXACT = 1
+LOWER = 2 #score is at least this (fail high)
+UPPER = 3 #score is at most this (fail low)
+
+ENTRY_BYTES = 16
+SCORE_OFFSET = 1 << 31
+KEY_MASK = (1 << 64) - 1
+
+
+class TranspositionTable():
+    def __init__(self, sizeMb=16, buffer=None):
+        #buffer lets the table live in memory someone else owns, e.g. multiprocessing.shared_memory
+        buckets = 1
+        while buckets * 2 * ENTRY_BYTES * 2 <= sizeMb * 1024 * 1024:
+            buckets *= 2 #power of two bucket count so the index is a mask
+        self.sizeMb = sizeMb
+        self.bucketMask = buckets - 1
+        if buffer is None:
+            self.table = array('Q', [0]) * (buckets * 4)
+        else:
+            self.table = memoryview(buffer).cast('B')[:buckets * 4 * 8].cast('Q')
+        self.age = 0
+        self.resetStats()
+
+    #bytes a table of sizeMb needs, for callers that allocate the buffer themselves
+    @staticmethod
+    def bytesNeeded(sizeMb):
+        buckets = 1
+        while buckets * 2 * ENTRY_BYTES * 2 <= sizeMb * 1024 * 1024:
+            buckets *= 2
+        return buckets * 4 * 8
+
+    def resetStats(self):
+        self.probes = 0
+        self.hits = 0
+        self.collisions = 0 #probes that found the bucket filled by other positions
+        self.stores = 0
+        self.overwrites = 0 #stores that evicted a different position
+
+    def clear(self):
+        memoryview(self.table).cast('B')[:] = bytes(len(self.table) * 8)
+        self.age = 0
+        self.resetStats()
+
+    #call at the start of every search so older entries become preferred victims
+    def newSearch(self):
+        self.age = (self.age + 1) & 63
+
+    #(move, depth, score, bound) stored for key, or None
+    def probe(self, key):
+        table = self.table
+        self.probes += 1
+        index = (key & self.bucketMask) << 2
+        occupied = False
+        for i in (index, index + 2):
+            data = table[i + 1]
+            if data == 0:
+                continue
+            if table[i] ^ data == key:
+                self.hits += 1
+                return (data & 0xFFFF, (data >> 16) & 0xFF, (data >> 32) - SCORE_OFFSET, (data >> 24) & 3)
+            occupied = True
+        if occupied:
+            self.collisions += 1
+        return None
+
+    def store(self, key, move, depth, score, bound):
+        table = self.table
+        index = (key & self.bucketMask) << 2
+        depth = min(max(depth, 0), 255)
+        self.stores += 1
+
+        data = table[index + 1]
+        preferredKey = table[index] ^ data
+        if data == 0 or preferredKey == key or depth >= (data >> 16) & 0xFF or (data >> 26) & 63 != self.age:
+            slot = index #deeper, same position or stale: goes in the depth preferred slot
+        else:
+            slot = index + 2
+            data = table[slot + 1]
+        if data != 0 and table[slot] ^ data != key:
+            self.overwrites += 1
+        elif data != 0 and move == 0:
+            move = data & 0xFFFF #keep the best move we already had for this position
+
+        data = move | (depth << 16) | (bound << 24) | (self.age << 26) | ((score + SCORE_OFFSET) << 32)
+        table[slot] = (key ^ data) & KEY_MASK
+        table[slot + 1] = data
+
+    #permille of sampled entries used by the current search, as UCI reports it
+    def hashfull(self):
+        sample = min(len(self.table) // 2, 1000)
+        used = 0
+        for i in range(sample):
+            data = self.table[2 * i + 1]
+            if data != 0 and (data >> 26) & 63 == self.age:
+                used += 1
+        return used * 1000 // sample
+
+    def stats(self):
+        return {
+            "sizeMb": self.sizeMb,
+            "entries": len(self.table) // 2,
+            "probes": self.probes,
+            "hits": self.hits,
+            "hitRate": self.hits / self.probes if self.probes else 0.0,
+            "collisions": self.collisions,
+            "stores": self.stores,
+            "overwrites": self.overwrites,
+            "hashfull": self.hashfull(),
+        }
+
+
+#Memo for GameState.getValidMoves keyed on the Zobrist key. Every slot is a fixed run of packed moves in one
+#flat array, so the memory bound is exact; a hit only wraps the packed ints back into Move objects
+class MoveListCache():
+    SLOT_MOVES = 256 #no legal position has more than 218 moves
+
+    def __init__(self, sizeMb=4):
+        slots = 1
+        while slots * 2 * (8 + 4 * self.SLOT_MOVES) <= sizeMb * 1024 * 1024:
+            slots *= 2
+        self.slotMask = slots - 1
+        self.keys = array('Q', [0]) * slots
+        self.counts = array('H', [0]) * slots
+        self.moves = array('I', [0]) * (slots * self.SLOT_MOVES)
+        self.filled = array('B', [0]) * slots
+        self.hits = 0
+        self.misses = 0
+
+    #same result as gs.getValidMoves(), including the checkMate and staleMate flags
+    def getValidMoves(self, gs):
+        key = gs.zobristKey
+        slot = key & self.slotMask
+        if self.filled[slot] and self.keys[slot] == key:
+            self.hits += 1
+            start = slot * self.SLOT_MOVES
+            fromPacked = Engine.Move.fromPacked
+            moves = [fromPacked(packed) for packed in self.moves[start:start + self.counts[slot]]]
+            if len(moves) == 0:
+                inCheck = gs.inCheck()
+                gs.checkMate, gs.staleMate = inCheck, not inCheck
+            else:
+                gs.checkMate = gs.staleMate = False
+            return moves
+        self.misses += 1
+        moves = gs.getValidMoves()
+        start = slot * self.SLOT_MOVES
+        for i, move in enumerate(moves):
+            self.moves[start + i] = move.packed
+        self.counts[slot] = len(moves)
+        self.keys[slot] = key
+        self.filled[slot] = 1
+        return moves
@@ -0,0 +1,300 @@
+# UCI front-end: lets tournament managers and GUIs (cutechess-cli, Arena, ...) play the engine over stdin/stdout
+# with no pygame anywhere in the process.
+#
+#   python uci.py
+#   cutechess-cli -engine cmd="python uci.py" -engine cmd=... -each proto=uci tc=40/60
+#
+# Commands are read on the main thread while a search runs on its own thread, so stop, isready and quit are
+# answered in the middle of a search. Besides the standard commands, "d" prints the FEN of the current position.
+
+import os
+import sys
+import threading
+
+import Engine
+import moveFinder
+import openingBook
+import parallelSearch
+import tablebase
+
+NAME = "Chess-Engine"
+AUTHOR = "the Chess-Engine authors"
+BACKEND = 'bitboard'
+DEFAULT_HASH_MB = 16
+MAX_HASH_MB = 1024
+MAX_THREADS = os.cpu_count() or 1
+MOVES_TO_GO = 30 #moves the remaining time is shared between when the GUI doesn't say
+MOVE_OVERHEAD = 0.05 #seconds kept back for the GUI and process overhead on every move
+BOOK_PATH = 'book.bin'
+TABLEBASE_PATH = 'tablebases'
+
+
+#the move of gs written as uci, e.g. e2e4 or e7e8q, or None when it isn't legal
+def parseMove(gs, uci, moves=None):
+    if moves is None:
+        moves = gs.getValidMoves()
+    uci = uci.lower()
+    for move in moves:
+        if move.getChessNotation() == uci:
+            return move
+    return None
+
+#'score cp 31' or 'score mate -3' for a score of moveFinder's, mates counted in moves rather than plies
+def formatScore(score):
+    if score > moveFinder.CHECKMATE - moveFinder.MAX_PLY:
+        return "score mate %d" % ((moveFinder.CHECKMATE - score + 1) // 2)
+    if score < -moveFinder.CHECKMATE + moveFinder.MAX_PLY:
+        return "score mate %d" % -((moveFinder.CHECKMATE + score) // 2)
+    return "score cp %d" % score
+
+#seconds to spend on this move from the go parameters, None when they set no clock
+def allocateTime(params, whiteToMove):
+    remaining = params.get('wtime' if whiteToMove else 'btime')
+    if remaining is None:
+        return None
+    increment = params.get('winc' if whiteToMove else 'binc', 0)
+    movesToGo = params.get('movestogo', MOVES_TO_GO)
+    budget = (remaining / max(movesToGo, 1) + increment * 0.8) / 1000
+    return max(0.01, min(budget, remaining / 1000 - MOVE_OVERHEAD))
+
+#gs played out again on a new GameState, history and all, for the search thread to make and undo moves on while
+#the main thread keeps reading gs (the d command)
+def copyPosition(gs):
+    copy = Engine.GameState(backend=BACKEND, fen=gs.startFen)
+    for move in gs.moveLog:
+        copy.makeMove(move)
+    return copy
+
+
+class UciEngine():
+    def __init__(self, output=sys.stdout):
+        self.output = output
+        self.outputLock = threading.Lock() #the search thread prints info and bestmove too
+        self.hashMb = DEFAULT_HASH_MB
+        self.threads = 1
+        self.searcher = None #made when first needed, so setoption Hash doesn't allocate a table twice
+        self.parallel = None
+        self.tablebases = tablebase.Tablebases(TABLEBASE_PATH) if os.path.isdir(TABLEBASE_PATH) else None
+        self.book = openingBook.OpeningBook(BOOK_PATH) if os.path.exists(BOOK_PATH) else None
+        self.useBook = self.book is not None
+        self.gs = Engine.GameState(backend=BACKEND)
+        self.searchThread = None
+        self.stopEvent = threading.Event()
+
+    def send(self, line):
+        with self.outputLock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    #handle one line of input. Returns False on quit
+    def handle(self, line):
+        words = line.split()
+        if not words:
+            return True
+        command, args = words[0], words[1:]
+        if command == 'uci':
+            self.send("id name %s" % NAME)
+            self.send("id author %s" % AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max %d" % (DEFAULT_HASH_MB, MAX_HASH_MB))
+            self.send("option name Threads type spin default 1 min 1 max %d" % MAX_THREADS)
+            self.send("option name OwnBook type check default %s" % ('true' if self.useBook else 'false'))
+            self.send("uciok")
+        elif command == 'isready':
+            self.send("readyok")
+        elif command == 'setoption':
+            self.waitSearch()
+            self.setOption(args)
+        elif command == 'ucinewgame':
+            self.waitSearch()
+            if self.searcher is not None:
+                self.searcher.tt.clear()
+                self.searcher.clearHeuristics()
+            if self.parallel is not None:
+                self.parallel.clear()
+            self.gs = Engine.GameState(backend=BACKEND)
+        elif command == 'position':
+            self.waitSearch()
+            self.setPosition(args)
+        elif command == 'go':
+            self.waitSearch()
+            self.go(args)
+        elif command == 'stop':
+            self.stopSearch()
+        elif command == 'ponderhit':
+            pass #pondering isn't offered, a GUI shouldn't send it
+        elif command == 'd':
+            self.send(self.gs.getFen())
+        elif command == 'quit':
+            return False
+        else:
+            self.send("info string unknown command %s" % command)
+        return True
+
+    #setoption name <id> [value <x>], where the name may have spaces
+    def setOption(self, args):
+        if 'name' not in args:
+            return
+        rest = args[args.index('name') + 1:]
+        if 'value' in rest:
+            name, value = ' '.join(rest[:rest.index('value')]), ' '.join(rest[rest.index('value') + 1:])
+        else:
+            name, value = ' '.join(rest), ''
+        name = name.lower()
+        try:
+            if name == 'hash':
+                self.hashMb = max(1, min(int(value), MAX_HASH_MB))
+                self.closeSearchers() #made again at the new size on the next go
+            elif name == 'threads':
+                self.threads = max(1, min(int(value), MAX_THREADS))
+                self.closeSearchers()
+            elif name == 'ownbook':
+                self.useBook = value.lower() == 'true' and self.book is not None
+            else:
+                self.send("info string unknown option %s" % name)
+        except ValueError:
+            self.send("info string bad value %s for option %s" % (value, name))
+
+    #position [startpos | fen <six fields>] [moves <move> ...]
+    def setPosition(self, args):
+        if not args:
+            return
+        if args[0] == 'startpos':
+            fen, rest = None, args[1:]
+        elif args[0] == 'fen':
+            end = args.index('moves') if 'moves' in args else len(args)
+            fen, rest = ' '.join(args[1:end]), args[end:]
+        else:
+            self.send("info string bad position command")
+            return
+        try:
+            gs = Engine.GameState(backend=BACKEND, fen=fen)
+        except ValueError as error:
+            self.send("info string bad fen: %s" % error)
+            return
+        if rest and rest[0] == 'moves':
+            for uci in rest[1:]:
+                move = parseMove(gs, uci)
+                if move is None:
+                    self.send("info string illegal move %s, position stops before it" % uci)
+                    break
+                gs.makeMove(move)
+        self.gs = gs
+
+    #go [depth n] [movetime ms] [nodes n] [wtime ms btime ms winc ms binc ms movestogo n] [infinite]
+    def go(self, args):
+        params = {}
+        infinite = False
+        i = 0
+        while i < len(args):
+            word = args[i]
+            if word == 'infinite':
+                infinite = True
+            elif word in ('depth', 'movetime', 'nodes', 'wtime', 'btime', 'winc', 'binc', 'movestogo') and i + 1 < len(args):
+                try:
+                    params[word] = int(args[i + 1])
+                except ValueError:
+                    pass
+                i += 1
+            i += 1
+        movetime = params['movetime'] / 1000 if 'movetime' in params else None
+        if not infinite and movetime is None:
+            movetime = allocateTime(params, self.gs.whiteToMove)
+        limits = {'depth': params.get('depth'), 'movetime': None if infinite else movetime,
+                  'nodes': params.get('nodes')}
+        self.stopEvent.clear()
+        self.searchThread = threading.Thread(target=self.searchMain, args=(copyPosition(self.gs), limits, infinite), daemon=True)
+        self.searchThread.start()
+
+    def searchMain(self, gs, limits, infinite):
+        bestMove = None
+        if self.useBook and not infinite:
+            move = self.book.pickMove(gs)
+            if move is not None:
+                bestMove = move.getChessNotation()
+                self.send("info string book move")
+        if bestMove is None:
+            if self.threads > 1:
+                bestMove = self.searchParallel(gs, limits)
+            else:
+                bestMove = self.searchSingle(gs, limits)
+        if infinite:
+            self.stopEvent.wait() #bestmove only after stop, even when the search ran out of depth
+        self.send("bestmove %s" % (bestMove or '0000'))
+
+    def searchSingle(self, gs, limits):
+        if self.searcher is None:
+            self.searcher = moveFinder.Searcher(self.hashMb, tablebases=self.tablebases)
+        def onIteration(result):
+            self.sendInfo(result.depth, result.score, result.nodes, result.seconds, self.searcher.tt.hashfull(),
+                          [move.getChessNotation() for move in result.pv])
+        result = self.searcher.search(gs, stopEvent=self.stopEvent, onIteration=onIteration, **limits)
+        return result.bestMove.getChessNotation() if result.bestMove else None
+
+    #the helpers report nothing until they are done, so there is a single info line at the end
+    def searchParallel(self, gs, limits):
+        if self.parallel is None:
+            self.parallel = parallelSearch.ParallelSearcher(self.threads, self.hashMb, BACKEND)
+        done = threading.Event()
+        stopper = threading.Thread(target=self.forwardStop, args=(self.parallel, done), daemon=True)
+        stopper.start()
+        try:
+            result = self.parallel.search(gs, **limits)
+        except RuntimeError as error: #no worker came back, answer from this process rather than not at all
+            self.send("info string parallel search failed: %s" % error)
+            self.parallel.close()
+            self.parallel = None
+            return self.searchSingle(gs, limits)
+        finally:
+            done.set()
+        self.sendInfo(result.depth, result.score, result.nodes, result.seconds, self.parallel.tt.hashfull(), result.pv)
+        return result.bestMove
+
+    #pass our stop on to the parallel workers, until the search is over one way or another
+    def forwardStop(self, parallel, done):
+        while not self.stopEvent.wait(0.01):
+            if done.is_set():
+                return
+        if not done.is_set():
+            parallel.stop()
+
+    def sendInfo(self, depth, score, nodes, seconds, hashfull, pv):
+        self.send("info depth %d %s nodes %d nps %d time %d hashfull %d pv %s" % (
+            depth, formatScore(score), nodes, int(nodes / seconds) if seconds > 0 else 0, int(seconds * 1000),
+            hashfull, ' '.join(pv)))
+
+    def stopSearch(self):
+        self.stopEvent.set()
+        self.waitSearch()
+
+    #a new command that changes the state waits for the search before it; the GUI should have sent stop
+    def waitSearch(self):
+        if self.searchThread is not None:
+            self.searchThread.join()
+            self.searchThread = None
+
+    def closeSearchers(self):
+        self.searcher = None
+        if self.parallel is not None:
+            self.parallel.close()
+            self.parallel = None
+
+    def close(self):
+        self.closeSearchers()
+        if self.book is not None:
+            self.book.close()
+
+
+def main():
+    engine = UciEngine()
+    try:
+        for line in sys.stdin:
+            if not engine.handle(line):
+                break
+    finally:
+        engine.stopSearch()
+        engine.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,30 @@
+# Zobrist keys: every (piece, square), the side to move, each castling rights combination and each en passant
+# file gets a random 64 bit number, and a position's key is the XOR of the numbers for everything in it.
+# A move only touches a few of those, so GameState keeps the key up to date in makeMove instead of hashing
+# the whole board. The numbers come from a fixed seed so keys are the same in every process and every run,
+# which anything stored on disk or shared between processes relies on.
+
+import random
+
+PIECES = ('wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK')
+
+_random = random.Random(0x2C0B1257)
+PIECE_KEYS = {piece: [_random.getrandbits(64) for _ in range(64)] for piece in PIECES} #indexed by row*8 + col
+PIECE_KEYS['--'] = [0] * 64 #empty squares don't change the key, saves a branch on captures
+SIDE_KEY = _random.getrandbits(64) #XORed in when black is to move
+CASTLING_KEYS = [_random.getrandbits(64) for _ in range(16)] #indexed by GameState.castlingRights
+ENPASSANT_KEYS = [_random.getrandbits(64) for _ in range(8)] #indexed by the file of the en passant square
+
+
+#key of the position in gs, built from scratch
+def computeKey(gs):
+    key = 0
+    for r in range(8):
+        for c in range(8):
+            key ^= PIECE_KEYS[gs.board[r][c]][r * 8 + c]
+    if not gs.whiteToMove:
+        key ^= SIDE_KEY
+    key ^= CASTLING_KEYS[gs.castlingRights]
+    if gs.enpassantPossible:
+        key ^= ENPASSANT_KEYS[gs.enpassantPossible[1]]
+    return key